@@ -26,6 +26,7 @@
 
         app = p2nix.mkPoetryApplication {
           projectDir = ./.;
+          extras = [ "images" "compress" ];
           overrides =
             [ p2nix.defaultPoetryOverrides customOverrides ];
           postFixup = ''
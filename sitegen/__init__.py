@@ -1,18 +1,36 @@
+from typing import Any, Dict, Final, List, Optional, Tuple
+
 from pathlib import Path
-import os
 import shutil
 
-import pandoc
+from . import build, profile
+from .convert import (
+    PANDOC_PATH_ENV,
+    ConversionCache,
+    configure_pandoc,
+    start_backend
+)
+from .manifest import BuildManifest
+from .writer import PageWriter
+
 
-from . import build
+TRACE_PATH: Path = build.CACHE_DIR / "trace.json"
 
+# The build stages each target of `build_target` runs
+TARGETS: Final[Dict[str, Tuple[str, ...]]] = {
+    "static": ("static",),
+    "pages": ("pages",),
+    "posts": ("blog", "search"),
+    "projects": ("projects",),
+    "games": ("games",),
+    "search": ("search",)
+}
 
-PANDOC_PATH_ENV = 'PANDOC_BINARY'
 
+def build_test(jobs: int = 1, pandoc_mode: str = "auto"):
+    from .registry import TemplateRegistry
 
-def build_test():
-    if pandoc_path := os.environ.get(PANDOC_PATH_ENV):
-        pandoc.configure(path=pandoc_path)
+    configure_pandoc()
 
     test_build_dir: Path = Path("tests/site")
     test_src_dir: Path = Path("tests/src")
@@ -20,40 +38,314 @@ def build_test():
     if test_build_dir.exists():
         shutil.rmtree("tests/site")
     build.make_build_dir(test_build_dir)
+
+    templates: TemplateRegistry = TemplateRegistry(build.TEMPLATE_DIR)
     
     build.copy_static(Path("site_src/static"), test_build_dir)
     build.build_pages(
         build_dir=test_build_dir,
+        templates=templates,
         src_dir=test_src_dir,
     )
 
-    blog_posts: List[build.PostBuildData] = build.build_blog(
-        post_src_dir=Path("tests/test_posts"),
-        post_build_dir=Path("posts"),
-        site_build_dir=test_build_dir,
-        verbose=True
+    backend: Optional[Any] = start_backend(pandoc_mode, verbose=True)
+
+    try:
+        blog_posts: List[build.PostBuildData] = build.build_blog(
+            post_src_dir=Path("tests/test_posts"),
+            post_build_dir=Path("posts"),
+            site_build_dir=test_build_dir,
+            templates=templates,
+            backend=backend,
+            jobs=jobs,
+            verbose=True
+        )
+
+        build.build_projects(
+            posts=blog_posts,
+            projects_src_dir=Path("tests/test_projects"),
+            templates=templates,
+            site_src_dir=test_src_dir,
+            site_build_dir=test_build_dir,
+            posts_build_dir=Path("posts"),
+            projects_build_dir=Path("projects"),
+            backend=backend,
+            jobs=jobs,
+            verbose=True
+        )
+    finally:
+        if backend is not None:
+            backend.close()
+
+
+def build_production(incremental: bool = False,
+                     jobs: int = 1,
+                     pandoc_mode: str = "auto",
+                     minify: bool = False,
+                     profile_build: bool = False,
+                     page_size: int = build.POSTS_PER_PAGE):
+    r"""Builds the site into `site_out`.
+
+    A full build cleans the output first. An incremental build keeps the
+    previous output and uses its build manifest to only redo the work whose
+    inputs changed. Posts and projects are converted across `jobs` worker
+    processes, with the pandoc backend selected by `pandoc_mode` (see
+    `convert.start_backend`). With `minify` pages, CSS and JavaScript are
+    minified as they are written. Blog and tag listings show `page_size`
+    posts per page.
+
+    With `profile_build` the build is traced: a summary of the time spent
+    in each stage and the slowest documents is printed, and the full trace
+    is written to `TRACE_PATH` for chrome://tracing or Perfetto.
+    """
+    from .catalogue import MetadataCatalogue
+    from .registry import TemplateRegistry
+
+    configure_pandoc()
+    if profile_build:
+        profile.start()
+
+    writer: PageWriter = PageWriter(
+        minify=minify,
+        cache_dir=build.CACHE_DIR / "minify",
+        background=True
+    )
+    manifest: BuildManifest
+    if incremental:
+        manifest = build.load_manifest(writer.settings(), verbose=True)
+    else:
+        build.clean()
+        manifest = BuildManifest(build.BUILD_DIR)
+        manifest.settings = writer.settings()
+    
+    cache: ConversionCache = ConversionCache(build.CACHE_DIR / "pandoc")
+    templates: TemplateRegistry = TemplateRegistry(
+        build.TEMPLATE_DIR,
+        cache_dir=build.CACHE_DIR / "jinja"
+    )
+    catalogue: MetadataCatalogue = MetadataCatalogue(build.CATALOGUE_PATH)
+    backend: Optional[Any] = start_backend(pandoc_mode, verbose=True)
+    
+    # A failed build must not leave the profiler recording
+    profiler: Optional[profile.Profiler] = None
+    try:
+        build.build_site(
+            templates=templates,
+            manifest=manifest,
+            cache=cache,
+            backend=backend,
+            jobs=jobs,
+            writer=writer,
+            page_size=page_size,
+            catalogue=catalogue,
+            verbose=True
+        )
+    finally:
+        if backend is not None:
+            backend.close()
+        catalogue.close()
+        writer.close()
+        profiler = profile.stop()
+    print(f"Wrote {writer.written} pages, {writer.unchanged} unchanged")
+
+    manifest.save()
+
+    if profiler is not None:
+        profiler.write_trace(TRACE_PATH)
+        print(profiler.summary())
+        print(f"Wrote build trace to {TRACE_PATH}")
+
+
+def build_target(target: str,
+                 only: Tuple[str, ...] = (),
+                 jobs: int = 1,
+                 pandoc_mode: str = "auto",
+                 minify: bool = False,
+                 page_size: int = build.POSTS_PER_PAGE,
+                 verbose: bool = True) -> None:
+    r"""Rebuilds one part of the site, `target` is a key of `TARGETS`, in
+    the output of an earlier build.
+
+    Other outputs are left alone and the manifest skips the target's up to
+    date outputs as in an incremental build, then new static files are
+    fingerprinted and the changed outputs compressed. With `target`
+    "posts", `only` names post directories to convert and write on their
+    own, see `build.rebuild_posts`. The pandoc backend is only started when
+    the target converts documents.
+
+    Raises `ValueError` when the earlier build used other settings, which
+    only a full build may change.
+    """
+    from .catalogue import MetadataCatalogue
+    from .registry import TemplateRegistry
+
+    configure_pandoc()
+
+    writer: PageWriter = PageWriter(
+        minify=minify,
+        cache_dir=build.CACHE_DIR / "minify",
+        background=True
+    )
+    manifest: BuildManifest = BuildManifest.load(build.BUILD_DIR)
+    if manifest.entries and manifest.settings != writer.settings():
+        raise ValueError(
+            f"{build.BUILD_DIR} was built with other settings, run a full "
+            "build to change them"
+        )
+    manifest.settings = writer.settings()
+
+    stages: Tuple[str, ...] = TARGETS[target]
+    cache: ConversionCache = ConversionCache(build.CACHE_DIR / "pandoc")
+    templates: TemplateRegistry = TemplateRegistry(
+        build.TEMPLATE_DIR,
+        cache_dir=build.CACHE_DIR / "jinja"
     )
+    catalogue: MetadataCatalogue = MetadataCatalogue(build.CATALOGUE_PATH)
+    backend: Optional[Any] = None
+    if any(stage in ("blog", "projects", "search") for stage in stages):
+        backend = start_backend(pandoc_mode, verbose=verbose)
+
+    try:
+        if only:
+            build.rebuild_posts(
+                only,
+                templates=templates,
+                manifest=manifest,
+                cache=cache,
+                backend=backend,
+                jobs=jobs,
+                writer=writer,
+                verbose=verbose
+            )
+            stages = ("search",)
+        build.build_site(
+            stages=(*stages, "assets", "compress"),
+            templates=templates,
+            manifest=manifest,
+            cache=cache,
+            backend=backend,
+            jobs=jobs,
+            writer=writer,
+            page_size=page_size,
+            catalogue=catalogue,
+            verbose=verbose
+        )
+    finally:
+        if backend is not None:
+            backend.close()
+        catalogue.close()
+        writer.close()
+    print(f"Wrote {writer.written} pages, {writer.unchanged} unchanged")
+
+    manifest.save()
+
+
+def build_shard(shard: str,
+                out_dir: Optional[Path] = None,
+                jobs: int = 1,
+                pandoc_mode: str = "auto",
+                minify: bool = False,
+                verbose: bool = True) -> Path:
+    r"""Builds shard `shard`, given as `i/N`, of the posts and projects into
+    `out_dir`, by default a directory of `shard.SHARDS_DIR`. Returns the
+    directory, which `merge_build` takes with those of the other shards.
+
+    Each shard is a separate process, or CI runner, with its own pandoc
+    backend. They share the caches in `build.CACHE_DIR` when run on one
+    machine.
+    """
+    from .registry import TemplateRegistry
+    from .shard import ShardSpec, parse_shard, shard_dir
+    from .shard import build_shard as build_one_shard
 
-    build.build_projects(
-        posts=blog_posts,
-        projects_src_dir=Path("tests/test_projects"),
-        site_src_dir=test_src_dir,
-        site_build_dir=test_build_dir,
-        posts_build_dir=Path("posts"),
-        projects_build_dir=Path("projects"),
-        verbose=True
+    spec: ShardSpec = parse_shard(shard)
+    if out_dir is None:
+        out_dir = shard_dir(spec)
+    configure_pandoc()
+
+    writer: PageWriter = PageWriter(
+        minify=minify,
+        cache_dir=build.CACHE_DIR / "minify",
+        background=True
+    )
+    cache: ConversionCache = ConversionCache(build.CACHE_DIR / "pandoc")
+    templates: TemplateRegistry = TemplateRegistry(
+        build.TEMPLATE_DIR,
+        cache_dir=build.CACHE_DIR / "jinja"
     )
+    backend: Optional[Any] = start_backend(pandoc_mode, verbose=verbose)
 
+    try:
+        build_one_shard(
+            spec,
+            out_dir,
+            templates=templates,
+            cache=cache,
+            backend=backend,
+            jobs=jobs,
+            writer=writer,
+            verbose=verbose
+        )
+    finally:
+        if backend is not None:
+            backend.close()
+        writer.close()
+    print(f"Wrote {writer.written} pages of shard {spec} to {out_dir}")
+    return out_dir
 
-def build_production(): 
-    if pandoc_path := os.environ.get(PANDOC_PATH_ENV):
-        pandoc.configure(path=pandoc_path)
 
-    build.clean()
-    
-    build.copy_static()
-    build.build_pages()
-    blog_posts: List[build.PostBuildData] = build.build_blog(verbose=True)
-    build.build_projects(blog_posts, verbose=True)
-    build.build_games()
+def merge_build(shard_dirs: List[Path],
+                jobs: int = 1,
+                minify: bool = False,
+                page_size: int = build.POSTS_PER_PAGE,
+                verbose: bool = True) -> None:
+    r"""Builds `site_out` from the shards `build_shard` wrote to
+    `shard_dirs`: the output is cleaned, the static files, pages and games
+    are built as in a full build, the shards are merged, see
+    `shard.merge_shards`, and then the static files are fingerprinted and
+    everything is compressed. Nothing is converted with pandoc.
+
+    Raises `ValueError`, before anything is cleaned, when the shards are
+    incomplete or were built with other settings. The merged site has no
+    build manifest, so the next incremental build starts over.
+    """
+    from .registry import TemplateRegistry
+    from .shard import load_fragments, merge_shards
 
+    writer: PageWriter = PageWriter(
+        minify=minify,
+        cache_dir=build.CACHE_DIR / "minify",
+        background=True
+    )
+    templates: TemplateRegistry = TemplateRegistry(
+        build.TEMPLATE_DIR,
+        cache_dir=build.CACHE_DIR / "jinja"
+    )
+
+    fragments = load_fragments(shard_dirs, writer.settings())
+
+    build.clean()
+    try:
+        build.build_site(
+            stages=("static", "pages", "games"),
+            templates=templates,
+            writer=writer,
+            verbose=verbose
+        )
+        merge_shards(
+            fragments,
+            templates=templates,
+            page_size=page_size,
+            jobs=jobs,
+            writer=writer,
+            verbose=verbose
+        )
+        build.build_site(
+            stages=("assets", "compress"),
+            templates=templates,
+            writer=writer,
+            verbose=verbose
+        )
+    finally:
+        writer.close()
+    print(f"Merged {len(shard_dirs)} shards, wrote {writer.written} pages")
@@ -0,0 +1,502 @@
+from typing import Any, Dict, Final, List, NamedTuple, Optional, Tuple
+
+import os
+
+from pathlib import Path
+
+import json
+
+import posixpath
+
+import re
+
+from urllib.parse import unquote
+
+from .manifest import hash_bytes, hash_file
+from .sync import copy_file
+
+
+ASSETS_DIR_NAME: Final[str] = "assets"
+# Public map of logical to fingerprinted paths, in the assets directory
+ASSET_MANIFEST_NAME: Final[str] = "manifest.json"
+# Bumped whenever fingerprinting changes, older state is discarded
+ASSETS_VERSION: Final[str] = "3"
+HASH_LENGTH: Final[int] = 16
+
+# Directories whose files are fingerprinted, wherever they are in the site
+ASSET_DIR_NAMES: Final[Tuple[str, ...]] = ("static",)
+# Top level directories left alone, the games' scripts build the URLs of
+# their images at runtime
+EXCLUDED_DIRS: Final[Tuple[str, ...]] = ("games", ASSETS_DIR_NAME)
+SKIPPED_SUFFIXES: Final[Tuple[str, ...]] = (".gz", ".br")
+
+_HTML_REFERENCE: Final[re.Pattern] = re.compile(
+    r"""\b(src|href|poster|data|srcset)=(["'])(.*?)\2""",
+    re.IGNORECASE | re.DOTALL
+)
+_CSS_REFERENCE: Final[re.Pattern] = re.compile(
+    r"""url\(\s*(["']?)([^"')]+)\1\s*\)"""
+)
+_EXTERNAL: Final[re.Pattern] = re.compile(r"^([a-zA-Z][\w+.-]*:|//|#)")
+
+
+class AssetReport(NamedTuple):
+    # Originals stored under a new hash this run
+    changed: int
+    # Distinct files in the store
+    stored: int
+    # Bytes of originals moved out of the output this run
+    saved: int
+    pages: int
+
+    def __str__(self) -> str:
+        return (
+            f"Assets: {self.changed} files fingerprinted, {self.stored} "
+            f"stored, {self.saved} bytes of originals removed, {self.pages} "
+            f"pages rewritten"
+        )
+
+
+def asset_name(digest: str, suffix: str) -> str:
+    return f"{ASSETS_DIR_NAME}/{digest[:HASH_LENGTH]}{suffix.lower()}"
+
+
+def is_asset(logical: str) -> bool:
+    r"""Whether the file at the site relative path `logical` is
+    fingerprinted.
+    """
+    parts: List[str] = logical.split("/")
+    return parts[0] not in EXCLUDED_DIRS \
+        and any(part in ASSET_DIR_NAMES for part in parts[:-1]) \
+        and not logical.endswith(SKIPPED_SUFFIXES)
+
+
+def _split_link(link: str) -> Tuple[str, str]:
+    r"""Separates the path of a link from its query and fragment."""
+    for separator in ("?", "#"):
+        if separator in link:
+            index: int = link.index(separator)
+            return link[:index], link[index:]
+    return link, ""
+
+
+def resolve_link(link: str, directory: str) -> Optional[str]:
+    r"""The site relative path a link on a page in `directory` points to,
+    `None` for external links, fragments and links leaving the site.
+    """
+    link = link.strip()
+    if not link or _EXTERNAL.match(link):
+        return None
+    path, _ = _split_link(link)
+    path = unquote(path)
+    joined: str = path.lstrip("/") if path.startswith("/") \
+        else posixpath.join(directory, path)
+    resolved: str = posixpath.normpath(joined)
+    if resolved.startswith("..") or resolved == ".":
+        return None
+    return resolved
+
+
+def relative_link(target: str, directory: str) -> str:
+    return posixpath.relpath(target, directory or ".")
+
+
+def rewrite_links(text: str,
+                  pattern: re.Pattern,
+                  directory: str,
+                  mapping: Dict[str, str],
+                  used: Dict[str, str],
+                  new_directory: Optional[str] = None) -> str:
+    r"""Replaces the links matched by `pattern` in `text`, a document in
+    `directory`, to paths in `mapping` with links to what they map to. The
+    replaced links are added to `used`, keyed by the logical path.
+
+    With `new_directory`, where the document is moving to, every link
+    within the site is made relative to it.
+    """
+    def replace_link(link: str) -> str:
+        logical: Optional[str] = resolve_link(link, directory)
+        if logical is None:
+            return link
+        target: Optional[str] = mapping.get(logical)
+        if target is not None:
+            used[logical] = target
+        elif new_directory is None:
+            return link
+        else:
+            target = logical
+        return relative_link(target, new_directory or directory) \
+            + _split_link(link.strip())[1]
+
+    def replace(match: re.Match) -> str:
+        if pattern is _CSS_REFERENCE:
+            quote, link = match.groups()
+            return f"url({quote}{replace_link(link)}{quote})"
+        attribute, quote, value = match.groups()
+        if attribute.lower() == "srcset":
+            value = ", ".join(
+                " ".join([replace_link(candidate.split()[0]),
+                          *candidate.split()[1:]])
+                for candidate in value.split(",") if candidate.strip()
+            )
+        else:
+            value = replace_link(value)
+        return f"{attribute}={quote}{value}{quote}"
+
+    return pattern.sub(replace, text)
+
+
+def _replace_file(path: Path, data: bytes) -> None:
+    tmp_path: Path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+class AssetStore:
+    r"""Content addressed store of the site's static files.
+
+    `fingerprint` moves every file under a `static` directory of the build
+    into `assets/`, named by the hash of its contents, so identical files
+    are stored once and every stored file can be cached forever. Links to
+    the original paths in the pages and stylesheets are rewritten to the
+    stored files. `assets/manifest.json` maps each original path to its
+    stored file.
+
+    The mtime and size each original had when it was moved are kept in
+    `state_path`. Syncs given `moved` count those files as still in the
+    build, so only changed files are copied and hashed again, and a file
+    whose source is gone is forgotten along with its stored copy.
+
+    Pages are rewritten in place. Which stored files each page and
+    stylesheet links to is kept in `state_path` as well, so a page a later
+    build does not render again is still updated when a file it links to
+    changes.
+
+    Arguments
+    ---------
+
+    build_dir: The site build directory
+
+    state_path: File the moved originals and the links of each rewritten
+    page are kept in
+
+    """
+
+    def __init__(self, build_dir: Path, state_path: Path) -> None:
+        self.build_dir: Path = build_dir
+        self.state_path: Path = state_path
+        self.assets_dir: Path = build_dir / ASSETS_DIR_NAME
+        # Logical path to stored path, both relative to the build directory
+        self.mapping: Dict[str, str] = {}
+        # Page path to its mtime, size and the stored files it links to
+        self.pages: Dict[str, Dict[str, Any]] = {}
+        # Logical path to the mtime and size of the original, its stored
+        # copy and for stylesheets the stored files it links to
+        self.files: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def load(cls, build_dir: Path, state_path: Path) -> "AssetStore":
+        store: AssetStore = cls(build_dir, state_path)
+        try:
+            with open(store.assets_dir / ASSET_MANIFEST_NAME, 'r') as file:
+                store.mapping = json.load(file)["assets"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return store
+        try:
+            with open(state_path, 'r') as file:
+                state: Dict[str, Any] = json.load(file)
+            if state.get("version") == ASSETS_VERSION \
+                    and state.get("build_dir") == str(build_dir):
+                store.pages = state["pages"]
+                store.files = state["files"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return store
+
+    def save(self) -> None:
+        self.assets_dir.mkdir(parents=True, exist_ok=True)
+        _replace_file(
+            self.assets_dir / ASSET_MANIFEST_NAME,
+            json.dumps(
+                {"version": ASSETS_VERSION, "assets": self.mapping},
+                indent=1,
+                sort_keys=True
+            ).encode('utf-8')
+        )
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        _replace_file(
+            self.state_path,
+            json.dumps({
+                "version": ASSETS_VERSION,
+                "build_dir": str(self.build_dir),
+                "pages": self.pages,
+                "files": self.files
+            }).encode('utf-8')
+        )
+
+    def locate(self, path: Path) -> Path:
+        r"""Where the contents of the build output `path` are, the stored
+        file when the original is not there.
+        """
+        if path.exists():
+            return path
+        logical: str = Path(os.path.relpath(path, self.build_dir)).as_posix()
+        stored: Optional[str] = self.mapping.get(logical)
+        return self.build_dir / stored if stored is not None else path
+
+    def moved(self, dest_dir: Path) -> Dict[str, Tuple[int, int]]:
+        r"""The originals `fingerprint` moved out of `dest_dir`, by path
+        relative to it, with the mtime and size they had, see
+        `sync.sync_tree`.
+        """
+        prefix: str = Path(
+            os.path.relpath(dest_dir, self.build_dir)
+        ).as_posix() + "/"
+        return {
+            os.path.normpath(logical[len(prefix):]): tuple(record["stat"])
+            for logical, record in self.files.items()
+            if logical.startswith(prefix)
+            and (self.build_dir / record["stored"]).is_file()
+        }
+
+    def forget(self, paths: List[Path]) -> None:
+        r"""Drops the originals at `paths` whose source is gone, their
+        stored copies are removed by the next `fingerprint`.
+        """
+        forgotten: bool = False
+        for path in paths:
+            logical: str = Path(
+                os.path.relpath(path, self.build_dir)
+            ).as_posix()
+            if self.files.pop(logical, None) is not None:
+                self.mapping.pop(logical, None)
+                forgotten = True
+        if forgotten:
+            self.save()
+
+    def _originals(self) -> List[str]:
+        originals: List[str] = []
+        for directory, _, files in os.walk(self.build_dir):
+            relative: str = Path(
+                os.path.relpath(directory, self.build_dir)
+            ).as_posix()
+            for name in files:
+                logical: str = posixpath.normpath(
+                    posixpath.join(relative, name)
+                )
+                if is_asset(logical):
+                    originals.append(logical)
+        return sorted(originals)
+
+    def _kept(self, logical: str) -> bool:
+        r"""Whether the original at `logical`, moved out by an earlier run,
+        is still part of the site: its stored copy is there and so is its
+        directory, which goes once its post or project is removed.
+        """
+        record: Dict[str, Any] = self.files[logical]
+        return (self.build_dir / record["stored"]).is_file() \
+            and (self.build_dir / logical).parent.is_dir()
+
+    def _stale(self, links: Dict[str, str]) -> Dict[str, str]:
+        r"""Maps the stored files in `links` whose original has been stored
+        under a new hash since to the new stored file.
+        """
+        return {
+            stored: self.mapping[logical]
+            for logical, stored in links.items()
+            if self.mapping.get(logical, stored) != stored
+        }
+
+    def _relinked(self, links: Dict[str, str]) -> Dict[str, str]:
+        return {
+            logical: self.mapping.get(logical, stored)
+            for logical, stored in links.items()
+        }
+
+    def _store(self,
+               logical: str,
+               data: Optional[bytes] = None,
+               links: Optional[Dict[str, str]] = None) -> bool:
+        r"""Maps the original at `logical` to its copy in the store, with
+        `data` as the copy's contents when given. An original without
+        `data` whose mtime and size did not change since the last run keeps
+        its copy without being hashed. Returns whether it is stored under a
+        new hash.
+        """
+        path: Path = self.build_dir / logical
+        record: Optional[Dict[str, Any]] = self.files.get(logical)
+        if path.exists():
+            stat: os.stat_result = path.stat()
+            key: List[int] = [stat.st_mtime_ns, stat.st_size]
+        else:
+            # Moved out by an earlier run, its contents given as `data`
+            key = record["stat"]
+        if data is None and record is not None and record["stat"] == key \
+                and (self.build_dir / record["stored"]).is_file():
+            self.mapping[logical] = record["stored"]
+            return False
+
+        digest: str = hash_bytes(data) if data is not None \
+            else hash_file(path)
+        stored: str = asset_name(digest, path.suffix)
+        out_path: Path = self.build_dir / stored
+        if not out_path.exists():
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+            if data is not None:
+                _replace_file(out_path, data)
+            else:
+                # A copy, the original may be a hardlink to the source
+                copy_file(path, out_path)
+        self.mapping[logical] = stored
+        self.files[logical] = {"stat": key, "stored": stored}
+        if links is not None:
+            self.files[logical]["links"] = links
+        return record is None or record["stored"] != stored
+
+    def _store_stylesheet(self, logical: str, moved: bool) -> bool:
+        r"""Stores the stylesheet at `logical` with its links rewritten.
+        One `moved` out by an earlier run has the links in its stored copy
+        to files stored under a new hash since rewritten.
+        """
+        if not moved:
+            with open(self.build_dir / logical, 'r',
+                      encoding='utf-8') as file:
+                text: str = file.read()
+            links: Dict[str, str] = {}
+            text = rewrite_links(
+                text,
+                _CSS_REFERENCE,
+                posixpath.dirname(logical),
+                self.mapping,
+                links,
+                new_directory=ASSETS_DIR_NAME
+            )
+            return self._store(logical, text.encode('utf-8'), links)
+
+        record: Dict[str, Any] = self.files[logical]
+        mapping: Dict[str, str] = self._stale(record.get("links", {}))
+        if not mapping:
+            self.mapping[logical] = record["stored"]
+            return False
+        with open(self.build_dir / record["stored"], 'r',
+                  encoding='utf-8') as file:
+            text = file.read()
+        text = rewrite_links(
+            text,
+            _CSS_REFERENCE,
+            ASSETS_DIR_NAME,
+            mapping,
+            {}
+        )
+        return self._store(
+            logical,
+            text.encode('utf-8'),
+            self._relinked(record["links"])
+        )
+
+    def _rewrite_page(self, page: str) -> bool:
+        path: Path = self.build_dir / page
+        stat: os.stat_result = path.stat()
+        record: Optional[Dict[str, Any]] = self.pages.get(page)
+        directory: str = posixpath.dirname(page)
+
+        with open(path, 'r', encoding='utf-8') as file:
+            text: str = file.read()
+        if record is not None \
+                and record["stat"] == [stat.st_mtime_ns, stat.st_size]:
+            # Our own output, only links to files that changed since
+            mapping: Dict[str, str] = self._stale(record["links"])
+            if not mapping:
+                return False
+            text = rewrite_links(
+                text,
+                _HTML_REFERENCE,
+                directory,
+                mapping,
+                {}
+            )
+            links: Dict[str, str] = self._relinked(record["links"])
+        else:
+            links = {}
+            new_text: str = rewrite_links(
+                text,
+                _HTML_REFERENCE,
+                directory,
+                self.mapping,
+                links
+            )
+            if new_text == text:
+                self.pages.pop(page, None)
+                return False
+            text = new_text
+
+        _replace_file(path, text.encode('utf-8'))
+        stat = path.stat()
+        self.pages[page] = {
+            "stat": [stat.st_mtime_ns, stat.st_size],
+            "links": links
+        }
+        return True
+
+    def fingerprint(self, verbose: bool = False) -> AssetReport:
+        r"""Moves the originals synced into the build since the last run
+        into the store, then rewrites the pages and drops stored files
+        nothing maps to any more.
+        """
+        originals: List[str] = self._originals()
+        present: set = set(originals)
+        moved: set = {
+            logical for logical in self.files
+            if logical not in present and self._kept(logical)
+        }
+        self.files = {
+            logical: record for logical, record in self.files.items()
+            if logical in present or logical in moved
+        }
+        self.mapping = {}
+        changed: int = 0
+        # Stylesheets link other assets, so they are stored last with their
+        # links rewritten
+        for logical in sorted(present | moved):
+            if logical.endswith(".css"):
+                continue
+            if logical in moved:
+                self.mapping[logical] = self.files[logical]["stored"]
+            else:
+                changed += self._store(logical)
+        for logical in sorted(present | moved):
+            if logical.endswith(".css"):
+                changed += self._store_stylesheet(logical, logical in moved)
+
+        pages: int = 0
+        for path in sorted(self.build_dir.rglob("*.html")):
+            page: str = path.relative_to(self.build_dir).as_posix()
+            if page.split("/")[0] == ASSETS_DIR_NAME:
+                continue
+            if self._rewrite_page(page):
+                pages += 1
+        self.pages = {
+            page: record for page, record in self.pages.items()
+            if (self.build_dir / page).is_file()
+        }
+
+        removed: int = 0
+        for logical in originals:
+            path: Path = self.build_dir / logical
+            removed += path.stat().st_size
+            os.remove(path)
+
+        kept: set = set(self.mapping.values())
+        if self.assets_dir.is_dir():
+            for path in self.assets_dir.iterdir():
+                name: str = f"{ASSETS_DIR_NAME}/{path.name}"
+                if path.name != ASSET_MANIFEST_NAME and name not in kept \
+                        and not path.name.endswith(SKIPPED_SUFFIXES):
+                    os.remove(path)
+
+        report: AssetReport = AssetReport(changed, len(kept), removed, pages)
+        self.save()
+        if verbose:
+            print(report)
+        return report
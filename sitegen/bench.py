@@ -0,0 +1,406 @@
+from typing import Any, Dict, Final, List, NamedTuple, Optional
+
+import os
+
+from pathlib import Path
+
+import shutil
+
+import json
+
+import platform
+
+import random
+
+import struct
+
+import tempfile
+
+import zlib
+
+import datetime
+
+from . import build, profile
+from .convert import ConversionCache, configure_pandoc, start_backend
+from .manifest import BuildManifest
+from .registry import TemplateRegistry
+from .writer import PageWriter
+
+
+BENCH_VERSION: Final[int] = 1
+# Spans reported for every run, in the order they are printed
+BENCH_STAGES: Final[List[str]] = [
+    "copy_static",
+    "build_blog",
+    "build_blog_page",
+    "build_tags_pages",
+    "build_projects",
+    "pandoc"
+]
+# Regressions smaller than this many seconds are taken to be noise
+MIN_REGRESSION: Final[float] = 0.05
+
+_WORDS: Final[List[str]] = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua ut enim ad minim "
+    "veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea "
+    "commodo consequat"
+).split()
+
+
+class CorpusConfig(NamedTuple):
+    r"""Shape of a synthetic site.
+
+    Arguments
+    ---------
+
+    posts: Number of blog posts
+
+    tags: Number of distinct tags
+
+    tags_per_post: Tags on each post
+
+    projects: Number of projects
+
+    projects_per_post: Projects each post belongs to
+
+    static_files: Number of files in the site's static directory
+
+    static_size: Size in bytes of each static file
+
+    paragraphs: Paragraphs in each post and project document
+
+    seed: Seed of the random choices, equal configs give equal corpora
+
+    """
+    posts: int = 100
+    tags: int = 20
+    tags_per_post: int = 3
+    projects: int = 10
+    projects_per_post: int = 1
+    static_files: int = 50
+    static_size: int = 16384
+    paragraphs: int = 5
+    seed: int = 0
+
+
+class Corpus(NamedTuple):
+    posts_dir: Path
+    projects_dir: Path
+    static_dir: Path
+
+
+def _png(width: int, height: int, colour: bytes) -> bytes:
+    r"""A PNG of a single `colour`, given as three RGB bytes."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data \
+            + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows: bytes = (b"\0" + colour * width) * height
+    return b"\x89PNG\r\n\x1a\n" \
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) \
+        + chunk(b"IDAT", zlib.compress(rows)) \
+        + chunk(b"IEND", b"")
+
+
+def _document(rng: random.Random, title: str, paragraphs: int) -> str:
+    lines: List[str] = [f"# {title}", ""]
+    for index in range(paragraphs):
+        if index % 3 == 2:
+            lines.extend(["```python", "def f(x):", "    return x * 2", "```", ""])
+        lines.extend([
+            " ".join(rng.choice(_WORDS) for _ in range(60)),
+            ""
+        ])
+    return "\n".join(lines)
+
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    with open(path, 'w') as file:
+        json.dump(data, file, indent=2)
+
+
+def make_corpus(root: Path, config: CorpusConfig) -> Corpus:
+    r"""Writes `blog_posts`, `projects` and `static` trees shaped by `config`
+    under `root`, in the layout `build_blog` and `build_projects` read.
+    """
+    rng: random.Random = random.Random(config.seed)
+    corpus: Corpus = Corpus(
+        root / "blog_posts",
+        root / "projects",
+        root / "static"
+    )
+    for path in corpus:
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+
+    tags: List[str] = [f"tag-{index}" for index in range(config.tags)]
+    projects: List[str] = [f"project-{index}" for index in range(config.projects)]
+    start: datetime.date = datetime.date(2015, 1, 1)
+
+    for index in range(config.posts):
+        name: str = f"post-{index:05d}"
+        post_dir: Path = corpus.posts_dir / name
+        (post_dir / "static").mkdir(parents=True)
+        date: datetime.date = start + datetime.timedelta(
+            days=rng.randrange(3000)
+        )
+        with open(post_dir / "post.md", 'w') as file:
+            file.write(_document(rng, f"Post {index}", config.paragraphs))
+        with open(post_dir / "static" / "thumb.png", 'wb') as file:
+            file.write(_png(64, 48, bytes(rng.randrange(256) for _ in range(3))))
+        _write_json(post_dir / "post.json", {
+            "file_path": "post.md",
+            "post_dir": name,
+            "format": "markdown",
+            "static_dir": "static",
+            "title": f"Post {index}",
+            "authors": ["Alia Lescoulie"],
+            "day": date.day,
+            "month": date.month,
+            "year": date.year,
+            "description": " ".join(rng.choice(_WORDS) for _ in range(20)),
+            "thumbnail": "static/thumb.png",
+            "projects": rng.sample(
+                projects,
+                min(config.projects_per_post, len(projects))
+            ),
+            "tags": rng.sample(tags, min(config.tags_per_post, len(tags)))
+        })
+
+    for index, project in enumerate(projects):
+        proj_dir: Path = corpus.projects_dir / project
+        (proj_dir / "static").mkdir(parents=True)
+        with open(proj_dir / "project.md", 'w') as file:
+            file.write(_document(rng, f"Project {index}", config.paragraphs))
+        with open(proj_dir / "static" / "thumb.png", 'wb') as file:
+            file.write(_png(64, 48, bytes(rng.randrange(256) for _ in range(3))))
+        _write_json(proj_dir / "proj.json", {
+            "file_path": "project.md",
+            "proj_dir": project,
+            "format": "markdown",
+            "static_dir": "static",
+            "thumbnail": "static/thumb.png",
+            "project": project,
+            "day": 1,
+            "month": 1,
+            "year": 2023,
+            "description": " ".join(rng.choice(_WORDS) for _ in range(20))
+        })
+
+    for index in range(config.static_files):
+        with open(corpus.static_dir / f"asset-{index:05d}.bin", 'wb') as file:
+            file.write(rng.randbytes(config.static_size))
+
+    return corpus
+
+
+def _build(corpus: Corpus,
+           build_dir: Path,
+           cache_dir: Path,
+           manifest: BuildManifest,
+           backend: Optional[Any],
+           jobs: int) -> Dict[str, float]:
+    r"""Runs the static, blog and projects stages on `corpus`, returning the
+    wall time in seconds of each of `BENCH_STAGES`. Times of spans run in
+    worker processes, like `pandoc`, are summed over the workers.
+    """
+    templates: TemplateRegistry = TemplateRegistry(build.TEMPLATE_DIR)
+    cache: ConversionCache = ConversionCache(cache_dir / "pandoc")
+    writer: PageWriter = PageWriter()
+
+    profiler: profile.Profiler = profile.start()
+    try:
+        with profile.span("copy_static", "bench"):
+            build.copy_static(corpus.static_dir, build_dir, manifest=manifest)
+        with profile.span("build_blog", "bench"):
+            posts: List[build.PostBuildData] = build.build_blog(
+                post_src_dir=corpus.posts_dir,
+                post_build_dir=build_dir / "posts",
+                site_build_dir=build_dir,
+                templates=templates,
+                manifest=manifest,
+                cache=cache,
+                backend=backend,
+                jobs=jobs,
+                image_cache_dir=cache_dir / "images",
+                writer=writer
+            )
+        build.build_projects(
+            posts,
+            projects_src_dir=corpus.projects_dir,
+            templates=templates,
+            site_build_dir=build_dir,
+            posts_build_dir=build_dir / "posts",
+            projects_build_dir=build_dir / "projects",
+            manifest=manifest,
+            cache=cache,
+            backend=backend,
+            jobs=jobs,
+            image_cache_dir=cache_dir / "images",
+            writer=writer,
+            verbose=False
+        )
+    finally:
+        profile.stop()
+
+    totals: Dict[str, Dict[str, float]] = profiler.totals()
+    return {
+        stage: round(totals[stage]["wall_ms"] / 1000, 4) if stage in totals
+        else 0.0
+        for stage in BENCH_STAGES
+    }
+
+
+def run_benchmark(config: CorpusConfig,
+                  work_dir: Optional[Path] = None,
+                  jobs: int = 1,
+                  pandoc_mode: str = "auto",
+                  verbose: bool = False) -> Dict[str, Any]:
+    r"""Builds a synthetic corpus twice and times the stages of each build.
+
+    The `full` run starts from an empty build directory and empty caches,
+    the `incremental` run rebuilds the unchanged corpus from the manifest
+    the first run left, which measures the cost of finding that nothing
+    needs doing.
+
+    Arguments
+    ---------
+
+    config: Shape of the corpus
+
+    work_dir: Directory the corpus, caches and output are written to, a
+    temporary directory removed afterwards when `None`
+
+    jobs: Worker processes used to convert posts and projects
+
+    pandoc_mode: pandoc backend, see `convert.start_backend`
+
+    """
+    if work_dir is None:
+        with tempfile.TemporaryDirectory(prefix="sitegen-bench-") as tmp_dir:
+            return run_benchmark(config, Path(tmp_dir), jobs, pandoc_mode,
+                                 verbose)
+
+    configure_pandoc()
+    for name in ("site_out", "cache"):
+        if (work_dir / name).exists():
+            shutil.rmtree(work_dir / name)
+    corpus: Corpus = make_corpus(work_dir / "corpus", config)
+    build_dir: Path = work_dir / "site_out"
+    build.make_build_dir(build_dir)
+
+    backend: Optional[Any] = start_backend(pandoc_mode, verbose=verbose)
+    timings: Dict[str, Dict[str, float]] = {}
+    try:
+        manifest: BuildManifest = BuildManifest(build_dir)
+        timings["full"] = _build(
+            corpus, build_dir, work_dir / "cache", manifest, backend, jobs
+        )
+        manifest.save()
+        if verbose:
+            print(f"Full build of {config.posts} posts done")
+
+        manifest = BuildManifest.load(build_dir)
+        timings["incremental"] = _build(
+            corpus, build_dir, work_dir / "cache", manifest, backend, jobs
+        )
+    finally:
+        if backend is not None:
+            backend.close()
+
+    return {
+        "config": config._asdict(),
+        "jobs": jobs,
+        "pandoc": pandoc_mode,
+        "timings": timings
+    }
+
+
+def run_suite(configs: List[CorpusConfig],
+              work_dir: Optional[Path] = None,
+              jobs: int = 1,
+              pandoc_mode: str = "auto",
+              verbose: bool = False) -> Dict[str, Any]:
+    r"""Runs `run_benchmark` for each config, the machine-readable results
+    `compare` checks against a baseline.
+    """
+    runs: List[Dict[str, Any]] = []
+    for config in configs:
+        if verbose:
+            print(f"Benchmarking {config.posts} posts, {config.projects} "
+                  f"projects, {config.static_files} static files")
+        runs.append(run_benchmark(config, work_dir, jobs, pandoc_mode, verbose))
+    return {
+        "version": BENCH_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "runs": runs
+    }
+
+
+def _run_key(run: Dict[str, Any]) -> str:
+    return json.dumps([run["config"], run["jobs"], run["pandoc"]],
+                      sort_keys=True)
+
+
+def compare(results: Dict[str, Any],
+            baseline: Dict[str, Any],
+            threshold: float = 0.2) -> List[str]:
+    r"""Returns a line for every stage that got more than `threshold` slower
+    than in `baseline`, for runs with the same config, jobs and backend.
+    Slowdowns under `MIN_REGRESSION` seconds are ignored as noise.
+    """
+    previous: Dict[str, Dict[str, Any]] = {
+        _run_key(run): run for run in baseline.get("runs", [])
+    }
+    regressions: List[str] = []
+    for run in results["runs"]:
+        old: Optional[Dict[str, Any]] = previous.get(_run_key(run))
+        if old is None:
+            continue
+        for kind, stages in run["timings"].items():
+            for stage, seconds in stages.items():
+                before: Optional[float] = old["timings"].get(kind, {}).get(stage)
+                if not before:
+                    continue
+                if seconds > before * (1 + threshold) \
+                        and seconds - before > MIN_REGRESSION:
+                    regressions.append(
+                        f"{run['config']['posts']} posts, {kind} {stage}: "
+                        f"{before:.3f}s -> {seconds:.3f}s "
+                        f"(+{100 * (seconds / before - 1):.0f}%)"
+                    )
+    return regressions
+
+
+def results_table(results: Dict[str, Any],
+                  baseline: Optional[Dict[str, Any]] = None) -> str:
+    r"""Seconds per stage for every run, with the change from `baseline`
+    where it has the same run.
+    """
+    previous: Dict[str, Dict[str, Any]] = {
+        _run_key(run): run for run in (baseline or {}).get("runs", [])
+    }
+    lines: List[str] = []
+    for run in results["runs"]:
+        config: Dict[str, Any] = run["config"]
+        lines.append(
+            f"{config['posts']} posts, {config['projects']} projects, "
+            f"{config['tags']} tags, {config['static_files']} static files, "
+            f"{run['jobs']} jobs"
+        )
+        old: Optional[Dict[str, Any]] = previous.get(_run_key(run))
+        for kind, stages in run["timings"].items():
+            for stage, seconds in stages.items():
+                line: str = f"  {kind:<12}{stage:<18}{seconds:>9.3f}s"
+                if config["posts"]:
+                    line += f"{1000 * seconds / config['posts']:>9.2f} ms/post"
+                before: Optional[float] = None if old is None \
+                    else old["timings"].get(kind, {}).get(stage)
+                if before:
+                    line += f"  {100 * (seconds / before - 1):+.0f}%"
+                lines.append(line)
+    return "\n".join(lines)
@@ -1,4 +1,16 @@
-from typing import Any, Dict, Final, List, NamedTuple, Optional, Tuple, Set
+from __future__ import annotations
+
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Final,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple
+)
 
 import os
 
@@ -12,9 +24,26 @@ import json
 
 import datetime
 
-from jinja2 import Environment, Template, FileSystemLoader, select_autoescape
+import time
 
-import pandoc
+from functools import partial
+
+from .manifest import BuildManifest, hash_file, hash_value
+from .profile import profiled, span
+from .writer import PageWriter, default_writer
+
+# Stage modules and Jinja are imported by the functions that use them, so a
+# targeted build only loads what its stages need
+if TYPE_CHECKING:
+    from jinja2 import Environment, Template
+
+    from .assets import AssetReport
+    from .catalogue import MetadataCatalogue
+    from .convert import ConversionCache
+    from .images import ThumbnailSet
+    from .registry import TemplateRegistry
+    from .search import SearchIndex, SearchReport
+    from .sync import SyncResult
 
 # Pre-defined site names
 SITEGEN_DIR: Final[Path] = Path(__file__).parent
@@ -28,6 +57,40 @@ POST_BUILD_DIR: Final[Path] = BUILD_DIR / "posts"
 PROJS_BUILD_DIR: Final[Path] = BUILD_DIR / "projects"
 GAMES_DIR: Final[Path] = SRC_DIR / "games"
 GAMES_BUILD_DIR: Final[Path] = BUILD_DIR / "games"
+CACHE_DIR: Final[Path] = Path(".sitegen_cache")
+IMAGE_CACHE_DIR: Final[Path] = CACHE_DIR / "images"
+CATALOGUE_PATH: Final[Path] = CACHE_DIR / "catalogue.sqlite"
+MEDIA_CACHE_DIR: Final[Path] = CACHE_DIR / "media"
+SEARCH_CACHE_PATH: Final[Path] = CACHE_DIR / "search.json"
+ASSETS_STATE_PATH: Final[Path] = CACHE_DIR / "assets.json"
+# Posts on each page of the blog and tag listings, 0 for a single page
+POSTS_PER_PAGE: Final[int] = 10
+
+# Templates each kind of page loads directly, `TemplateRegistry.paths` adds
+# whatever they include, extend or import when the manifest records them
+PAGE_TEMPLATES: Final[Tuple[str, ...]] = (
+    "header.html.jinja",
+    "navbar.html.jinja"
+)
+BLOCK_TEMPLATES: Final[Tuple[str, ...]] = (
+    "post_block.html.jinja",
+    "tag.html.jinja"
+)
+
+# Build stage that writes the outputs of each manifest group
+GROUP_STAGES: Final[Dict[str, str]] = {
+    "static": "static",
+    "pages": "pages",
+    "posts": "blog",
+    "post_thumbs": "blog",
+    "blog": "blog",
+    "tags": "blog",
+    "projects": "projects",
+    "project_thumbs": "projects",
+    "projects_page": "projects",
+    "games": "games",
+    "compressed": "compress"
+}
 
 
 def make_build_dir(build_dir: Path = BUILD_DIR) -> None:
@@ -46,73 +109,133 @@ def make_build_dir(build_dir: Path = BUILD_DIR) -> None:
     os.mkdir(build_dir) 
 
 
-def load_templates(templates_dir: Path = TEMPLATE_DIR,
-                   verbose: bool = False) -> Environment:
-    r"""Loads the Jinja templates from the specified directory into an
-    Environment. The returned object can generate jinja templates by
-    calling `get_template("template_path.html.jinja")`
+def default_templates(
+        templates: Optional[TemplateRegistry] = None) -> TemplateRegistry:
+    r"""Returns `templates`, or a registry over the `templates` directory
+    when none is given. Builds should create one registry and pass it to
+    every step so each template is only compiled once.
+    """
+    from .registry import TemplateRegistry
+
+    if templates is None:
+        return TemplateRegistry(TEMPLATE_DIR)
+    return templates
+
 
-    By default gets templates from the `templates` directory.
+def render_source_page(page_path: Path,
+                       pages: Environment,
+                       templates: Optional[TemplateRegistry] = None,
+                       depth: str = "") -> str:
+    r"""Renders the page template `page_path`, a `*.html.jinja` file loaded
+    by `pages`, with the site header and navbar linking `depth` up to the
+    site root.
     """
-    if verbose:
-        print(f"Loading templates from {templates_dir}")
-    TemplatesBase: Environment = Environment(
-        loader=FileSystemLoader(templates_dir),
-        autoescape=select_autoescape()
-    )
-    return TemplatesBase
+    templates = default_templates(templates)
+
+    header: Template = templates.get_template("header.html.jinja")
+    navbar: Template = templates.get_template("navbar.html.jinja")
+
+    page_temp: Template = pages.get_template(
+        page_path.stem + page_path.suffix
+        )
+
+    page_title: str = "Alia Lescoulie" if page_path.stem == "index.html" \
+        else f"{str(page_path.stem)[:-5].capitalize()} - Alia Lescoulie"
+
+    return page_temp.render(
+            header=header.render(title=page_title, depth=depth),
+            navbar=navbar.render(depth=depth))
 
 
 def build_pages(build_dir: Path = BUILD_DIR,
-                templates_dir: Path = TEMPLATE_DIR,
-                src_dir: Path = SRC_DIR) -> None:
+                templates: Optional[TemplateRegistry] = None,
+                src_dir: Path = SRC_DIR,
+                manifest: Optional[BuildManifest] = None,
+                writer: Optional[PageWriter] = None) -> None:
     r"""Builds the jinja templates in the source dir into html files in the
     build dir using the header and navbar jinja templates in the provided
-    templates dir.
+    template registry.
+
+    When a manifest is given pages whose source and templates are unchanged
+    since the last build are skipped.
     """
     make_build_dir(build_dir=build_dir) # Ensures that build_dir exists
 
-    TemplatesBase: Environment = load_templates(templates_dir=templates_dir)
-
-    Pages: Environment = Environment(
-        loader=FileSystemLoader(src_dir),
-    )
-
-
-    header: Template = TemplatesBase.get_template("header.html.jinja")
-    navbar: Template = TemplatesBase.get_template("navbar.html.jinja")
+    templates = default_templates(templates)
+    writer = default_writer(writer)
 
+    Pages: Environment = templates.pages(src_dir)
 
     for page in glob.glob(f"{src_dir}/*.html.jinja"):
         page_path: Path = Path(page)
+        out_path: Path = build_dir.joinpath(page_path.stem)
 
-        page_temp: Template = Pages.get_template(
-            page_path.stem + page_path.suffix
-            )
-
-        page_title: str = "Alia Lescoulie" if page_path.stem == "index.html" \
-            else f"{str(page_path.stem)[:-5].capitalize()} - Alia Lescoulie"
+        if manifest is not None:
+            # Pages like projects.html are overwritten by a later stage,
+            # once that stage owns the output there is no point rendering it
+            if manifest.owner(out_path) not in (None, "pages"):
+                continue
+            inputs: Dict[str, str] = manifest.inputs([
+                *templates.page_paths(src_dir, page_path.name),
+                *templates.paths(PAGE_TEMPLATES)
+            ])
+            if manifest.is_fresh(out_path, inputs):
+                continue
 
-        page_header: str = header.render(title=page_title)
+        page_text: str = render_source_page(page_path, Pages, templates)
 
-        page_text: str = page_temp.render(
-                header=page_header,
-                navbar=navbar.render())
+        writer.write(out_path, page_text)
 
-        with open(
-                build_dir.joinpath(page_path.stem),
-                'w',
-                encoding='utf-8'
-                 ) as file:
+        if manifest is not None:
+            manifest.record(out_path, inputs, "pages")
 
-            file.write(page_text) 
+    if manifest is not None:
+        manifest.prune("pages")
     
 
+def sync_static(src_dir: Path,
+                dest_dir: Path,
+                site_build_dir: Path = BUILD_DIR,
+                writer: Optional[PageWriter] = None) -> SyncResult:
+    r"""Syncs the static directory `src_dir` into `dest_dir`, see
+    `sync.sync_tree`. Originals fingerprinting moved into the asset store
+    count as present, so only the files that changed are copied again.
+    """
+    from .assets import AssetStore
+    from .sync import sync_tree
+
+    store: AssetStore = AssetStore.load(site_build_dir, ASSETS_STATE_PATH)
+    result: SyncResult = sync_tree(
+        src_dir,
+        dest_dir,
+        transform=default_writer(writer).transform,
+        moved=store.moved(dest_dir)
+    )
+    store.forget(result.removed)
+    return result
+
+
 def copy_static(static_dir: Path = STATIC_DIR,
                 build_dir: Path = BUILD_DIR,
-                dir_name: str = "static") -> None:
+                dir_name: str = "static",
+                manifest: Optional[BuildManifest] = None,
+                writer: Optional[PageWriter] = None) -> None:
+    r"""Syncs `static_dir` into `build_dir / dir_name`, copying only the
+    files that changed since the last sync and removing deleted ones. CSS
+    and JavaScript go through the `writer`'s minifiers when it has them.
+    """
     make_build_dir(build_dir=build_dir)
-    shutil.copytree(static_dir, Path(build_dir, dir_name))
+    static_build_dir: Path = Path(build_dir, dir_name)
+
+    if manifest is not None:
+        inputs: Dict[str, str] = manifest.inputs([static_dir])
+        if manifest.is_fresh(static_build_dir, inputs):
+            return
+
+    sync_static(static_dir, static_build_dir, build_dir, writer)
+
+    if manifest is not None:
+        manifest.record(static_build_dir, inputs, "static")
 
 
 class PostData(NamedTuple):
@@ -125,38 +248,57 @@ class PostData(NamedTuple):
     date: "date"
     description: str
     thumbnail: Path
-    project: Optional[List[str]]
+    project: List[str]
     tags: List[str]
 
 
+def post_from_json(post_json: Dict[str, Any]) -> PostData:
+    r"""Makes a post's `PostData` from its parsed post.json, the `projects`
+    field may be a list of project names or a single name.
+    """
+    from .catalogue import names
+
+    Post: PostData = PostData(
+        Path(post_json["file_path"]),
+        Path(post_json["post_dir"]),
+        post_json["format"],
+        Path(post_json["static_dir"]) \
+            if post_json["static_dir"] is not None else None,
+        post_json["title"],
+        post_json["authors"],
+        datetime.date(
+            day=post_json["day"],
+            month=post_json["month"],
+            year=post_json["year"]
+        ),
+        post_json["description"],
+        Path(post_json["thumbnail"]),
+        names(post_json.get("projects")),
+        post_json["tags"]
+    )
+    return Post
+
+
 def parse_post(post_json_path: Path, posts_dir: Path) -> PostData:
     with open(post_json_path, 'r') as file:
-        post_json: Dict[str, Any] = json.load(file)
-
-        Post: PostData = PostData(
-            Path(post_json["file_path"]),
-            Path(post_json["post_dir"]),
-            post_json["format"],
-            Path(post_json["static_dir"]) \
-                if post_json["static_dir"] is not None else None,
-            post_json["title"],
-            post_json["authors"],
-            datetime.date(
-                day=post_json["day"],
-                month=post_json["month"],
-                year=post_json["year"]
-            ),
-            post_json["description"],
-            Path(post_json["thumbnail"]),
-            post_json["projects"],
-            post_json["tags"]
-        )
- 
-    return Post
+        return post_from_json(json.load(file))
 
 
+@profiled()
 def collect_posts(posts_src_dir: Path = POSTS_DIR,
+                  catalogue: Optional[MetadataCatalogue] = None,
                   verbose: bool = False) -> List:
+    r"""Reads the post.json of every post under `posts_src_dir`. With a
+    `catalogue` only new and changed post.json files are read and parsed.
+    """
+    if catalogue is not None:
+        return catalogue.documents(
+            posts_src_dir,
+            "post",
+            "post.json",
+            post_from_json,
+            verbose=verbose
+        )
     post_list: List(str) = glob.glob("*/post.json", root_dir=posts_src_dir)
     if verbose:
         print(f"Collecting Posts in {posts_src_dir}")
@@ -176,9 +318,22 @@ class PostHTML(NamedTuple):
     post_src: str
 
 
+@profiled("document", document=lambda post_data, *args, **kwargs :
+          str(post_data.directory))
 def build_post_html(post_data: PostData,
                     post_src_dir: Path = POSTS_DIR,
+                    cache: Optional[ConversionCache] = None,
+                    backend: Optional[Any] = None,
+                    media_dir: Optional[Path] = None,
+                    media_cache_dir: Optional[Path] = None,
                     verbose: bool = False) -> PostHTML:
+    r"""Converts a post with pandoc. With `media_dir` set the images
+    embedded in the output, and notebook outputs pandoc leaves unwritten,
+    are stored there as files, see `media.extract_document_media`.
+    """
+    from .convert import convert
+    from .media import MediaCache, extract_document_media
+
     if verbose:
         print(f"Building {post_data.path} html")
 
@@ -187,8 +342,21 @@ def build_post_html(post_data: PostData,
                                                 )
     with open(post_src_path, 'r') as post_file:
         post_text: str = post_file.read()
-        post_info: Any = pandoc.read(post_text, format=post_data.format)
-        post_html: str = pandoc.write(post_info, format='html')
+    with span("pandoc", "pandoc", document=str(post_data.directory)):
+        post_html: str = convert(
+            post_text,
+            post_data.format,
+            cache=cache,
+            backend=backend
+        )
+    if media_dir is not None:
+        post_html = extract_document_media(
+            post_text,
+            post_data.format,
+            post_html,
+            media_dir,
+            cache=MediaCache(media_cache_dir) if media_cache_dir else None
+        )
     return PostHTML(post_data, post_html)
 
 
@@ -209,6 +377,32 @@ def render_date_string(date) -> str: # put a datetime date as the argument
     return date.strftime("%B %-d, %Y")
 
 
+def post_page_path(post_data: PostData,
+                   site_build_dir: Path = BUILD_DIR) -> Path:
+    return site_build_dir.joinpath(
+        "posts",
+        post_data.directory,
+        post_data.path.stem + ".html"
+    )
+
+
+def post_input_paths(post_data: PostData,
+                     post_src_dir: Path = POSTS_DIR,
+                     templates: Optional[TemplateRegistry] = None,
+                     post_template_name: str = "post_temp.html.jinja"
+                     ) -> List[Path]:
+    r"""The files a post page is generated from, its post.json, source
+    document and templates.
+    """
+    return [
+        post_src_dir.joinpath(post_data.directory, "post.json"),
+        post_src_dir.joinpath(post_data.directory, post_data.path),
+        *default_templates(templates).paths(
+            (post_template_name, *PAGE_TEMPLATES)
+        )
+    ]
+
+
 class PostBuildData(NamedTuple):
     path: Path
     directory: Path
@@ -218,27 +412,70 @@ class PostBuildData(NamedTuple):
         return hash(self.data.title)
 
 
+def post_build_data(post_data: PostData,
+                    site_build_dir: Path = BUILD_DIR) -> PostBuildData:
+    post_path: Path = post_page_path(post_data, site_build_dir)
+    return PostBuildData(post_path, post_path.parent, post_data)
+
+
+date_sort = lambda x : x.data.date
+
+
+class ContentIndex:
+    r"""Lookups over the posts of a build, made once after the posts are
+    collected so the listing stages never rescan the post list.
+
+    `by_date` holds every post newest first, `tags` and `projects` map each
+    tag and project name to its posts, also newest first. Names are matched
+    exactly.
+
+    Arguments
+    ---------
+
+    posts: Every post of the site
+
+    """
+
+    def __init__(self, posts: List[PostBuildData]) -> None:
+        self.by_date: List[PostBuildData] = sorted(posts,
+                                                   key=date_sort,
+                                                   reverse=True)
+        self.tags: Dict[str, List[PostBuildData]] = {}
+        self.projects: Dict[str, List[PostBuildData]] = {}
+        for post in self.by_date:
+            for tag in dict.fromkeys(post.data.tags):
+                self.tags.setdefault(tag, []).append(post)
+            for project in dict.fromkeys(post.data.project):
+                self.projects.setdefault(project, []).append(post)
+
+    def tag_posts(self, tag: str) -> List[PostBuildData]:
+        return self.tags.get(tag, [])
+
+    def project_posts(self, name: str) -> List[PostBuildData]:
+        return self.projects.get(name, [])
+
+
+@profiled("document", document=lambda Post, *args, **kwargs :
+          str(Post.post_data.directory))
 def build_post_page(
         Post: PostHTML,
         site_build_dir: Path = BUILD_DIR,
         post_build_dir: Path = POST_BUILD_DIR,
-        templates_dir: Path = TEMPLATE_DIR, 
+        templates: Optional[TemplateRegistry] = None, 
         post_template_name: str = "post_temp.html.jinja",
+        writer: Optional[PageWriter] = None,
         verbose: bool = False
         ) -> PostBuildData:
     
-    TemplatesBase: Environment = load_templates(
-            templates_dir,
-            verbose
-        )
+    templates = default_templates(templates)
 
-    header: Template = TemplatesBase.get_template("header.html.jinja")
-    navbar: Template = TemplatesBase.get_template("navbar.html.jinja")
+    header: Template = templates.get_template("header.html.jinja")
+    navbar: Template = templates.get_template("navbar.html.jinja")
 
     if verbose:
         print(f"Loading template {post_template_name}")
 
-    PostTemp: Template = TemplatesBase.get_template(post_template_name)
+    PostTemp: Template = templates.get_template(post_template_name)
 
     header_text: str = header.render(
         title=f"{Post.post_data.title} - Alia Lescoulie",
@@ -254,25 +491,65 @@ def build_post_page(
         post_html=Post.post_src
     )
 
-    post_dir: Path = site_build_dir / "posts" / Post.post_data.directory
+    post_path: Path = post_page_path(Post.post_data, site_build_dir)
 
-    post_path: Path = post_dir.joinpath(Post.post_data.path.stem + ".html")
+    post_dir: Path = post_path.parent
 
     if verbose:
         print(f"writing post to {post_path}")
 
     post_dir.mkdir(parents=True, exist_ok=True)
 
-    with open(post_path, "w") as post_file:
-        post_file.write(post_text)
+    default_writer(writer).write(post_path, post_text)
 
     return PostBuildData(post_path, post_dir, Post.post_data)
 
 
+def build_post(post_data: PostData,
+               post_src_dir: Path = POSTS_DIR,
+               site_build_dir: Path = BUILD_DIR,
+               post_build_dir: Path = POST_BUILD_DIR,
+               templates: Optional[TemplateRegistry] = None,
+               post_template_name: str = "post_temp.html.jinja",
+               cache: Optional[ConversionCache] = None,
+               backend: Optional[Any] = None,
+               writer: Optional[PageWriter] = None,
+               media_cache_dir: Optional[Path] = None,
+               verbose: bool = False) -> PostBuildData:
+    r"""Converts a post and writes its page, the unit of work handed to
+    worker processes by `build_blog`. Embedded media is written next to
+    the page.
+    """
+    from .media import MEDIA_DIR_NAME
+
+    return build_post_page(
+        build_post_html(
+            post_data,
+            post_src_dir=post_src_dir,
+            cache=cache,
+            backend=backend,
+            media_dir=post_page_path(post_data, site_build_dir).parent
+            / MEDIA_DIR_NAME,
+            media_cache_dir=media_cache_dir,
+            verbose=verbose
+        ),
+        site_build_dir=site_build_dir,
+        post_build_dir=post_build_dir,
+        templates=templates,
+        post_template_name=post_template_name,
+        writer=writer,
+        verbose=verbose
+    )
+
+
+@profiled("document", document=lambda post, *args, **kwargs :
+          str(post.data.directory))
 def copy_post_files(post: PostBuildData,
                     site_build_dir: Path = BUILD_DIR,
                     post_src_dir: Path = POSTS_DIR,
                     post_build_dir: Path = POST_BUILD_DIR,
+                    manifest: Optional[BuildManifest] = None,
+                    writer: Optional[PageWriter] = None,
                     verbose: bool = False) -> None:
     if post.data.static is None:
         return None
@@ -281,33 +558,33 @@ def copy_post_files(post: PostBuildData,
             post.data.directory,
             "static"
         ) 
+        static_src_dir: Path = post_src_dir.joinpath(
+            post.data.directory,
+            post.data.static
+        )
+
+        if manifest is not None:
+            inputs: Dict[str, str] = manifest.inputs([static_src_dir])
+            if manifest.is_fresh(new_static_dir, inputs):
+                return None
 
         if verbose:
             print(f"Copying {post.data.static} to {new_static_dir}")
 
-        if not new_static_dir.exists():
-            os.mkdir(new_static_dir)
+        sync_static(static_src_dir, new_static_dir, site_build_dir, writer)
 
-        shutil.copytree(
-            post_src_dir.joinpath(post.data.directory, post.data.static),
-            new_static_dir, 
-            dirs_exist_ok=True
-        )
+        if manifest is not None:
+            manifest.record(new_static_dir, inputs, "posts")
 
 
 def render_tags(tags: List[str],
-                templates_dir,
+                templates: TemplateRegistry,
                 link_depth: int = 0,
                 verbose: bool = False) -> None:
 
-    TemplatesBase: Environment = load_templates(
-        templates_dir,
-        verbose
-    )
-
     root_dir: Path = Path('.') if link_depth <= 0 else Path(link_depth * "../")
 
-    tag_temp: Template = TemplatesBase.get_template("tag.html.jinja")
+    tag_temp: Template = templates.get_template("tag.html.jinja")
     tag_list: List[str] = [
         tag_temp.render(
             link=root_dir.joinpath(f"{tag}.html"),
@@ -318,182 +595,594 @@ def render_tags(tags: List[str],
     return ', '.join(tag_list) 
 
 
-date_sort = lambda x : x.data.date
+class PostBlocks:
+    r"""The listing blocks of posts, each rendered once per link depth and
+    reused by every page that lists the post, so the blog, tag and project
+    pages together render a post's block once rather than once per page.
+
+    One instance lives for a whole build, `build_site` makes it. Rendered
+    blocks are not pickled, worker processes render the blocks they need.
+
+    Arguments
+    ---------
+
+    templates: Registry the blocks are rendered with
+
+    """
+
+    def __init__(self, templates: TemplateRegistry) -> None:
+        self.templates: TemplateRegistry = templates
+        self.blocks: Dict[Tuple[Path, int], str] = {}
+        self.rendered: int = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"templates": self.templates, "blocks": {}, "rendered": 0}
+
+    def block(self,
+              post: PostBuildData,
+              link_depth: int = 0,
+              thumbnails: Optional[Dict[str, ThumbnailSet]] = None,
+              verbose: bool = False) -> str:
+        from .images import thumbnail_context
+
+        key: Tuple[Path, int] = (post.data.directory, link_depth)
+        if key in self.blocks:
+            return self.blocks[key]
+
+        if verbose:
+            print(f"Building block for {post.data.title}")
+        block: Template = self.templates.get_template("post_block.html.jinja")
+        self.blocks[key] = block.render(
+            title=post.data.title,
+            **thumbnail_context(
+                post_thumbnail(post.data),
+                thumbnails,
+                link_depth * '../'
+            ),
+            link=Path(f"{link_depth * '../'}posts").joinpath(
+                post.data.directory,
+                post.data.path.stem + ".html"),
+            date=render_date_string(post.data.date),
+            author=render_authors_string(post.data.authors),
+            summary=post.data.description,
+            tags=render_tags(
+                post.data.tags,
+                self.templates,
+                link_depth=link_depth,
+                verbose=verbose
+            )
+        )
+        self.rendered += 1
+        return self.blocks[key]
 
 
 def build_post_blocks(posts: List[PostBuildData],
-                      templates_dir: Path,
+                      templates: TemplateRegistry,
                       post_build_dir: Path,
                       link_depth: int = 0,
                       post_sort_lambda = date_sort,
                       reverse_cron: bool = True,
+                      thumbnails: Optional[Dict[str, ThumbnailSet]] = None,
+                      blocks: Optional[PostBlocks] = None,
                       verbose: bool = True) -> List[str]:
-    TemplatesBase: Environment = load_templates(templates_dir, verbose)
-
-    header: Template = TemplatesBase.get_template("header.html.jinja")
-    navbar: Template = TemplatesBase.get_template("navbar.html.jinja")
-    block: Template = TemplatesBase.get_template("post_block.html.jinja")
-    blog_page: Template = TemplatesBase.get_template("blog.html.jinja")
+    r"""The listing blocks of `posts`, newest first unless `reverse_cron`
+    is unset. Blocks already rendered into `blocks` are reused.
+    """
+    if blocks is None:
+        blocks = PostBlocks(templates)
 
     sorted_posts: List[PostBuildData] = sorted(posts,
                                                key=post_sort_lambda,
                                                reverse=reverse_cron)
-    
-    root_dir: Path = Path('.') if link_depth <= 0 else Path(link_depth * "../")
 
     if verbose:
         print("Posts sorted")
 
-    post_blocks: List[str] = []
+    return [
+        blocks.block(post, link_depth, thumbnails, verbose=verbose)
+        for post in sorted_posts
+    ]
 
-    for post in sorted_posts:
-        if verbose:
-            print(f"Building block for {post.data.title}")
-        post_blocks.append(
-            block.render(
-                title=post.data.title,
-                img_link=Path(f"{link_depth * '../'}posts").joinpath(
-                    post.data.directory) / post.data.thumbnail,
-                link=Path(f"{link_depth * '../'}posts").joinpath(
-                    post.data.directory,
-                    post.data.path.stem + ".html"),
-                date=render_date_string(post.data.date),
-                author=render_authors_string(post.data.authors),
-                summary=post.data.description,
-                tags=render_tags(
-                    post.data.tags,
-                    templates_dir,
-                    link_depth=link_depth,
-                    verbose=verbose
-                )
-            )
-        )
 
-    return post_blocks
+def post_thumbnail(post_data: PostData) -> str:
+    r"""Path of a post's thumbnail relative to the site root."""
+    return (Path("posts") / post_data.directory / post_data.thumbnail).as_posix()
+
+
+def listing_inputs(posts: List[PostBuildData],
+                   templates: TemplateRegistry,
+                   page_template_name: str,
+                   manifest: BuildManifest,
+                   thumbnails: Optional[Dict[str, ThumbnailSet]] = None
+                   ) -> Dict[str, str]:
+    r"""Inputs of a page listing posts, its templates and the metadata and
+    thumbnails of every post it lists. Post sources are not included,
+    editing the body of a post does not change its block.
+    """
+    from .images import thumbnails_digest
+
+    inputs: Dict[str, str] = manifest.inputs(templates.paths(
+        (page_template_name, *PAGE_TEMPLATES, *BLOCK_TEMPLATES)
+    ))
+    inputs["posts"] = hash_value(
+        sorted((post.data for post in posts), key=lambda x : str(x.directory))
+    )
+    inputs["thumbnails"] = thumbnails_digest(
+        sorted(post_thumbnail(post.data) for post in posts),
+        thumbnails
+    )
+    return inputs
+
 
+def listing_page_path(blog_page_path: Path, number: int) -> Path:
+    r"""Path of page `number` of the listing starting at `blog_page_path`,
+    `blog.html`, `blog/2.html`, `blog/3.html` and so on.
+    """
+    if number <= 1:
+        return blog_page_path
+    return blog_page_path.with_suffix("") / f"{number}.html"
+
+
+def listing_page_link(blog_page_path: Path, number: int, current: int) -> str:
+    r"""Relative link from page `current` of a listing to page `number`."""
+    if current <= 1:
+        return listing_page_path(blog_page_path, number).as_posix()
+    if number <= 1:
+        return f"../{blog_page_path.name}"
+    return f"{number}.html"
 
+
+def paginate(posts: List[PostBuildData],
+             page_size: int = POSTS_PER_PAGE) -> List[List[PostBuildData]]:
+    r"""Splits `posts`, newest first, into pages of `page_size`. A
+    `page_size` of zero puts every post on one page.
+    """
+    sorted_posts: List[PostBuildData] = sorted(posts,
+                                               key=date_sort,
+                                               reverse=True)
+    if page_size <= 0 or not sorted_posts:
+        return [sorted_posts]
+    return [
+        sorted_posts[start:start + page_size]
+        for start in range(0, len(sorted_posts), page_size)
+    ]
+
+
+@profiled()
 def build_blog_page(posts: List[PostBuildData],
-                    templates_dir: Path = TEMPLATE_DIR,
+                    templates: Optional[TemplateRegistry] = None,
                     site_build_dir: Path = BUILD_DIR,
                     post_build_dir: Path = POST_BUILD_DIR,
                     blog_page_path: Path = Path("blog.html"),
                     title: str = "Blog",
+                    manifest: Optional[BuildManifest] = None,
+                    manifest_group: str = "blog",
+                    thumbnails: Optional[Dict[str, ThumbnailSet]] = None,
+                    blocks: Optional[PostBlocks] = None,
+                    page_size: int = POSTS_PER_PAGE,
+                    writer: Optional[PageWriter] = None,
                     verbose: bool = False) -> None:
-    if verbose:
-        print(f"Building blog page")
-    
-    TemplatesBase: Environment = load_templates(templates_dir, verbose=verbose)
-    blog_page: Template = TemplatesBase.get_template("blog.html.jinja")
-    header: Template = TemplatesBase.get_template("header.html.jinja")
-    navbar: Template = TemplatesBase.get_template("navbar.html.jinja")
-
-    post_blocks = build_post_blocks(posts,
-                                    templates_dir,
-                                    post_build_dir,
-                                    verbose=verbose)
-    
-    blog_page_text: str = blog_page.render(
-        header=header.render(title="Blog"),
-        navbar=navbar.render(),
-        title=title,
-        posts="\n".join(post_blocks)
-    )
-    
-    with open(site_build_dir.joinpath(blog_page_path), 'w') as blog_file:
+    r"""Writes the listing of `posts` at `blog_page_path`, split into pages
+    of `page_size` posts: `blog.html`, `blog/2.html`, ... Each page gets
+    its number, the page count and links to the previous, next and every
+    other page, and a search box over the index `build_search_index`
+    writes.
+
+    With a manifest a page is only rewritten when the posts on it or the
+    number of pages changed. Pages left over from a longer listing are
+    removed when `manifest_group` is pruned.
+    """
+    from .search import SEARCH_DIR_NAME
+
+    templates = default_templates(templates)
+
+    pages: List[List[PostBuildData]] = paginate(posts, page_size)
+    page_count: int = len(pages)
+
+    blog_page: Template = templates.get_template("blog.html.jinja")
+    header: Template = templates.get_template("header.html.jinja")
+    navbar: Template = templates.get_template("navbar.html.jinja")
+
+    for number, page_posts in enumerate(pages, start=1):
+        out_path: Path = site_build_dir.joinpath(
+            listing_page_path(blog_page_path, number)
+        )
+
+        if manifest is not None:
+            inputs: Dict[str, str] = listing_inputs(
+                page_posts,
+                templates,
+                "blog.html.jinja",
+                manifest,
+                thumbnails
+            )
+            inputs["page"] = f"{number}/{page_count}"
+            if manifest.is_fresh(out_path, inputs):
+                continue
+
+        if verbose:
+            print(f"Building blog page {number} of {page_count}")
+
+        link_depth: int = 0 if number <= 1 else 1
+        post_blocks: List[str] = build_post_blocks(page_posts,
+                                                   templates,
+                                                   post_build_dir,
+                                                   link_depth,
+                                                   thumbnails=thumbnails,
+                                                   blocks=blocks,
+                                                   verbose=verbose)
+
+        blog_page_text: str = blog_page.render(
+            header=header.render(title="Blog", depth=link_depth * "../"),
+            navbar=navbar.render(depth=link_depth * "../"),
+            title=title,
+            posts="\n".join(post_blocks),
+            depth=link_depth * "../",
+            search_dir=SEARCH_DIR_NAME,
+            page=number,
+            page_count=page_count,
+            pages=[
+                {
+                    "number": other,
+                    "link": listing_page_link(blog_page_path, other, number),
+                    "current": other == number
+                }
+                for other in range(1, page_count + 1)
+            ],
+            prev_link=listing_page_link(blog_page_path, number - 1, number)
+                if number > 1 else None,
+            next_link=listing_page_link(blog_page_path, number + 1, number)
+                if number < page_count else None
+        )
+
         if verbose:
             print(
-                f"Writing page to {site_build_dir.joinpath(blog_page_path)}"
+                f"Writing page to {out_path}"
                 )
-        blog_file.write(blog_page_text)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        default_writer(writer).write(out_path, blog_page_text)
+
+        if manifest is not None:
+            manifest.record(out_path, inputs, manifest_group)
 
 
+@profiled()
 def build_tags_pages(posts: List[PostBuildData],
-                     templates_dir: Path = TEMPLATE_DIR,
+                     templates: Optional[TemplateRegistry] = None,
                      site_build_dir: Path = BUILD_DIR,
                      post_build_dir: Path = POST_BUILD_DIR,
+                     manifest: Optional[BuildManifest] = None,
+                     thumbnails: Optional[Dict[str, ThumbnailSet]] = None,
+                     blocks: Optional[PostBlocks] = None,
+                     page_size: int = POSTS_PER_PAGE,
+                     index: Optional[ContentIndex] = None,
+                     writer: Optional[PageWriter] = None,
                      verbose: bool = False) -> None:
-    tags_set: List[str] = []
-    for post in posts:
-        for tag in post.data.tags:
-            tags_set.append(tag)
+    templates = default_templates(templates)
+    if blocks is None:
+        blocks = PostBlocks(templates)
 
-    tags_set: Set[str] = set(tags_set)
+    if index is None:
+        index = ContentIndex(posts)
 
     if verbose:
-        print(f"Found tags {tags_set}")
-
-    tags_map: Dict[str, List[PostBuilData]] = {tag: [] for tag in tags_set}
+        print(f"Found tags {set(index.tags)}")
 
-    for post in posts:
-        for tag in post.data.tags:
-            tags_map[tag].append(post)
-
-    for tag in tags_map.keys():
-        build_blog_page(tags_map[tag],
-                        templates_dir = templates_dir,
+    for tag, tag_posts in index.tags.items():
+        build_blog_page(tag_posts,
+                        templates = templates,
                         site_build_dir = site_build_dir,
                         post_build_dir = post_build_dir,
                         blog_page_path = Path(f"{tag}.html"),
                         title = f"{tag} Blog Posts",
+                        manifest = manifest,
+                        manifest_group = "tags",
+                        thumbnails = thumbnails,
+                        blocks = blocks,
+                        page_size = page_size,
+                        writer = writer,
                         verbose = verbose
                         )
 
+    if manifest is not None:
+        manifest.prune("tags", verbose=verbose)
+
+
+def stream_posts(posts_data: List[PostData],
+                 post_src_dir: Path = POSTS_DIR,
+                 post_build_dir: Path = POST_BUILD_DIR,
+                 site_build_dir: Path = BUILD_DIR,
+                 templates: Optional[TemplateRegistry] = None,
+                 post_template_name: str = "post_temp.html.jinja",
+                 manifest: Optional[BuildManifest] = None,
+                 inputs: Optional[Dict[Path, Dict[str, str]]] = None,
+                 cache: Optional[ConversionCache] = None,
+                 backend: Optional[Any] = None,
+                 jobs: int = 1,
+                 media_cache_dir: Path = MEDIA_CACHE_DIR,
+                 writer: Optional[PageWriter] = None,
+                 verbose: bool = False) -> Iterator[PostBuildData]:
+    r"""Converts and writes each post in `posts_data`, then records it in
+    the manifest and copies its static files, yielding it before the next
+    post is taken on.
+
+    A post's HTML is dropped as soon as its page is written and only a few
+    posts per worker are converted ahead, see `parallel.imap_jobs`, so
+    memory is bounded by the largest posts in flight rather than the whole
+    corpus. Posts are recorded with their `inputs` when given, keyed by
+    page path, otherwise with the inputs read now.
+    """
+    from .parallel import imap_jobs
+
+    templates = default_templates(templates)
+
+    for post in imap_jobs(
+        partial(
+            build_post,
+            post_src_dir=post_src_dir,
+            site_build_dir=site_build_dir,
+            post_build_dir=post_build_dir,
+            templates=templates,
+            post_template_name=post_template_name,
+            backend=backend,
+            media_cache_dir=media_cache_dir,
+            verbose=verbose
+        ),
+        posts_data,
+        [f"post {post.directory}" for post in posts_data],
+        jobs=jobs if len(posts_data) > 1 else 1,
+        cache=cache,
+        writer=writer
+    ):
+        if manifest is not None:
+            manifest.record(
+                post.path,
+                inputs[post.path] if inputs is not None
+                else manifest.inputs(post_input_paths(
+                    post.data,
+                    post_src_dir,
+                    templates,
+                    post_template_name
+                )),
+                "posts"
+            )
+        copy_post_files(
+            post,
+            site_build_dir=site_build_dir,
+            post_src_dir=post_src_dir,
+            post_build_dir=post_build_dir,
+            manifest=manifest,
+            writer=writer,
+            verbose=verbose
+        )
+        yield post
+
+
+@profiled()
+def rebuild_posts(names: Tuple[str, ...],
+                  post_src_dir: Path = POSTS_DIR,
+                  post_build_dir: Path = POST_BUILD_DIR,
+                  site_build_dir: Path = BUILD_DIR,
+                  templates: Optional[TemplateRegistry] = None,
+                  post_template_name: str = "post_temp.html.jinja",
+                  manifest: Optional[BuildManifest] = None,
+                  cache: Optional[ConversionCache] = None,
+                  backend: Optional[Any] = None,
+                  jobs: int = 1,
+                  media_cache_dir: Path = MEDIA_CACHE_DIR,
+                  writer: Optional[PageWriter] = None,
+                  verbose: bool = False) -> List[PostBuildData]:
+    r"""Converts and writes the pages of the posts in the directories
+    `names` of `post_src_dir` and copies their static files, without
+    collecting the other posts or touching the listings.
+
+    The posts are rebuilt even when the manifest has them up to date, and
+    recorded in it so the next incremental build does not redo them. A
+    changed title or date reaches the listings on the next blog build.
+    """
+    templates = default_templates(templates)
+
+    posts_data: List[PostData] = []
+    for name in names:
+        json_path: Path = post_src_dir / name / "post.json"
+        if not json_path.is_file():
+            raise FileNotFoundError(f"No post {name} in {post_src_dir}")
+        posts_data.append(parse_post(json_path, post_src_dir))
+
+    return list(stream_posts(
+        posts_data,
+        post_src_dir=post_src_dir,
+        post_build_dir=post_build_dir,
+        site_build_dir=site_build_dir,
+        templates=templates,
+        post_template_name=post_template_name,
+        manifest=manifest,
+        cache=cache,
+        backend=backend,
+        jobs=jobs,
+        media_cache_dir=media_cache_dir,
+        writer=writer,
+        verbose=verbose
+    ))
+
+
+def prune_posts(manifest: BuildManifest, verbose: bool = False) -> None:
+    r"""Removes the outputs of deleted posts, along with the media extracted
+    beside their pages.
+    """
+    from .media import MEDIA_DIR_NAME
+
+    for key in manifest.prune("posts", verbose=verbose):
+        post_dir: Path = (manifest.build_dir / key).parent
+        if (post_dir / MEDIA_DIR_NAME).is_dir():
+            shutil.rmtree(post_dir / MEDIA_DIR_NAME)
+        if post_dir.is_dir() and not any(post_dir.iterdir()):
+            post_dir.rmdir()
+
+
 def build_blog(post_src_dir: Path = POSTS_DIR,
                post_build_dir: Path = POST_BUILD_DIR,
                site_build_dir: Path = BUILD_DIR,
-               templates_dir: Path = TEMPLATE_DIR,
+               templates: Optional[TemplateRegistry] = None,
                post_template_name: str = "post_temp.html.jinja",
+               manifest: Optional[BuildManifest] = None,
+               cache: Optional[ConversionCache] = None,
+               backend: Optional[Any] = None,
+               jobs: int = 1,
+               image_cache_dir: Path = IMAGE_CACHE_DIR,
+               blocks: Optional[PostBlocks] = None,
+               page_size: int = POSTS_PER_PAGE,
+               catalogue: Optional[MetadataCatalogue] = None,
+               writer: Optional[PageWriter] = None,
+               media_cache_dir: Path = MEDIA_CACHE_DIR,
                verbose: bool = False) -> List[PostBuildData]:
     r"""Builds the blog over several steps
+
+    When a manifest is given only posts whose post.json, source or templates
+    changed are converted and rendered, only changed static directories are
+    copied, and outputs of deleted posts are removed.
+
+    Listings show thumbnails of the post images, see
+    `images.build_thumbnails`.
+
+    With `jobs` greater than one posts are converted and rendered across a
+    pool of worker processes. Posts stream through conversion, writing and
+    copying one at a time, see `stream_posts`, and only their metadata is
+    kept for the listings.
+
+    The blog and tag pages share `blocks`, so every post's listing block is
+    rendered once, and list `page_size` posts per page. Post metadata comes
+    from `catalogue` when one is given.
+
+    Images embedded in converted posts are written to a `media` directory
+    beside each page, extractions are cached in `media_cache_dir`.
     """
+    from .assets import AssetStore
+    from .images import build_thumbnails
+
+    templates = default_templates(templates)
+    if blocks is None:
+        blocks = PostBlocks(templates)
+
     if verbose: 
         print("Starting blog construction")
 
-    posts: List[PostData] = collect_posts(
+    posts_data: List[PostData] = collect_posts(
         posts_src_dir=post_src_dir,
+        catalogue=catalogue,
         verbose=verbose
         )
 
-    if len(posts) == 0:
+    if len(posts_data) == 0:
+        if manifest is not None:
+            prune_posts(manifest, verbose=verbose)
+            for group in ("post_thumbs", "blog", "tags"):
+                manifest.prune(group, verbose=verbose)
         return []
 
     if verbose:
-        print(f"Collected {len(posts)} posts")
+        print(f"Collected {len(posts_data)} posts")
+
+    stale: List[PostData] = posts_data
+    inputs: Dict[Path, Dict[str, str]] = {}
+
+    if manifest is not None:
+        stale = []
+        for post in posts_data:
+            page_path: Path = post_page_path(post, site_build_dir)
+            inputs[page_path] = manifest.inputs(post_input_paths(
+                post,
+                post_src_dir,
+                templates,
+                post_template_name
+            ))
+            if not manifest.is_fresh(page_path, inputs[page_path]):
+                stale.append(post)
+
+        if verbose:
+            print(f"{len(posts_data) - len(stale)} posts are up to date")
     
-    posts: List[PostHTML] = [build_post_html(
-        post,
-        post_src_dir = post_src_dir,
-        verbose=verbose) for post in posts]
+    built: int = 0
+    for post in stream_posts(
+        stale,
+        post_src_dir=post_src_dir,
+        post_build_dir=post_build_dir,
+        site_build_dir=site_build_dir,
+        templates=templates,
+        post_template_name=post_template_name,
+        manifest=manifest,
+        inputs=inputs,
+        cache=cache,
+        backend=backend,
+        jobs=jobs,
+        media_cache_dir=media_cache_dir,
+        writer=writer,
+        verbose=verbose
+    ):
+        built += 1
+
+    if verbose:
+        print(f"Built {built} posts")
+        if cache is not None:
+            print(cache.summary())
 
     posts: List[PostBuildData] = [
-            build_post_page(post,
-                            site_build_dir=site_build_dir,
-                            post_build_dir=post_build_dir,
-                            templates_dir=templates_dir,
-                            post_template_name=post_template_name,
-                            verbose=verbose
-                            ) for post in posts
-        ]
+        post_build_data(post, site_build_dir) for post in posts_data
+    ]
+    index: ContentIndex = ContentIndex(posts)
 
+    # Up to date pages may still have changed static files
+    built_dirs: set = {post.directory for post in stale}
     for post in posts:
+        if post.data.directory in built_dirs:
+            continue
         copy_post_files(
             post,
             site_build_dir=site_build_dir,
             post_src_dir=post_src_dir,
             post_build_dir=post_build_dir,
+            manifest=manifest,
+            writer=writer,
             verbose=verbose
         )
+
+    if manifest is not None:
+        prune_posts(manifest, verbose=verbose)
+
+    thumbnails: Dict[str, ThumbnailSet] = build_thumbnails(
+        [site_build_dir / post_thumbnail(post.data) for post in posts],
+        image_cache_dir,
+        site_build_dir,
+        manifest=manifest,
+        manifest_group="post_thumbs",
+        jobs=jobs,
+        locate=AssetStore.load(site_build_dir, ASSETS_STATE_PATH).locate,
+        verbose=verbose
+    )
     
-    build_blog_page(posts,
-                    templates_dir,
+    build_blog_page(index.by_date,
+                    templates,
                     site_build_dir,
                     post_build_dir,
+                    manifest=manifest,
+                    thumbnails=thumbnails,
+                    blocks=blocks,
+                    page_size=page_size,
+                    writer=writer,
                     verbose=verbose)
+    if manifest is not None:
+        manifest.prune("blog", verbose=verbose)
 
     build_tags_pages(posts,
-                     templates_dir = templates_dir,
+                     templates = templates,
                      site_build_dir = site_build_dir,
                      post_build_dir = post_build_dir,
+                     manifest = manifest,
+                     thumbnails = thumbnails,
+                     blocks = blocks,
+                     page_size = page_size,
+                     index = index,
+                     writer = writer,
                      verbose = verbose)
     return posts
 
@@ -509,33 +1198,45 @@ class ProjectData(NamedTuple):
     description: str
 
 
+def project_from_json(proj_json: Dict[str, Any]) -> ProjectData:
+    return ProjectData(
+        Path(proj_json["file_path"]),
+        Path(proj_json["proj_dir"]),
+        proj_json["format"],
+        Path(proj_json["static_dir"]),
+        Path(proj_json["thumbnail"]),
+        proj_json["project"],
+        datetime.date(
+            day=proj_json["day"],
+            month=proj_json["month"],
+            year=proj_json["year"]
+        ),
+        proj_json["description"]
+    )
+
+
 def parse_proj(proj_json_path: Path,
                proj_src_dir: Path = PROJS_DIR) -> ProjectData:
     
     with open(proj_json_path, 'r') as file:
-        proj_json: Dict[str, Any] = json.load(file)
-
-        data: ProjectData = ProjectData(
-            Path(proj_json["file_path"]),
-            Path(proj_json["proj_dir"]),
-            proj_json["format"],
-            Path(proj_json["static_dir"]),
-            Path(proj_json["thumbnail"]),
-            proj_json["project"],
-            datetime.date(
-                day=proj_json["day"],
-                month=proj_json["month"],
-                year=proj_json["year"]
-            ),
-            proj_json["description"]
-        )
-
-        return data
+        return project_from_json(json.load(file))
 
 
 def collect_projects(proj_src_dir: Path = PROJS_DIR,
                      site_src_dir: Path = SRC_DIR,
+                     catalogue: Optional[MetadataCatalogue] = None,
                      verbose: bool = True) -> List[ProjectData]:
+    r"""Reads the proj.json of every project under `proj_src_dir`. With a
+    `catalogue` only new and changed proj.json files are read and parsed.
+    """
+    if catalogue is not None:
+        return catalogue.documents(
+            proj_src_dir,
+            "project",
+            "proj.json",
+            project_from_json,
+            verbose=verbose
+        )
     proj_list: List(str) = glob.glob("*/proj.json", root_dir=proj_src_dir)
     if verbose:
         print(f"Collecting Posts in {proj_src_dir}")
@@ -553,28 +1254,189 @@ class ProjectHTML(NamedTuple):
     proj_src: str
 
 
-def build_project_page_html(project: ProjectData,
-                            posts: List[PostBuildData],
-                            templates_dir: Path = TEMPLATE_DIR,
-                            projects_src_dir: Path = PROJS_DIR,
-                            site_build_dir: Path = BUILD_DIR,
-                            post_build_dir: Path = POST_BUILD_DIR,
-                            projects_build_dir: Path = PROJS_BUILD_DIR,
-                            verbose: bool = True
-                            ) -> List[ProjectHTML]:
-    proj_posts: Set[PostBuildData] = set()
-    for post in posts:
-        if post.data.project is not None and project.name in post.data.project:
-            proj_posts.add(post)
+def project_thumbnail(project: ProjectData) -> str:
+    r"""Path of a project's thumbnail relative to the site root."""
+    return (Path("projects") / project.directory / project.thumbnail).as_posix()
+
+
+def project_page_path(project: ProjectData,
+                      projects_build_dir: Path = PROJS_BUILD_DIR) -> Path:
+    return projects_build_dir.joinpath(
+        project.directory,
+        project.path.stem + ".html"
+    )
+
+
+def project_input_paths(project: ProjectData,
+                        projects_src_dir: Path = PROJS_DIR,
+                        templates: Optional[TemplateRegistry] = None) -> List[Path]:
+    return [
+        projects_src_dir.joinpath(project.directory, "proj.json"),
+        projects_src_dir.joinpath(project.directory, project.path),
+        *default_templates(templates).paths(
+            ("project_page.html.jinja", *PAGE_TEMPLATES, *BLOCK_TEMPLATES)
+        )
+    ]
+
 
-    TemplatesBase: Environment = load_templates(
-        templates_dir,
-        verbose
+def index_post(index: SearchIndex,
+               post: PostData,
+               post_src_dir: Path = POSTS_DIR,
+               cache: Optional[ConversionCache] = None,
+               backend: Optional[Any] = None,
+               verbose: bool = False) -> bool:
+    r"""Adds the terms of `post` to `index` unless they are up to date,
+    returning whether the post was indexed. Posts are indexed on their
+    title, description, tags and the text of the HTML `build_post_html`
+    converts them to.
+    """
+    from .search import SearchIndex, html_text
+
+    name: str = str(post.directory)
+    key: str = SearchIndex.key(
+        post,
+        hash_file(post_src_dir / post.directory / post.path)
     )
+    if index.is_fresh(name, key):
+        return False
 
-    header: Template = TemplatesBase.get_template("header.html.jinja")
-    navbar: Template = TemplatesBase.get_template("navbar.html.jinja")
-    proj_page: Template = TemplatesBase.get_template("project_page.html.jinja")
+    if verbose:
+        print(f"Indexing {post.path} for search")
+    post_html: PostHTML = build_post_html(
+        post,
+        post_src_dir=post_src_dir,
+        cache=cache,
+        backend=backend
+    )
+    index.add(
+        name,
+        key,
+        {
+            "title": post.title,
+            "description": post.description,
+            "date": render_date_string(post.date),
+            "link": post_page_path(post, Path("")).as_posix()
+        },
+        {
+            "title": post.title,
+            "tags": " ".join(post.tags),
+            "description": post.description,
+            "body": html_text(post_html.post_src)
+        }
+    )
+    return True
+
+
+def write_search_index(index: SearchIndex,
+                       site_build_dir: Path = BUILD_DIR,
+                       indexed: int = 0,
+                       start: Optional[float] = None,
+                       writer: Optional[PageWriter] = None,
+                       verbose: bool = False) -> SearchReport:
+    r"""Writes the shards of `index` and `index.json` to `search/`. Shards
+    whose contents did not change are not rewritten, shards left without
+    terms are removed.
+    """
+    from .search import INDEX_NAME, SEARCH_DIR_NAME, SearchReport, dump_json
+
+    if start is None:
+        start = time.perf_counter()
+
+    search_dir: Path = site_build_dir / SEARCH_DIR_NAME
+    search_dir.mkdir(parents=True, exist_ok=True)
+    shards: Dict[str, Dict[str, List[List]]] = index.shards()
+    files: Dict[str, str] = {
+        f"{shard}.json": dump_json(terms) for shard, terms in shards.items()
+    }
+    files[INDEX_NAME] = dump_json(index.manifest(shards))
+    for file_name, text in files.items():
+        default_writer(writer).write(search_dir / file_name, text)
+    for path in search_dir.glob("*.json"):
+        if path.name not in files:
+            os.remove(path)
+
+    report: SearchReport = SearchReport(
+        len(index.documents),
+        indexed,
+        sum(len(terms) for terms in shards.values()),
+        len(shards),
+        sum(len(text.encode('utf-8')) for text in files.values()),
+        time.perf_counter() - start
+    )
+    if verbose:
+        print(report)
+    return report
+
+
+@profiled()
+def build_search_index(post_src_dir: Path = POSTS_DIR,
+                       site_build_dir: Path = BUILD_DIR,
+                       cache: Optional[ConversionCache] = None,
+                       backend: Optional[Any] = None,
+                       catalogue: Optional[MetadataCatalogue] = None,
+                       index_path: Path = SEARCH_CACHE_PATH,
+                       prefix_length: Optional[int] = None,
+                       writer: Optional[PageWriter] = None,
+                       verbose: bool = False) -> SearchReport:
+    r"""Writes the client-side search index of the posts to `search/`, see
+    `search.SearchIndex`.
+
+    The terms of each post are cached in `index_path` with a digest of its
+    metadata and source, so only new and changed posts are converted again,
+    through `cache` they are usually pandoc cache hits after the blog
+    stage. See `index_post` and `write_search_index`.
+
+    Arguments
+    ---------
+
+    index_path: File the per-post terms are cached in
+
+    prefix_length: Length of the term prefixes the index is sharded by,
+    `search.PREFIX_LENGTH` by default
+
+    """
+    from .search import PREFIX_LENGTH, SearchIndex
+
+    if prefix_length is None:
+        prefix_length = PREFIX_LENGTH
+    start: float = time.perf_counter()
+    index: SearchIndex = SearchIndex.load(index_path, prefix_length)
+
+    posts_data: List[PostData] = collect_posts(
+        posts_src_dir=post_src_dir,
+        catalogue=catalogue
+    )
+    indexed: int = 0
+    for post in posts_data:
+        if index_post(
+            index,
+            post,
+            post_src_dir=post_src_dir,
+            cache=cache,
+            backend=backend,
+            verbose=verbose
+        ):
+            indexed += 1
+    index.retain(str(post.directory) for post in posts_data)
+
+    report: SearchReport = write_search_index(
+        index,
+        site_build_dir,
+        indexed=indexed,
+        start=start,
+        writer=writer,
+        verbose=verbose
+    )
+    index.save()
+    return report
+
+
+def convert_project(project: ProjectData,
+                    projects_src_dir: Path = PROJS_DIR,
+                    cache: Optional[ConversionCache] = None,
+                    backend: Optional[Any] = None) -> str:
+    r"""The HTML pandoc converts a project's source document to."""
+    from .convert import convert
 
     proj_src_path: Path = projects_src_dir.joinpath(
         project.directory,
@@ -583,16 +1445,57 @@ def build_project_page_html(project: ProjectData,
 
     with open(proj_src_path, 'r') as proj_file:
         proj_text: str = proj_file.read()
-        proj_info: Any = pandoc.read(proj_text, format=project.format)
-        proj_html: str = pandoc.write(proj_info, format="html")
-   
+    with span("pandoc", "pandoc", document=str(project.directory)):
+        return convert(
+            proj_text,
+            project.format,
+            cache=cache,
+            backend=backend
+        )
+
+
+def build_project_page_html(project: ProjectData,
+                            index: ContentIndex,
+                            templates: Optional[TemplateRegistry] = None,
+                            projects_src_dir: Path = PROJS_DIR,
+                            site_build_dir: Path = BUILD_DIR,
+                            post_build_dir: Path = POST_BUILD_DIR,
+                            projects_build_dir: Path = PROJS_BUILD_DIR,
+                            cache: Optional[ConversionCache] = None,
+                            backend: Optional[Any] = None,
+                            thumbnails: Optional[Dict[str, ThumbnailSet]] = None,
+                            blocks: Optional[PostBlocks] = None,
+                            proj_html: Optional[str] = None,
+                            verbose: bool = True
+                            ) -> List[ProjectHTML]:
+    r"""Renders a project's page with the blocks of its posts. The project
+    document is converted unless `proj_html` gives its converted HTML.
+    """
+    proj_posts: List[PostBuildData] = index.project_posts(project.name)
+
+    templates = default_templates(templates)
+
+    header: Template = templates.get_template("header.html.jinja")
+    navbar: Template = templates.get_template("navbar.html.jinja")
+    proj_page: Template = templates.get_template("project_page.html.jinja")
+
+    if proj_html is None:
+        proj_html = convert_project(
+            project,
+            projects_src_dir,
+            cache=cache,
+            backend=backend
+        )
+
     proj_post_blocks: List[str] = build_post_blocks(
-        list(proj_posts),
-        templates_dir,
+        proj_posts,
+        templates,
         post_build_dir,
         2,
         date_sort,
         reverse_cron = False,
+        thumbnails = thumbnails,
+        blocks = blocks,
         verbose = verbose
     )
 
@@ -620,29 +1523,69 @@ def write_project(
     project: ProjectHTML,
     site_build_dir: Path = BUILD_DIR,
     projects_build_dir: Path = PROJS_BUILD_DIR,
+    writer: Optional[PageWriter] = None,
     verbose: bool = False
     ) -> ProjectBuildData:
 
-    proj_dir: Path = projects_build_dir / project.data.directory
+    proj_path: Path = project_page_path(project.data, projects_build_dir)
 
-    proj_path = proj_dir.joinpath(project.data.path.stem + ".html")
+    proj_dir: Path = proj_path.parent
 
     if verbose:
         print(f"writing project to {proj_path}")
 
     proj_dir.mkdir(parents=True, exist_ok=True)
 
-    with open(proj_path, "w") as proj_file:
-        proj_file.write(project.proj_src)
+    default_writer(writer).write(proj_path, project.proj_src)
 
     return ProjectBuildData(proj_path, proj_dir, project.data)
 
 
+def build_project(project: ProjectData,
+                  index: ContentIndex,
+                  templates: Optional[TemplateRegistry] = None,
+                  projects_src_dir: Path = PROJS_DIR,
+                  site_build_dir: Path = BUILD_DIR,
+                  posts_build_dir: Path = POST_BUILD_DIR,
+                  projects_build_dir: Path = PROJS_BUILD_DIR,
+                  cache: Optional[ConversionCache] = None,
+                  backend: Optional[Any] = None,
+                  thumbnails: Optional[Dict[str, ThumbnailSet]] = None,
+                  blocks: Optional[PostBlocks] = None,
+                  writer: Optional[PageWriter] = None,
+                  verbose: bool = False) -> ProjectBuildData:
+    r"""Converts a project and writes its page, the unit of work handed to
+    worker processes by `build_projects`.
+    """
+    return write_project(
+        build_project_page_html(
+            project,
+            index,
+            templates,
+            projects_src_dir,
+            site_build_dir,
+            posts_build_dir,
+            projects_build_dir,
+            cache = cache,
+            backend = backend,
+            thumbnails = thumbnails,
+            blocks = blocks,
+            verbose = verbose
+        ),
+        site_build_dir,
+        projects_build_dir,
+        writer = writer,
+        verbose = verbose
+    )
+
+
 def copy_project_files(
     project: ProjectBuildData,
     site_build_dir: Path = BUILD_DIR,
     projects_src_dir: Path = PROJS_DIR,
     projects_build_dir: Path = PROJS_BUILD_DIR,
+    manifest: Optional[BuildManifest] = None,
+    writer: Optional[PageWriter] = None,
     verbose: bool = False
     ) -> None:
 
@@ -650,34 +1593,58 @@ def copy_project_files(
         return None
     else:
         new_static_dir: Path = projects_build_dir / project.data.directory / "static"
+        static_src_dir: Path = projects_src_dir.joinpath(
+            project.data.directory,
+            project.data.static
+        )
 
-        if not new_static_dir.exists():
-            new_static_dir.mkdir()
+        if manifest is not None:
+            inputs: Dict[str, str] = manifest.inputs([static_src_dir])
+            if manifest.is_fresh(new_static_dir, inputs):
+                return None
 
-        shutil.copytree(
-            projects_src_dir.joinpath(
-                project.data.directory,
-                project.data.static
-            ),
-            new_static_dir,
-            dirs_exist_ok=True
-        )
+        sync_static(static_src_dir, new_static_dir, site_build_dir, writer)
+
+        if manifest is not None:
+            manifest.record(new_static_dir, inputs, "projects")
 
 
 def build_projects_page(
         projects: List[ProjectBuildData],
-        templates_dir: Path = TEMPLATE_DIR,
+        templates: Optional[TemplateRegistry] = None,
         site_build_dir: Path = BUILD_DIR,
         projects_build_dir: Path = PROJS_BUILD_DIR,
+        manifest: Optional[BuildManifest] = None,
+        thumbnails: Optional[Dict[str, ThumbnailSet]] = None,
+        writer: Optional[PageWriter] = None,
         verbose: bool = False
     ) -> None:
 
-    if verbose:
-        print("Building project page")
+    from .images import thumbnail_context, thumbnails_digest
+
+    templates = default_templates(templates)
 
-    TemplatesBase: Environment = load_templates(templates_dir, verbose)
+    out_path: Path = site_build_dir.joinpath("projects.html")
+
+    if manifest is not None:
+        inputs: Dict[str, str] = manifest.inputs(templates.paths(
+            ("projects.html.jinja", "project_block.html.jinja", *PAGE_TEMPLATES)
+        ))
+        inputs["projects"] = hash_value(
+            sorted((proj.data for proj in projects),
+                   key=lambda x : str(x.directory))
+        )
+        inputs["thumbnails"] = thumbnails_digest(
+            sorted(project_thumbnail(proj.data) for proj in projects),
+            thumbnails
+        )
+        if manifest.is_fresh(out_path, inputs):
+            return
 
-    proj_block_template: Template = TemplatesBase.get_template("project_block.html.jinja")
+    if verbose:
+        print("Building projects page")
+
+    proj_block_template: Template = templates.get_template("project_block.html.jinja")
     
     cron_sort = lambda x : x.data.date
 
@@ -692,16 +1659,16 @@ def build_projects_page(
         proj_blocks.append(
             proj_block_template.render(
                 title=project.data.name,
-                img_link=Path("projects") / project.data.directory / project.data.thumbnail,
+                **thumbnail_context(project_thumbnail(project.data), thumbnails),
                 link=Path("projects") / project.data.directory / (project.data.path.stem + ".html"),
                 data=render_date_string(project.data.date),
                 summary=project.data.description
             )
         )
     
-    header: Environment = TemplatesBase.get_template("header.html.jinja")
-    navbar: Environment = TemplatesBase.get_template("navbar.html.jinja")
-    proj_page_template: Environment = TemplatesBase.get_template(
+    header: Environment = templates.get_template("header.html.jinja")
+    navbar: Environment = templates.get_template("navbar.html.jinja")
+    proj_page_template: Environment = templates.get_template(
         "projects.html.jinja"
     )
 
@@ -712,52 +1679,66 @@ def build_projects_page(
     )
 
     if verbose:
-        print(f"Writing page to {site_build_dir.joinpath('projects.html')}")
+        print(f"Writing page to {out_path}")
 
-    with open(site_build_dir.joinpath("projects.html"), 'w') as projs_file:
-        projs_file.write(proj_page_text)
+    default_writer(writer).write(out_path, proj_page_text)
 
+    if manifest is not None:
+        manifest.record(out_path, inputs, "projects_page")
 
+
+@profiled()
 def build_projects(posts: List[PostBuildData],
                    projects_src_dir: Path = PROJS_DIR,
-                   templates_dir: Path = TEMPLATE_DIR,
+                   templates: Optional[TemplateRegistry] = None,
                    site_src_dir: Path = SRC_DIR,
                    site_build_dir: Path = BUILD_DIR,
                    posts_build_dir: Path = POST_BUILD_DIR,
                    projects_build_dir: Path = PROJS_BUILD_DIR,
+                   manifest: Optional[BuildManifest] = None,
+                   cache: Optional[ConversionCache] = None,
+                   backend: Optional[Any] = None,
+                   jobs: int = 1,
+                   image_cache_dir: Path = IMAGE_CACHE_DIR,
+                   blocks: Optional[PostBlocks] = None,
+                   catalogue: Optional[MetadataCatalogue] = None,
+                   writer: Optional[PageWriter] = None,
                    verbose: bool = False) -> None:
+    r"""Builds a page for every project and the projects listing page,
+    across a pool of `jobs` worker processes when `jobs` is greater than
+    one.
+
+    When a manifest is given a project page is only rebuilt when its
+    proj.json, source, templates or the metadata or thumbnails of its posts
+    changed.
+    """
+    from .assets import AssetStore
+    from .images import build_thumbnails, thumbnails_digest
+    from .parallel import map_jobs
+
+    templates = default_templates(templates)
+
     if verbose:
         print("Starting projects construction")
 
     projs_data: List[ProjectData] = collect_projects(
         projects_src_dir,
         site_src_dir,
+        catalogue = catalogue,
         verbose = verbose
     )
 
     if verbose:
         print(f"Collected {len(projs_data)}")
 
-    proj_html: List[ProjectHTML] = [
-            build_project_page_html(
-                project,
-                posts,
-                templates_dir,
-                projects_src_dir,
-                site_build_dir,
-                posts_build_dir,
-                projects_build_dir,
-                verbose = verbose
-            ) for project in projs_data
-    ]
+    index: ContentIndex = ContentIndex(posts)
 
-    proj_builds: List[PostBuildData] = [
-        write_project(
-            project,
-            site_build_dir,
-            projects_build_dir,
-            verbose = verbose
-        ) for project in proj_html
+    proj_builds: List[ProjectBuildData] = [
+        ProjectBuildData(
+            project_page_path(project, projects_build_dir),
+            projects_build_dir / project.directory,
+            project
+        ) for project in projs_data
     ]
 
     for proj in proj_builds:
@@ -766,65 +1747,329 @@ def build_projects(posts: List[PostBuildData],
             site_build_dir,
             projects_src_dir,
             projects_build_dir,
+            manifest = manifest,
+            writer = writer,
             verbose = verbose
         )
 
-    if verbose:
-        print("Building projects page")
+    thumbnails: Dict[str, ThumbnailSet] = build_thumbnails(
+        [
+            site_build_dir / image for image in (
+                *(post_thumbnail(post.data) for post in posts),
+                *(project_thumbnail(project) for project in projs_data)
+            )
+        ],
+        image_cache_dir,
+        site_build_dir,
+        manifest = manifest,
+        manifest_group = "project_thumbs",
+        jobs = jobs,
+        locate = AssetStore.load(site_build_dir, ASSETS_STATE_PATH).locate,
+        verbose = verbose
+    )
+
+    stale: List[ProjectData] = projs_data
+    inputs: Dict[Path, Dict[str, str]] = {}
+
+    if manifest is not None:
+        stale = []
+        for project in projs_data:
+            proj_path: Path = project_page_path(project, projects_build_dir)
+            inputs[proj_path] = manifest.inputs(project_input_paths(
+                project,
+                projects_src_dir,
+                templates
+            ))
+            inputs[proj_path]["posts"] = hash_value(sorted(
+                (post.data for post in index.project_posts(project.name)),
+                key=lambda x : str(x.directory)
+            ))
+            inputs[proj_path]["thumbnails"] = thumbnails_digest(
+                sorted(
+                    post_thumbnail(post.data)
+                    for post in index.project_posts(project.name)
+                ),
+                thumbnails
+            )
+            if not manifest.is_fresh(proj_path, inputs[proj_path]):
+                stale.append(project)
+
+        if verbose:
+            print(f"{len(projs_data) - len(stale)} projects are up to date")
+
+    built: List[ProjectBuildData] = map_jobs(
+        partial(
+            build_project,
+            index = index,
+            templates = templates,
+            projects_src_dir = projects_src_dir,
+            site_build_dir = site_build_dir,
+            posts_build_dir = posts_build_dir,
+            projects_build_dir = projects_build_dir,
+            backend = backend,
+            thumbnails = thumbnails,
+            blocks = blocks,
+            verbose = verbose
+        ),
+        stale,
+        [f"project {project.directory}" for project in stale],
+        jobs = jobs,
+        cache = cache,
+        writer = writer
+    )
+
+    if verbose and cache is not None:
+        print(cache.summary())
+
+    if manifest is not None:
+        for proj in built:
+            manifest.record(proj.path, inputs[proj.path], "projects")
+
+    if manifest is not None:
+        manifest.prune("projects", verbose=verbose)
 
     build_projects_page(
         proj_builds,
-        templates_dir,
+        templates,
         site_build_dir,
         projects_build_dir,
+        manifest = manifest,
+        thumbnails = thumbnails,
+        writer = writer,
         verbose = verbose
     )
 
 
+@profiled()
 def build_games(games_dir: Path = GAMES_DIR,
                 games_build_dir: Path = GAMES_BUILD_DIR,
                 build_dir: Path = BUILD_DIR,
-                templates_dir: Path = TEMPLATE_DIR) -> None:
+                templates: Optional[TemplateRegistry] = None,
+                manifest: Optional[BuildManifest] = None,
+                writer: Optional[PageWriter] = None) -> None:
    
     make_build_dir(games_build_dir)
 
-    TemplatesBase: Environment = load_templates(templates_dir=templates_dir)
+    templates = default_templates(templates)
+    writer = default_writer(writer)
 
-    Pages: Environment = Environment(
-        loader=FileSystemLoader(games_dir),
-    )
+    Pages: Environment = templates.pages(games_dir)
 
+    for page in glob.glob(f"{games_dir}/*.html.jinja"):
+        page_path: Path = Path(page)
+        out_path: Path = games_build_dir.joinpath(page_path.stem)
+
+        if manifest is not None:
+            inputs: Dict[str, str] = manifest.inputs([
+                *templates.page_paths(games_dir, page_path.name),
+                *templates.paths(PAGE_TEMPLATES)
+            ])
+            if manifest.is_fresh(out_path, inputs):
+                continue
+
+        page_text: str = render_source_page(
+            page_path,
+            Pages,
+            templates,
+            depth="../"
+        )
 
-    header: Template = TemplatesBase.get_template("header.html.jinja")
-    navbar: Template = TemplatesBase.get_template("navbar.html.jinja")
+        writer.write(out_path, page_text)
 
+        if manifest is not None:
+            manifest.record(out_path, inputs, "games")
 
-    for page in glob.glob(f"{games_dir}/*.html.jinja"):
-        page_path: Path = Path(page)
+    if manifest is not None:
+        manifest.prune("games")
 
-        page_temp: Template = Pages.get_template(
-            page_path.stem + page_path.suffix
-            )
+    copy_static(
+        games_dir / "static",
+        games_build_dir,
+        manifest=manifest,
+        writer=writer
+    )
+    copy_static(
+        games_dir / "scripts",
+        games_build_dir,
+        "scripts",
+        manifest=manifest,
+        writer=writer
+    )
+
+
+@profiled()
+def fingerprint_assets(site_build_dir: Path = BUILD_DIR,
+                       state_path: Path = ASSETS_STATE_PATH,
+                       verbose: bool = False) -> AssetReport:
+    r"""Moves the static files of the site, posts and projects into
+    `assets/` under content hashed names and rewrites the links to them,
+    see `assets.AssetStore`. Runs after every page is written.
+    """
+    from .assets import AssetStore
+
+    return AssetStore.load(site_build_dir, state_path).fingerprint(
+        verbose=verbose
+    )
 
-        page_title: str = "Alia Lescoulie" if page_path.stem == "index.html" \
-            else f"{str(page_path.stem)[:-5].capitalize()} - Alia Lescoulie"
 
-        page_header: str = header.render(title=page_title, depth="../")
+SITE_STAGES: Final[Tuple[str, ...]] = (
+    "static",
+    "pages",
+    "blog",
+    "projects",
+    "search",
+    "games",
+    "assets",
+    "compress"
+)
+
+
+def build_site(stages: Tuple[str, ...] = SITE_STAGES,
+               templates: Optional[TemplateRegistry] = None,
+               manifest: Optional[BuildManifest] = None,
+               cache: Optional[ConversionCache] = None,
+               backend: Optional[Any] = None,
+               jobs: int = 1,
+               writer: Optional[PageWriter] = None,
+               page_size: int = POSTS_PER_PAGE,
+               catalogue: Optional[MetadataCatalogue] = None,
+               verbose: bool = False) -> None:
+    r"""Runs the given stages of the production build in order.
+
+    Running only some stages is how watch mode rebuilds part of the site,
+    with a manifest each stage still skips outputs that are up to date. The
+    last stages fingerprint the static files and write precompressed
+    siblings of the text outputs.
+    The template references followed along the way are added to the
+    manifest's template graph. Each stage is a span when profiling. Post
+    and project metadata is read through `catalogue` when one is given.
+    """
+    from .compress import compress_site
+
+    templates = default_templates(templates)
+    blocks: PostBlocks = PostBlocks(templates)
+
+    if "static" in stages:
+        with span("static", "build"):
+            copy_static(manifest=manifest, writer=writer)
+    if "pages" in stages:
+        with span("pages", "build"):
+            build_pages(templates=templates, manifest=manifest, writer=writer)
+
+    posts: Optional[List[PostBuildData]] = None
+    if "blog" in stages:
+        with span("blog", "build"):
+            posts = build_blog(
+                templates=templates,
+                manifest=manifest,
+                cache=cache,
+                backend=backend,
+                jobs=jobs,
+                blocks=blocks,
+                page_size=page_size,
+                catalogue=catalogue,
+                writer=writer,
+                verbose=verbose
+            )
+    if "projects" in stages:
+        with span("projects", "build"):
+            if posts is None:
+                posts = [
+                    post_build_data(post)
+                    for post in collect_posts(catalogue=catalogue)
+                ]
+            build_projects(
+                posts,
+                templates=templates,
+                manifest=manifest,
+                cache=cache,
+                backend=backend,
+                jobs=jobs,
+                blocks=blocks,
+                catalogue=catalogue,
+                writer=writer,
+                verbose=verbose
+            )
+    if "search" in stages:
+        with span("search", "build"):
+            build_search_index(
+                cache=cache,
+                backend=backend,
+                catalogue=catalogue,
+                writer=writer,
+                verbose=verbose
+            )
+    if "games" in stages:
+        with span("games", "build"):
+            build_games(templates=templates, manifest=manifest, writer=writer)
+    if writer is not None:
+        # Pages queued on a background writer must be on disk before their
+        # links are rewritten and they are compressed
+        writer.flush()
+    if "assets" in stages:
+        with span("assets", "build"):
+            fingerprint_assets(verbose=verbose)
+    if "compress" in stages:
+        with span("compress", "build"):
+            compress_site(BUILD_DIR, manifest=manifest, verbose=verbose)
+
+    if manifest is not None:
+        manifest.templates.update(templates.graph())
+
+
+def template_sources() -> List[Path]:
+    r"""Every template the site is rendered from, the shared templates as
+    well as the page templates in `site_src` and the games directory.
+    """
+    return sorted([
+        *(path for path in TEMPLATE_DIR.iterdir() if path.is_file()),
+        *SRC_DIR.glob("*.jinja"),
+        *GAMES_DIR.glob("*.jinja")
+    ])
 
-        page_text: str = page_temp.render(
-                header=page_header,
-                navbar=navbar.render(depth="../"))
 
-        with open(
-                games_build_dir.joinpath(page_path.stem),
-                'w',
-                encoding='utf-8'
-                 ) as file:
+def find_template(name: str) -> Path:
+    r"""The template source called `name`, either a file name in one of the
+    template directories or a path to the template.
+    """
+    for root in (TEMPLATE_DIR, SRC_DIR, GAMES_DIR):
+        if (root / name).is_file():
+            return root / name
+    path: Path = Path(name).resolve()
+    for source in template_sources():
+        if source.resolve() == path:
+            return source
+    raise FileNotFoundError(f"No template named {name}")
+
+
+def rebuild_report(manifest: BuildManifest,
+                   names: Tuple[str, ...] = ()) -> Dict[Path, List[str]]:
+    r"""The outputs a change to each template in `names` would rebuild. With
+    no names, the outputs invalidated by templates edited since the build
+    `manifest` describes.
+    """
+    if names:
+        paths: List[Path] = [find_template(name) for name in names]
+    else:
+        paths = manifest.changed(template_sources())
+    return {path: manifest.dependents(path) for path in paths}
 
-            file.write(page_text)
 
-    copy_static(games_dir / "static", games_build_dir)
-    copy_static(games_dir / "scripts", games_build_dir, "scripts")
+def load_manifest(settings: Dict[str, Any],
+                  build_dir: Path = BUILD_DIR,
+                  verbose: bool = False) -> BuildManifest:
+    r"""The manifest of the last build in `build_dir`, unless it was made
+    with different `settings` (e.g. minification), in which case the old
+    output is cleaned and a new manifest started.
+    """
+    manifest: BuildManifest = BuildManifest.load(build_dir)
+    if manifest.entries and manifest.settings != settings:
+        if verbose:
+            print("Build settings changed, rebuilding everything")
+        clean(build_dir)
+        manifest = BuildManifest(build_dir)
+    manifest.settings = settings
+    return manifest
 
 
 def clean(build_dir: Path = BUILD_DIR):
@@ -0,0 +1,203 @@
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Final,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple
+)
+
+import os
+
+from pathlib import Path
+
+import json
+
+import pickle
+
+import sqlite3
+
+
+# Bumped whenever the schema or the classes `documents` caches change, older
+# catalogues are rebuilt
+CATALOGUE_VERSION: Final[str] = "2"
+
+SCHEMA: Final[str] = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    parsed BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_root ON documents (root, kind);
+"""
+
+
+def names(value: Any) -> List[str]:
+    r"""A metadata field holding names as a list, the field may also be a
+    single name or missing.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+class CatalogueSync(NamedTuple):
+    # Metadata files parsed again because they are new or changed
+    changed: List[str]
+    removed: List[str]
+    unchanged: int
+
+
+class MetadataCatalogue:
+    r"""SQLite catalogue of the post.json and proj.json files of the source
+    trees, kept in the build cache.
+
+    `documents` lists a tree's metadata after bringing the catalogue up to
+    date: a file is only read and parsed again when its mtime or size
+    changed, rows of deleted files are dropped and new directories are
+    picked up, so renaming a post directory is a delete and an add. Each
+    row holds the object the metadata was parsed into, so unchanged files
+    are not parsed on later builds. What the latest sync of a tree changed
+    is kept in `last_sync`.
+
+    Arguments
+    ---------
+
+    path: The SQLite database file, created if missing
+
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path: Path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db: sqlite3.Connection = sqlite3.connect(path)
+        self.last_sync: Dict[Tuple[str, str], CatalogueSync] = {}
+
+        version: Optional[str] = None
+        try:
+            version = self._meta("version")
+        except sqlite3.OperationalError:
+            pass
+        if version != CATALOGUE_VERSION:
+            with self.db:
+                self.db.execute("DROP TABLE IF EXISTS documents")
+                self.db.execute("DROP TABLE IF EXISTS links")
+                self.db.execute("DROP TABLE IF EXISTS meta")
+        self.db.executescript(SCHEMA)
+        if version != CATALOGUE_VERSION:
+            with self.db:
+                self._set_meta("version", CATALOGUE_VERSION)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def _meta(self, key: str) -> Optional[str]:
+        row: Optional[Tuple[str]] = self.db.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, value)
+        )
+
+    def sync(self,
+             root: Path,
+             kind: str,
+             file_name: str,
+             parse: Callable[[Dict[str, Any]], Any],
+             verbose: bool = False) -> CatalogueSync:
+        r"""Brings the rows of the `file_name` files in the subdirectories of
+        `root` up to date with the files on disk, storing what `parse`
+        makes of each new or changed file.
+        """
+        found: Dict[str, os.stat_result] = {}
+        if root.is_dir():
+            for entry in os.scandir(root):
+                if not entry.is_dir():
+                    continue
+                path: str = os.path.join(entry.path, file_name)
+                try:
+                    found[path] = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+        known: Dict[str, Tuple[int, int]] = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.db.execute(
+                "SELECT path, mtime_ns, size FROM documents "
+                "WHERE root = ? AND kind = ?",
+                (str(root), kind)
+            )
+        }
+        changed: List[str] = sorted(
+            path for path, stat in found.items()
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size)
+        )
+        removed: List[str] = sorted(set(known) - set(found))
+
+        with self.db:
+            for path in (*removed, *changed):
+                self.db.execute("DELETE FROM documents WHERE path = ?", (path,))
+            for path in changed:
+                with open(path, 'r') as file:
+                    data: Dict[str, Any] = json.load(file)
+                self.db.execute(
+                    "INSERT INTO documents "
+                    "(path, root, kind, directory, mtime_ns, size, parsed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        str(root),
+                        kind,
+                        os.path.basename(os.path.dirname(path)),
+                        found[path].st_mtime_ns,
+                        found[path].st_size,
+                        pickle.dumps(parse(data))
+                    )
+                )
+
+        result: CatalogueSync = CatalogueSync(
+            changed,
+            removed,
+            len(found) - len(changed)
+        )
+        self.last_sync[(str(root), kind)] = result
+        if verbose:
+            print(
+                f"Catalogue of {root}: {len(changed)} changed, "
+                f"{len(removed)} removed, {result.unchanged} unchanged"
+            )
+        return result
+
+    def documents(self,
+                  root: Path,
+                  kind: str,
+                  file_name: str,
+                  parse: Callable[[Dict[str, Any]], Any],
+                  verbose: bool = False) -> List[Any]:
+        r"""What `parse` made of every `file_name` under `root`, in
+        directory order, syncing the catalogue first.
+        """
+        self.sync(root, kind, file_name, parse, verbose=verbose)
+        return [
+            pickle.loads(parsed) for parsed, in self.db.execute(
+                "SELECT parsed FROM documents WHERE root = ? AND kind = ? "
+                "ORDER BY directory",
+                (str(root), kind)
+            )
+        ]
@@ -0,0 +1,506 @@
+from typing import Callable, Optional, Tuple
+
+import click
+
+from pathlib import Path
+
+import json
+
+from . import (
+    build,
+    build_production,
+    build_shard,
+    build_target,
+    build_test,
+    merge_build
+)
+from .manifest import BuildManifest
+from .convert import PANDOC_MODES
+
+
+jobs_option = click.option(
+    "--jobs", "-j",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes used to convert posts and projects."
+)
+
+pandoc_option = click.option(
+    "--pandoc",
+    "pandoc_mode",
+    type=click.Choice(PANDOC_MODES),
+    default="auto",
+    show_default=True,
+    help="How documents are converted: a long-lived pandoc server, one "
+         "pandoc call per document, or the pandoc module's read/write."
+)
+
+
+minify_option = click.option(
+    "--minify/--no-minify",
+    default=False,
+    help="Minify HTML pages and static CSS and JavaScript."
+)
+
+page_size_option = click.option(
+    "--page-size",
+    type=click.IntRange(min=0),
+    default=build.POSTS_PER_PAGE,
+    show_default=True,
+    help="Posts per page of the blog and tag listings, 0 for one page."
+)
+
+
+@click.group(invoke_without_command=True)
+@click.option(
+    "--incremental/--full",
+    default=False,
+    help="Only rebuild outputs whose inputs changed since the last build."
+)
+@jobs_option
+@pandoc_option
+@minify_option
+@page_size_option
+@click.option(
+    "--profile",
+    "profile_build",
+    is_flag=True,
+    help="Time each build stage and document, print the slowest and write "
+         "a Chrome trace of the build."
+)
+@click.pass_context
+def main(ctx: click.Context,
+         incremental: bool,
+         jobs: int,
+         pandoc_mode: str,
+         minify: bool,
+         page_size: int,
+         profile_build: bool) -> None:
+    r"""Builds the site, run without a subcommand for a production build."""
+    if ctx.invoked_subcommand is None:
+        build_production(
+            incremental=incremental,
+            jobs=jobs,
+            pandoc_mode=pandoc_mode,
+            minify=minify,
+            profile_build=profile_build,
+            page_size=page_size
+        )
+
+
+def target_options(func: Callable) -> Callable:
+    r"""The options shared by the `build` subcommands."""
+    for option in reversed((
+        jobs_option,
+        pandoc_option,
+        minify_option,
+        page_size_option
+    )):
+        func = option(func)
+    return func
+
+
+def run_target(target: str,
+               jobs: int,
+               pandoc_mode: str,
+               minify: bool,
+               page_size: int,
+               only: Tuple[str, ...] = ()) -> None:
+    try:
+        build_target(
+            target,
+            only=only,
+            jobs=jobs,
+            pandoc_mode=pandoc_mode,
+            minify=minify,
+            page_size=page_size
+        )
+    except (FileNotFoundError, ValueError) as error:
+        raise click.ClickException(str(error))
+
+
+@main.group("build")
+def build_group() -> None:
+    r"""Rebuilds one part of the site, leaving the rest of the output alone.
+
+    Outputs that are up to date are skipped as in an incremental build.
+    """
+
+
+@build_group.command("posts")
+@target_options
+@click.option(
+    "--only",
+    multiple=True,
+    metavar="POST",
+    help="Only convert and write the post in this directory, repeatable. "
+         "The listings are not rebuilt."
+)
+def build_posts(jobs: int,
+                pandoc_mode: str,
+                minify: bool,
+                page_size: int,
+                only: tuple) -> None:
+    r"""Builds the posts, blog and tag listings and search index."""
+    run_target("posts", jobs, pandoc_mode, minify, page_size, only)
+
+
+@build_group.command("projects")
+@target_options
+def build_projects(jobs: int,
+                   pandoc_mode: str,
+                   minify: bool,
+                   page_size: int) -> None:
+    r"""Builds the project pages and listing."""
+    run_target("projects", jobs, pandoc_mode, minify, page_size)
+
+
+@build_group.command("pages")
+@target_options
+def build_pages(jobs: int,
+                pandoc_mode: str,
+                minify: bool,
+                page_size: int) -> None:
+    r"""Builds the pages in `site_src`."""
+    run_target("pages", jobs, pandoc_mode, minify, page_size)
+
+
+@build_group.command("games")
+@target_options
+def build_games(jobs: int,
+                pandoc_mode: str,
+                minify: bool,
+                page_size: int) -> None:
+    r"""Builds the games and copies their scripts."""
+    run_target("games", jobs, pandoc_mode, minify, page_size)
+
+
+@build_group.command("static")
+@target_options
+def build_static(jobs: int,
+                 pandoc_mode: str,
+                 minify: bool,
+                 page_size: int) -> None:
+    r"""Copies the site's static files."""
+    run_target("static", jobs, pandoc_mode, minify, page_size)
+
+
+@build_group.command("search")
+@target_options
+def build_search(jobs: int,
+                 pandoc_mode: str,
+                 minify: bool,
+                 page_size: int) -> None:
+    r"""Updates the search index of the posts."""
+    run_target("search", jobs, pandoc_mode, minify, page_size)
+
+
+@main.group("shard")
+def shard_group() -> None:
+    r"""Splits the pandoc work of a full build across processes or CI
+    runners.
+
+    Run `shard build --shard i/N` for every i from 1 to N, on any machines
+    with the site's sources, then `shard merge` with their output
+    directories to write the site.
+    """
+
+
+@shard_group.command("build")
+@click.option(
+    "--shard",
+    "shard",
+    required=True,
+    metavar="I/N",
+    help="Build shard I of N, counting from 1."
+)
+@click.option(
+    "--out",
+    "out_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Directory the shard is written to, cleaned first. Defaults to "
+         "site_shards/I-of-N."
+)
+@jobs_option
+@pandoc_option
+@minify_option
+def shard_build(shard: str,
+                out_dir: Optional[Path],
+                jobs: int,
+                pandoc_mode: str,
+                minify: bool) -> None:
+    r"""Converts and writes one shard of the posts and projects."""
+    try:
+        build_shard(
+            shard,
+            out_dir=out_dir,
+            jobs=jobs,
+            pandoc_mode=pandoc_mode,
+            minify=minify
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+
+
+@shard_group.command("merge")
+@click.argument(
+    "shard_dirs",
+    nargs=-1,
+    type=click.Path(file_okay=False, path_type=Path)
+)
+@jobs_option
+@minify_option
+@page_size_option
+def shard_merge(shard_dirs: tuple,
+                jobs: int,
+                minify: bool,
+                page_size: int) -> None:
+    r"""Builds the site from the shards in SHARD_DIRS, by default every
+    directory in site_shards. The shards must have been built with the same
+    --minify setting.
+    """
+    from .shard import SHARDS_DIR
+
+    if not shard_dirs:
+        shard_dirs = tuple(sorted(
+            path for path in SHARDS_DIR.glob("*") if path.is_dir()
+        ))
+    try:
+        merge_build(
+            list(shard_dirs),
+            jobs=jobs,
+            minify=minify,
+            page_size=page_size
+        )
+    except (FileNotFoundError, ValueError) as error:
+        raise click.ClickException(str(error))
+
+
+@main.command()
+@jobs_option
+@pandoc_option
+def test(jobs: int, pandoc_mode: str) -> None:
+    r"""Builds the test site from `tests/`."""
+    build_test(jobs=jobs, pandoc_mode=pandoc_mode)
+
+
+@main.command()
+@jobs_option
+@pandoc_option
+@click.option(
+    "--polling",
+    is_flag=True,
+    help="Poll the source trees instead of using inotify."
+)
+@click.option(
+    "--interval",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="Seconds between polls when polling."
+)
+@minify_option
+@page_size_option
+def watch(jobs: int,
+          pandoc_mode: str,
+          polling: bool,
+          interval: float,
+          minify: bool,
+          page_size: int) -> None:
+    r"""Rebuilds the affected parts of the site whenever a source changes."""
+    from .watch import watch as watch_site
+    watch_site(
+        jobs=jobs,
+        pandoc_mode=pandoc_mode,
+        polling=polling,
+        interval=interval,
+        minify=minify,
+        page_size=page_size
+    )
+
+
+@main.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option(
+    "--port", "-p",
+    type=click.IntRange(min=0, max=65535),
+    default=8000,
+    show_default=True
+)
+@pandoc_option
+@page_size_option
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    default=64,
+    show_default=True,
+    help="Megabytes of rendered pages kept in memory."
+)
+@click.option(
+    "--polling",
+    is_flag=True,
+    help="Poll the source trees instead of using inotify."
+)
+@click.option(
+    "--interval",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="Seconds between polls when polling."
+)
+def serve(host: str,
+          port: int,
+          pandoc_mode: str,
+          page_size: int,
+          cache_size: int,
+          polling: bool,
+          interval: float) -> None:
+    r"""Serves the site from its sources, rendering pages on request.
+
+    Pages stay in memory until one of their sources changes, static files
+    are served from the source trees. Nothing is written to site_out.
+    """
+    from .serve import serve as serve_site
+    serve_site(
+        host=host,
+        port=port,
+        pandoc_mode=pandoc_mode,
+        page_size=page_size,
+        max_bytes=cache_size << 20,
+        polling=polling,
+        interval=interval
+    )
+
+
+@main.command()
+@click.argument("templates", nargs=-1)
+def deps(templates: tuple) -> None:
+    r"""Lists the outputs a change to TEMPLATES would rebuild.
+
+    Without arguments lists the outputs invalidated by the templates edited
+    since the last build.
+    """
+    manifest: BuildManifest = BuildManifest.load(build.BUILD_DIR)
+    if not manifest.entries:
+        raise click.ClickException(
+            f"No build manifest in {build.BUILD_DIR}, build the site first"
+        )
+    try:
+        report = build.rebuild_report(manifest, templates)
+    except FileNotFoundError as error:
+        raise click.ClickException(str(error))
+
+    if not report:
+        click.echo("No templates changed since the last build")
+    for template, outputs in report.items():
+        name: str = str(template.relative_to(build.SITEGEN_DIR))
+        click.echo(f"{name}: {len(outputs)} outputs")
+        for parent in manifest.referenced_by(template):
+            click.echo(
+                f"  used by {Path(parent).relative_to(build.SITEGEN_DIR)}"
+            )
+        for output in outputs:
+            click.echo(f"  {output}")
+
+
+@main.command()
+@jobs_option
+@pandoc_option
+@click.option(
+    "--posts",
+    type=click.IntRange(min=0),
+    multiple=True,
+    default=(100,),
+    show_default=True,
+    help="Number of synthetic posts, repeat to benchmark several sizes."
+)
+@click.option("--tags", type=click.IntRange(min=1), default=20, show_default=True)
+@click.option("--tags-per-post", type=click.IntRange(min=0), default=3,
+              show_default=True)
+@click.option("--projects", type=click.IntRange(min=0), default=10,
+              show_default=True)
+@click.option("--projects-per-post", type=click.IntRange(min=0), default=1,
+              show_default=True)
+@click.option("--static-files", type=click.IntRange(min=0), default=50,
+              show_default=True)
+@click.option(
+    "--static-size",
+    type=click.IntRange(min=0),
+    default=16384,
+    show_default=True,
+    help="Bytes in each static file."
+)
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Keep the corpus and output here instead of a temporary directory."
+)
+@click.option(
+    "--output", "-o",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write the results as JSON."
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Results of an earlier run to compare against."
+)
+@click.option(
+    "--threshold",
+    type=click.FloatRange(min=0),
+    default=0.2,
+    show_default=True,
+    help="Fraction a stage may slow down by before it counts as a regression."
+)
+def bench(jobs: int,
+          pandoc_mode: str,
+          posts: tuple,
+          tags: int,
+          tags_per_post: int,
+          projects: int,
+          projects_per_post: int,
+          static_files: int,
+          static_size: int,
+          work_dir: Optional[Path],
+          output: Optional[Path],
+          baseline: Optional[Path],
+          threshold: float) -> None:
+    r"""Times the build on synthetic corpora of each size in POSTS.
+
+    Exits with an error when a stage regressed against the baseline.
+    """
+    from .bench import CorpusConfig, compare, results_table, run_suite
+
+    configs = [
+        CorpusConfig(
+            posts=count,
+            tags=tags,
+            tags_per_post=tags_per_post,
+            projects=projects,
+            projects_per_post=projects_per_post,
+            static_files=static_files,
+            static_size=static_size
+        )
+        for count in posts
+    ]
+    results = run_suite(configs, work_dir, jobs, pandoc_mode, verbose=True)
+
+    previous = None
+    if baseline is not None:
+        with open(baseline, 'r') as file:
+            previous = json.load(file)
+    click.echo(results_table(results, previous))
+
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        click.echo(f"Wrote results to {output}")
+
+    if previous is not None:
+        regressions = compare(results, previous, threshold)
+        if regressions:
+            raise click.ClickException(
+                "Slower than the baseline:\n" + "\n".join(regressions)
+            )
+        click.echo(f"No stage regressed by more than {100 * threshold:.0f}%")
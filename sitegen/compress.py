@@ -0,0 +1,187 @@
+from typing import Callable, Dict, Final, List, NamedTuple, Optional, Tuple
+
+import os
+
+from pathlib import Path
+
+import gzip
+
+from importlib.util import find_spec
+
+from .manifest import MANIFEST_NAME, BuildManifest
+
+
+# Outputs worth compressing, images and other binary formats already are
+COMPRESS_SUFFIXES: Final[Tuple[str, ...]] = (
+    ".html",
+    ".css",
+    ".js",
+    ".json",
+    ".svg",
+    ".xml",
+    ".txt",
+    ".ttf"
+)
+SIBLING_SUFFIXES: Final[Tuple[str, ...]] = (".gz", ".br")
+# Smaller files fit in a packet either way
+MIN_SIZE: Final[int] = 256
+# Siblings bigger than this fraction of the original are not worth serving
+MAX_RATIO: Final[float] = 0.9
+
+
+class Compressed(NamedTuple):
+    path: Path
+    size: int
+    # Size of each sibling written, `None` where it was skipped
+    siblings: Dict[str, Optional[int]]
+
+
+def _gzip(data: bytes) -> bytes:
+    # mtime=0 keeps the output identical between builds
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _brotli(data: bytes) -> bytes:
+    import brotli
+
+    return brotli.compress(data, quality=11)
+
+
+def has_brotli() -> bool:
+    r"""Whether brotli, the optional "compress" extra, is installed. It is
+    only imported once something is compressed.
+    """
+    return find_spec("brotli") is not None
+
+
+def encoders() -> Dict[str, Callable[[bytes], bytes]]:
+    r"""Sibling suffix to compression function, `.br` needs brotli."""
+    result: Dict[str, Callable[[bytes], bytes]] = {".gz": _gzip}
+    if has_brotli():
+        result[".br"] = _brotli
+    return result
+
+
+def compressible(build_dir: Path) -> List[Path]:
+    r"""The text outputs under `build_dir` that get compressed siblings."""
+    return sorted(
+        path for path in build_dir.rglob("*")
+        if path.suffix in COMPRESS_SUFFIXES
+        and path.name != MANIFEST_NAME
+        and path.is_file()
+    )
+
+
+def sibling(path: Path, suffix: str) -> Path:
+    return path.with_name(path.name + suffix)
+
+
+def compress_file(path: Path, suffixes: Tuple[str, ...]) -> Compressed:
+    r"""Writes the `suffixes` siblings of `path`, removing any sibling that
+    would not be smaller than `MAX_RATIO` of the original.
+    """
+    with open(path, 'rb') as file:
+        data: bytes = file.read()
+
+    available: Dict[str, Callable[[bytes], bytes]] = encoders()
+    siblings: Dict[str, Optional[int]] = {}
+    for suffix in suffixes:
+        out_path: Path = sibling(path, suffix)
+        packed: Optional[bytes] = None
+        if len(data) >= MIN_SIZE:
+            packed = available[suffix](data)
+            if len(packed) > len(data) * MAX_RATIO:
+                packed = None
+
+        if packed is None:
+            out_path.unlink(missing_ok=True)
+            siblings[suffix] = None
+            continue
+
+        tmp_path: Path = out_path.with_name(f".{out_path.name}.tmp")
+        with open(tmp_path, 'wb') as file:
+            file.write(packed)
+        os.replace(tmp_path, out_path)
+        siblings[suffix] = len(packed)
+
+    return Compressed(path, len(data), siblings)
+
+
+def compress_site(build_dir: Path,
+                  manifest: Optional[BuildManifest] = None,
+                  threads: int = 4,
+                  verbose: bool = False) -> List[Compressed]:
+    r"""Writes `.gz` and, with brotli installed, `.br` siblings of every text
+    output under `build_dir` for servers that serve precompressed files.
+
+    With a manifest a file is only compressed again once its contents
+    change, and siblings of deleted outputs are removed. Each file is
+    recorded under its `.gz` sibling, which may legitimately be missing
+    when compression did not pay off. Files are compressed on a pool of
+    `threads` threads.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    suffixes: Tuple[str, ...] = tuple(encoders())
+    if verbose and ".br" not in suffixes:
+        print("brotli is not installed, only writing .gz files")
+
+    stale: List[Path] = []
+    inputs: Dict[Path, Dict[str, str]] = {}
+    for path in compressible(build_dir):
+        if manifest is None:
+            stale.append(path)
+            continue
+        inputs[path] = manifest.inputs([path])
+        inputs[path]["suffixes"] = ",".join(suffixes)
+        if not manifest.is_fresh(sibling(path, ".gz"), inputs[path],
+                                 must_exist=False):
+            stale.append(path)
+
+    if threads > 1 and len(stale) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results: List[Compressed] = list(pool.map(
+                lambda path : compress_file(path, suffixes),
+                stale
+            ))
+    else:
+        results = [compress_file(path, suffixes) for path in stale]
+
+    if manifest is not None:
+        for result in results:
+            manifest.record(
+                sibling(result.path, ".gz"),
+                inputs[result.path],
+                "compressed"
+            )
+        # Entries are keyed on the .gz sibling, prune removes that one
+        for key in manifest.prune("compressed", verbose=verbose):
+            source: Path = build_dir / key[:-len(".gz")]
+            for suffix in SIBLING_SUFFIXES:
+                sibling(source, suffix).unlink(missing_ok=True)
+
+    if verbose:
+        print(compression_summary(results, len(inputs) - len(stale)))
+    return results
+
+
+def compression_summary(results: List[Compressed], unchanged: int = 0) -> str:
+    original: int = sum(result.size for result in results)
+    lines: List[str] = [
+        f"Compressed {len(results)} files ({unchanged} unchanged), "
+        f"{original} bytes"
+    ]
+    for suffix in SIBLING_SUFFIXES:
+        written: List[Tuple[int, int]] = [
+            (result.size, result.siblings[suffix]) for result in results
+            if result.siblings.get(suffix) is not None
+        ]
+        if not written:
+            continue
+        before: int = sum(size for size, _ in written)
+        after: int = sum(size for _, size in written)
+        lines.append(
+            f"  {suffix}: {len(written)} files, {before} -> {after} bytes, "
+            f"saved {before - after} ({100 * (before - after) / before:.0f}%)"
+        )
+    return "\n".join(lines)
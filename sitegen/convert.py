@@ -0,0 +1,391 @@
+from typing import Any, Dict, Final, List, Optional, Tuple
+
+import os
+
+from pathlib import Path
+
+import shutil
+
+import hashlib
+
+import json
+
+import base64
+
+import socket
+
+import subprocess
+
+import time
+
+
+PANDOC_PATH_ENV: Final[str] = 'PANDOC_BINARY'
+CACHE_MAX_BYTES: Final[int] = 512 * 1024 * 1024
+PANDOC_MODES: Final[Tuple[str, ...]] = ("auto", "server", "cli", "python")
+SERVER_START_TIMEOUT: Final[float] = 5.0
+
+
+class ConversionError(RuntimeError):
+    r"""Raised when pandoc fails to convert a document."""
+
+
+def configure_pandoc() -> None:
+    r"""Points pandoc at the binary in `PANDOC_BINARY` when it is set.
+    Also used as the initializer of worker processes.
+    """
+    if pandoc_path := os.environ.get(PANDOC_PATH_ENV):
+        # The pandoc module is slow to import and only the python backend
+        # uses it
+        import pandoc
+        pandoc.configure(path=pandoc_path)
+
+
+def pandoc_binary() -> str:
+    r"""Path of the pandoc program, `PANDOC_BINARY` if it is set."""
+    return os.environ.get(PANDOC_PATH_ENV) or shutil.which("pandoc") or "pandoc"
+
+
+def pandoc_version(binary: Optional[str] = None) -> str:
+    result: subprocess.CompletedProcess = subprocess.run(
+        [binary or pandoc_binary(), "--version"],
+        capture_output=True,
+        check=True
+    )
+    return result.stdout.decode().splitlines()[0].split(" ")[1]
+
+
+class CliBackend:
+    r"""Converts each document with a single pandoc process reading the
+    source on stdin and writing the output format on stdout, instead of one
+    process to read into the AST and another to write it.
+    """
+    name: str = "cli"
+
+    def __init__(self, binary: Optional[str] = None) -> None:
+        self.binary: str = binary or pandoc_binary()
+
+    def convert(self,
+                source: str,
+                input_format: str,
+                output_format: str = "html",
+                options: Tuple[str, ...] = ()) -> str:
+        result: subprocess.CompletedProcess = subprocess.run(
+            [
+                self.binary,
+                "--from", input_format,
+                "--to", output_format,
+                *options
+            ],
+            input=source.encode('utf-8'),
+            capture_output=True
+        )
+        if result.returncode != 0:
+            raise ConversionError(
+                f"pandoc exited with {result.returncode}: "
+                f"{result.stderr.decode('utf-8', 'replace').strip()}"
+            )
+        return result.stdout.decode('utf-8')
+
+    def close(self) -> None:
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerBackend:
+    r"""Converts documents through a long-lived `pandoc server` process on
+    localhost, so a build pays for pandoc's startup once.
+
+    The backend is picklable, copies sent to worker processes talk to the
+    server started by the parent. Calls with command line options the
+    server API has no equivalent for go through a `CliBackend`.
+
+    Arguments
+    ---------
+
+    binary: The pandoc program, defaults to `pandoc_binary()`
+
+    timeout: Seconds the server may spend on a single document
+
+    """
+    name: str = "server"
+
+    def __init__(self,
+                 binary: Optional[str] = None,
+                 timeout: int = 120) -> None:
+        self.binary: str = binary or pandoc_binary()
+        self.timeout: int = timeout
+        self.url: Optional[str] = None
+        self._process: Optional[subprocess.Popen] = None
+        self._fallback: CliBackend = CliBackend(self.binary)
+        import urllib.request
+        # Never route requests to our own server through a proxy
+        self._opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler({})
+        )
+
+    def start(self) -> bool:
+        r"""Starts the server and checks it converts a trivial document,
+        returns `False` if this pandoc cannot run as a server.
+        """
+        import urllib.error
+        port: int = _free_port()
+        try:
+            process: subprocess.Popen = subprocess.Popen(
+                [
+                    self.binary,
+                    "server",
+                    f"--port={port}",
+                    f"--timeout={self.timeout}"
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            return False
+
+        self.url = f"http://127.0.0.1:{port}/"
+        deadline: float = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                self._request("", "markdown", "html")
+            except urllib.error.URLError as error:
+                if isinstance(error.reason, ConnectionRefusedError):
+                    time.sleep(0.05)
+                    continue
+                break
+            except (OSError, ConversionError):
+                break
+            self._process = process
+            return True
+
+        process.terminate()
+        process.wait()
+        self.url = None
+        return False
+
+    def _request(self,
+                 source: str,
+                 input_format: str,
+                 output_format: str) -> str:
+        import urllib.error
+        import urllib.request
+        request: urllib.request.Request = urllib.request.Request(
+            self.url,
+            data=json.dumps({
+                "text": source,
+                "from": input_format,
+                "to": output_format
+            }).encode('utf-8'),
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "application/json"
+            }
+        )
+        try:
+            with self._opener.open(request, timeout=self.timeout) as response:
+                result: Dict[str, Any] = json.load(response)
+        except urllib.error.HTTPError as error:
+            raise ConversionError(
+                f"pandoc server returned {error.code}: "
+                f"{error.read().decode('utf-8', 'replace').strip()}"
+            ) from error
+
+        if result.get("error"):
+            raise ConversionError(f"pandoc server: {result['error']}")
+        if result.get("base64"):
+            return base64.b64decode(result["output"]).decode('utf-8')
+        return result["output"]
+
+    def convert(self,
+                source: str,
+                input_format: str,
+                output_format: str = "html",
+                options: Tuple[str, ...] = ()) -> str:
+        if options or self.url is None:
+            return self._fallback.convert(
+                source,
+                input_format,
+                output_format,
+                options
+            )
+        return self._request(source, input_format, output_format)
+
+    def close(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            "binary": self.binary,
+            "timeout": self.timeout,
+            "url": self.url
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["binary"], state["timeout"])
+        self.url = state["url"]
+
+
+def start_backend(mode: str = "auto",
+                  verbose: bool = False) -> Optional[Any]:
+    r"""Returns the conversion backend for `mode`.
+
+    `server` and `auto` start a long-lived pandoc server, falling back to
+    `cli` (one pandoc process per document) when the local pandoc cannot
+    run as a server. `python` returns `None`, which makes `convert` use the
+    pandoc module's read and write calls.
+    """
+    if mode not in PANDOC_MODES:
+        raise ValueError(f"Unknown pandoc mode {mode}, expected {PANDOC_MODES}")
+    if mode == "python":
+        return None
+
+    if mode in ("auto", "server"):
+        server: ServerBackend = ServerBackend()
+        if server.start():
+            if verbose:
+                print(f"Converting documents with pandoc server at {server.url}")
+            return server
+        if verbose:
+            print("pandoc server unavailable, using one pandoc call per document")
+
+    return CliBackend()
+
+
+class ConversionCache:
+    r"""Content addressed on-disk cache of pandoc conversions.
+
+    Entries are keyed on the source bytes, input and output formats, the
+    pandoc version, the backend and the writer options, so a cached
+    document is reused whenever any of those is unchanged, whatever file it
+    came from. Reading an entry bumps its mtime and once the cache grows
+    past `max_bytes` the least recently used entries are evicted.
+
+    Arguments
+    ---------
+
+    cache_dir: Directory the rendered documents are stored in
+
+    max_bytes: Size the cache is trimmed back to after each write
+
+    """
+
+    def __init__(self,
+                 cache_dir: Path,
+                 max_bytes: int = CACHE_MAX_BYTES) -> None:
+        self.cache_dir: Path = cache_dir
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._version: Optional[str] = None
+        self._size: Optional[int] = None
+
+    def key(self,
+            source: bytes,
+            input_format: str,
+            output_format: str,
+            options: Tuple[str, ...] = (),
+            backend: str = "python") -> str:
+        if self._version is None:
+            self._version = pandoc_version()
+        digest = hashlib.sha256(source)
+        for part in (input_format, output_format, self._version, backend,
+                     *options):
+            digest.update(b"\0" + part.encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.html"
+
+    def get(self, key: str) -> Optional[str]:
+        path: Path = self.entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                text: str = file.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        path: Path = self.entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path: Path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._entries())
+        else:
+            self._size += path.stat().st_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self) -> List[Path]:
+        return list(self.cache_dir.glob("*/*.html"))
+
+    def evict(self) -> None:
+        r"""Deletes least recently used entries until the cache fits in
+        `max_bytes`.
+        """
+        entries: List[Tuple[float, int, Path]] = []
+        for path in self._entries():
+            stat: os.stat_result = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        size: int = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
+        self._size = size
+
+    def summary(self) -> str:
+        return f"Conversion cache: {self.hits} hits, {self.misses} misses"
+
+
+def convert(source: str,
+            input_format: str,
+            output_format: str = "html",
+            options: Tuple[str, ...] = (),
+            cache: Optional[ConversionCache] = None,
+            backend: Optional[Any] = None) -> str:
+    r"""Converts `source` from `input_format` to `output_format` with
+    pandoc, reusing a cached result when one is available.
+
+    With a `backend` from `start_backend` the document is converted in a
+    single call, otherwise it goes through `pandoc.read` and `pandoc.write`.
+    """
+    if cache is not None:
+        key: str = cache.key(
+            source.encode('utf-8'),
+            input_format,
+            output_format,
+            options,
+            backend.name if backend is not None else "python"
+        )
+        if (text := cache.get(key)) is not None:
+            return text
+
+    if backend is not None:
+        text: str = backend.convert(source, input_format, output_format, options)
+    else:
+        import pandoc
+        doc: Any = pandoc.read(source, format=input_format)
+        text: str = pandoc.write(doc, format=output_format, options=list(options))
+
+    if cache is not None:
+        cache.put(key, text)
+    return text
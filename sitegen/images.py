@@ -0,0 +1,279 @@
+from typing import Any, Callable, Dict, Final, List, NamedTuple, Optional, Tuple
+
+import os
+
+from pathlib import Path
+
+import shutil
+
+import json
+
+from functools import partial
+
+from .manifest import BuildManifest, hash_file, hash_value
+from .parallel import map_jobs
+from .sync import sync_tree
+
+
+THUMBS_DIR_NAME: Final[str] = "thumbs"
+# Listing cards are at most ~240px wide, the larger size is for 2x screens
+THUMB_WIDTHS: Final[Tuple[int, ...]] = (240, 480)
+THUMB_QUALITY: Final[int] = 75
+THUMB_SIZES: Final[str] = "(max-width: 800px) 40vw, 240px"
+# Modern formats offered ahead of the fallback, in order of preference
+THUMB_FORMATS: Final[Tuple[Tuple[str, str, str], ...]] = (
+    ("image/avif", "avif", "AVIF"),
+    ("image/webp", "webp", "WEBP")
+)
+
+
+class ThumbnailSet(NamedTuple):
+    r"""The resized variants of one image, stored under `key`.
+    `sources` lists `(mime type, [(width, file name)])` per format, the
+    last entry is the source's own format and is used for the `img` tag.
+    """
+    key: str
+    width: int
+    height: int
+    sources: List[Tuple[str, List[Tuple[int, str]]]]
+
+
+def pillow() -> Optional[Any]:
+    r"""The Pillow package, `None` when the optional "images" extra is not
+    installed. Imported on first use, builds that make no thumbnails never
+    load it.
+    """
+    try:
+        import PIL.Image
+        import PIL.ImageOps
+    except ImportError:
+        return None
+    return PIL
+
+
+def available_formats() -> List[Tuple[str, str, str]]:
+    r"""The entries of `THUMB_FORMATS` this Pillow can encode."""
+    if pillow() is None:
+        return []
+    from PIL import Image
+    extensions: Dict[str, str] = Image.registered_extensions()
+    return [
+        entry for entry in THUMB_FORMATS
+        if extensions.get(f".{entry[1]}") == entry[2]
+        and entry[2] in Image.SAVE
+    ]
+
+
+def thumbnail_key(digest: str) -> str:
+    r"""Cache key of the thumbnails of an image with contents `digest`,
+    which changes with the encoder settings as well.
+    """
+    PIL: Optional[Any] = pillow()
+    return hash_value((
+        digest,
+        THUMB_WIDTHS,
+        THUMB_QUALITY,
+        available_formats(),
+        PIL.__version__ if PIL is not None else None
+    ))
+
+
+def _load_set(meta_path: Path) -> Optional[ThumbnailSet]:
+    try:
+        with open(meta_path, 'r') as file:
+            return ThumbnailSet(**json.load(file))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def encode_thumbnails(item: Tuple[Path, str],
+                      cache_dir: Path,
+                      cache: Any = None) -> ThumbnailSet:
+    r"""Encodes every variant of the image in `item`, an image path and its
+    cache key, into `cache_dir / key`. Runs in worker processes through
+    `map_jobs`, which is also why it accepts a `cache`.
+    """
+    from PIL import Image, ImageOps
+    image_path, key = item
+    tmp_dir: Path = cache_dir / f"{key}.{os.getpid()}.tmp"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image)
+        alpha: bool = image.mode in ("RGBA", "LA", "PA") \
+            or "transparency" in image.info
+        image = image.convert("RGBA" if alpha else "RGB")
+        fallback: Tuple[str, str, str] = ("image/png", "png", "PNG") if alpha \
+            else ("image/jpeg", "jpg", "JPEG")
+        formats: List[Tuple[str, str, str]] = [*available_formats(), fallback]
+
+        widths: List[int] = sorted({min(width, image.width) for width in THUMB_WIDTHS})
+        sources: Dict[str, List[Tuple[int, str]]] = {
+            mime: [] for mime, _, _ in formats
+        }
+        for width in widths:
+            height: int = max(1, round(image.height * width / image.width))
+            resized: Any = image if width == image.width \
+                else image.resize((width, height), Image.LANCZOS)
+            for mime, extension, pil_format in formats:
+                name: str = f"{width}.{extension}"
+                resized.save(
+                    tmp_dir / name,
+                    pil_format,
+                    quality=THUMB_QUALITY,
+                    optimize=True
+                )
+                sources[mime].append((width, name))
+
+    thumbs: ThumbnailSet = ThumbnailSet(
+        key,
+        widths[-1],
+        height,
+        [(mime, sources[mime]) for mime, _, _ in formats]
+    )
+    try:
+        os.replace(tmp_dir, cache_dir / key)
+    except OSError:
+        # Another build encoded the same image first
+        shutil.rmtree(tmp_dir)
+
+    meta_path: Path = cache_dir / f"{key}.json"
+    tmp_path: Path = meta_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as file:
+        json.dump(thumbs._asdict(), file)
+    os.replace(tmp_path, meta_path)
+    return _load_set(meta_path)
+
+
+def build_thumbnails(images: List[Path],
+                     cache_dir: Path,
+                     site_build_dir: Path,
+                     manifest: Optional[BuildManifest] = None,
+                     manifest_group: str = "thumbs",
+                     jobs: int = 1,
+                     locate: Optional[Callable[[Path], Path]] = None,
+                     verbose: bool = False) -> Dict[str, ThumbnailSet]:
+    r"""Makes resized AVIF, WebP and fallback variants of `images`, files
+    already copied into `site_build_dir`, and syncs them into its `thumbs`
+    directory.
+
+    Variants are cached in `cache_dir` by image contents, so an image is
+    only encoded again when it changes, and new images are encoded across a
+    pool of `jobs` processes. Returns the variants keyed on each image's
+    path relative to `site_build_dir`. Without Pillow nothing is made and
+    listings keep linking the full size images.
+
+    Arguments
+    ---------
+
+    images: Images in the build directory to make thumbnails of
+
+    cache_dir: Directory the encoded variants are cached in
+
+    site_build_dir: The site build directory
+
+    manifest: Records the thumbnail directories so stale ones are removed
+
+    manifest_group: Group the thumbnail directories are recorded under
+
+    locate: Maps an image to the file holding it, e.g. its fingerprinted
+    copy when the original is not there, see `assets.AssetStore.locate`
+
+    """
+    if pillow() is None:
+        if verbose:
+            print("Pillow is not installed, skipping thumbnails")
+        return {}
+
+    keys: Dict[Path, str] = {}
+    sources: Dict[Path, Path] = {}
+    for image in images:
+        source: Path = locate(image) if locate is not None else image
+        if not source.is_file():
+            continue
+        digest: str = manifest.digest(source) if manifest is not None \
+            else hash_file(source)
+        keys[image] = thumbnail_key(digest)
+        sources[image] = source
+
+    thumbs: Dict[Path, ThumbnailSet] = {}
+    missing: List[Path] = []
+    for image, key in keys.items():
+        cached: Optional[ThumbnailSet] = _load_set(cache_dir / f"{key}.json")
+        if cached is not None and (cache_dir / key).is_dir():
+            thumbs[image] = cached
+        else:
+            missing.append(image)
+
+    if verbose:
+        print(f"Encoding thumbnails for {len(missing)} of {len(keys)} images")
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    encoded: List[ThumbnailSet] = map_jobs(
+        partial(encode_thumbnails, cache_dir=cache_dir),
+        [(sources[image], keys[image]) for image in missing],
+        [f"thumbnails of {image}" for image in missing],
+        jobs=jobs
+    )
+    thumbs.update(zip(missing, encoded))
+
+    for image, thumb in thumbs.items():
+        out_dir: Path = site_build_dir / THUMBS_DIR_NAME / thumb.key[:16]
+        if manifest is not None:
+            inputs: Dict[str, str] = {"thumbnails": thumb.key}
+            if manifest.is_fresh(out_dir, inputs):
+                continue
+        sync_tree(cache_dir / thumb.key, out_dir)
+        if manifest is not None:
+            manifest.record(out_dir, inputs, manifest_group)
+
+    if manifest is not None:
+        manifest.prune(manifest_group, verbose=verbose)
+
+    return {
+        image.relative_to(site_build_dir).as_posix(): thumb
+        for image, thumb in thumbs.items()
+    }
+
+
+def thumbnail_context(image: str,
+                      thumbnails: Optional[Dict[str, ThumbnailSet]] = None,
+                      link_prefix: str = "") -> Dict[str, Any]:
+    r"""Template variables for the listing image `image`, a path relative to
+    the site root, on a page `link_prefix` away from the root. Images
+    without thumbnails link the original file.
+    """
+    thumb: Optional[ThumbnailSet] = (thumbnails or {}).get(image)
+    if thumb is None:
+        return {"img_link": f"{link_prefix}{image}", "img_sources": []}
+
+    base: str = f"{link_prefix}{THUMBS_DIR_NAME}/{thumb.key[:16]}/"
+    sources: List[Dict[str, str]] = [
+        {
+            "type": mime,
+            "srcset": ", ".join(
+                f"{base}{name} {width}w" for width, name in variants
+            )
+        }
+        for mime, variants in thumb.sources
+    ]
+    return {
+        "img_link": f"{base}{thumb.sources[-1][1][0][1]}",
+        "img_srcset": sources[-1]["srcset"],
+        "img_sources": sources[:-1],
+        "img_sizes": THUMB_SIZES,
+        "img_width": thumb.width,
+        "img_height": thumb.height
+    }
+
+
+def thumbnails_digest(images: List[str],
+                      thumbnails: Optional[Dict[str, ThumbnailSet]] = None) -> str:
+    r"""Digest of the thumbnails a listing of `images` links to, a listing
+    input that changes whenever one of its images is re-encoded.
+    """
+    return hash_value([
+        (thumbnails or {}).get(image, (None,))[0] for image in images
+    ])
@@ -0,0 +1,233 @@
+from typing import Any, Dict, Final, Iterable, List, Optional, Set
+
+import os
+
+from pathlib import Path
+
+import shutil
+
+import json
+
+import hashlib
+
+
+MANIFEST_NAME: Final[str] = ".manifest.json"
+MANIFEST_VERSION: Final[int] = 1
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_value(value: Any) -> str:
+    r"""Digest of a value's repr, for inputs that are parsed metadata rather
+    than files, e.g. the posts listed on a blog page.
+    """
+    return hash_bytes(repr(value).encode())
+
+
+def hash_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    r"""Returns the sha256 hex digest of the file at `path`, reading it in
+    chunks so large static files are not loaded into memory at once.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    r"""Records, for every output under the build directory, the digests of
+    the inputs it was built from.
+
+    A build step asks `is_fresh(output, inputs)` before doing any work and
+    calls `record(output, inputs)` once the output is written. Entries are
+    grouped by stage (`posts`, `tags`, `projects`, ...) so `prune(group)`
+    can delete outputs whose sources have disappeared.
+
+    File digests are cached by `(mtime_ns, size)` between runs, so an
+    unchanged input costs a `stat` rather than a re-hash.
+
+    Templates are recorded as inputs together with everything they include,
+    extend or import, so `dependents(template)` is the set of outputs a
+    template edit invalidates. The reference graph itself is kept in
+    `templates` for reporting.
+
+    Arguments
+    ---------
+
+    build_dir: The site build directory, output keys are relative to it
+
+    """
+
+    def __init__(self, build_dir: Path) -> None:
+        self.build_dir: Path = build_dir
+        self.path: Path = build_dir / MANIFEST_NAME
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.files: Dict[str, List[Any]] = {}
+        self.templates: Dict[str, List[str]] = {}
+        # Options the outputs were built with, see `build.load_manifest`
+        self.settings: Dict[str, Any] = {}
+        self.touched: Set[str] = set()
+        self._digests: Dict[str, str] = {}
+
+    @classmethod
+    def load(cls, build_dir: Path) -> "BuildManifest":
+        manifest: BuildManifest = cls(build_dir)
+        if not manifest.path.exists():
+            return manifest
+        try:
+            with open(manifest.path, 'r') as file:
+                data: Dict[str, Any] = json.load(file)
+        except (OSError, ValueError):
+            return manifest
+        if data.get("version") != MANIFEST_VERSION:
+            return manifest
+        manifest.entries = data.get("entries", {})
+        manifest.files = data.get("files", {})
+        manifest.templates = data.get("templates", {})
+        manifest.settings = data.get("settings", {})
+        return manifest
+
+    def save(self) -> None:
+        self.build_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path: Path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as file:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "entries": self.entries,
+                    "files": self.files,
+                    "settings": self.settings,
+                    "templates": self.templates
+                },
+                file,
+                indent=1,
+                sort_keys=True
+            )
+        os.replace(tmp_path, self.path)
+
+    def refresh(self) -> None:
+        r"""Forgets the digests and outputs seen so far, so a manifest kept
+        in memory between builds (as in watch mode) re-checks its inputs.
+        """
+        self.touched = set()
+        self._digests = {}
+
+    def key(self, output: Path) -> str:
+        return Path(os.path.relpath(output, self.build_dir)).as_posix()
+
+    def digest(self, path: Path) -> str:
+        r"""Digest of a file or, for a directory, of every file under it.
+        Missing inputs hash to `"missing"` so their appearance invalidates
+        whatever depended on them.
+        """
+        name: str = str(path)
+        if name in self._digests:
+            return self._digests[name]
+
+        if path.is_dir():
+            tree = hashlib.sha256()
+            for file_path in sorted(p for p in path.rglob("*") if p.is_file()):
+                tree.update(file_path.relative_to(path).as_posix().encode())
+                tree.update(self.digest(file_path).encode())
+            result: str = tree.hexdigest()
+        elif path.is_file():
+            stat: os.stat_result = path.stat()
+            cached: Optional[List[Any]] = self.files.get(name)
+            if cached is not None \
+                    and cached[0] == stat.st_mtime_ns \
+                    and cached[1] == stat.st_size:
+                result = cached[2]
+            else:
+                result = hash_file(path)
+                self.files[name] = [stat.st_mtime_ns, stat.st_size, result]
+        else:
+            result = "missing"
+
+        self._digests[name] = result
+        return result
+
+    def inputs(self, paths: Iterable[Path]) -> Dict[str, str]:
+        return {str(path): self.digest(path) for path in paths}
+
+    def is_fresh(self,
+                 output: Path,
+                 inputs: Dict[str, str],
+                 must_exist: bool = True) -> bool:
+        r"""Whether `output` was recorded with exactly `inputs`. Outputs a
+        step may decide not to write are checked with `must_exist=False`.
+        """
+        key: str = self.key(output)
+        self.touched.add(key)
+        entry: Optional[Dict[str, Any]] = self.entries.get(key)
+        return entry is not None \
+            and entry["inputs"] == inputs \
+            and (output.exists() or not must_exist)
+
+    def owner(self, output: Path) -> Optional[str]:
+        r"""The group that last recorded `output`, if any."""
+        entry: Optional[Dict[str, Any]] = self.entries.get(self.key(output))
+        return entry["group"] if entry is not None else None
+
+    def record(self, output: Path, inputs: Dict[str, str],
+               group: str) -> None:
+        key: str = self.key(output)
+        self.touched.add(key)
+        self.entries[key] = {"group": group, "inputs": inputs}
+
+    def dependents(self, path: Path) -> List[str]:
+        r"""Outputs recorded with `path` among their inputs."""
+        name: str = str(path)
+        return sorted(
+            key for key, entry in self.entries.items()
+            if name in entry["inputs"]
+        )
+
+    def referenced_by(self, path: Path) -> List[str]:
+        r"""Templates that include, extend or import the template at `path`."""
+        name: str = str(path)
+        return sorted(
+            template for template, refs in self.templates.items()
+            if name in refs
+        )
+
+    def changed(self, paths: Iterable[Path]) -> List[Path]:
+        r"""The `paths` whose contents differ from the digest some output
+        recorded for them.
+        """
+        changed: List[Path] = []
+        for path in paths:
+            digest: str = self.digest(path)
+            name: str = str(path)
+            if any(
+                entry["inputs"].get(name, digest) != digest
+                for entry in self.entries.values()
+            ):
+                changed.append(path)
+        return changed
+
+    def prune(self, group: str, verbose: bool = False) -> List[str]:
+        r"""Deletes outputs of `group` that were neither checked nor recorded
+        during this run, i.e. whose source posts or projects are gone.
+        """
+        stale: List[str] = [
+            key for key, entry in self.entries.items()
+            if entry["group"] == group and key not in self.touched
+        ]
+        for key in stale:
+            output: Path = self.build_dir / key
+            if verbose:
+                print(f"Removing stale output {output}")
+            if output.is_dir():
+                shutil.rmtree(output)
+            elif output.exists():
+                os.remove(output)
+            del self.entries[key]
+            parent: Path = output.parent
+            while parent != self.build_dir and parent.is_dir() \
+                    and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+        return stale
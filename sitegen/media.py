@@ -0,0 +1,247 @@
+from typing import Dict, Final, List, Optional, Tuple
+
+import os
+
+from pathlib import Path
+
+import base64
+
+import binascii
+
+import hashlib
+
+import json
+
+import re
+
+from .manifest import hash_bytes
+
+
+MEDIA_DIR_NAME: Final[str] = "media"
+# Bumped whenever extraction changes, so cached results are not reused
+MEDIA_VERSION: Final[str] = "1"
+
+MEDIA_SUFFIXES: Final[Dict[str, str]] = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+    "image/svg+xml": ".svg"
+}
+
+# Notebook outputs pandoc refers to by the SHA-1 of their contents
+_MEDIABAG_NAME: Final[re.Pattern] = re.compile(r"^[0-9a-f]{40}\.\w+$")
+_REFERENCE: Final[re.Pattern] = re.compile(
+    r"""\b(src|href|poster)=(["'])(?:data:(image/[\w.+-]+);base64,"""
+    r"""([A-Za-z0-9+/=\s]+)|([^"']+))\2"""
+)
+
+
+def _output_bytes(mime: str, value: object) -> Optional[bytes]:
+    text: str = "".join(value) if isinstance(value, list) else str(value)
+    if mime == "image/svg+xml":
+        return text.encode('utf-8')
+    try:
+        return base64.b64decode(text)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def notebook_media(source: str) -> Dict[str, bytes]:
+    r"""The images pandoc leaves for the caller to provide when converting
+    the notebook `source`. Output images are named by the SHA-1 of their
+    contents, cell attachments by their own name.
+    """
+    try:
+        notebook: Dict = json.loads(source)
+    except ValueError:
+        return {}
+
+    media: Dict[str, bytes] = {}
+    for cell in notebook.get("cells", []):
+        for name, data in (cell.get("attachments") or {}).items():
+            for mime, value in data.items():
+                if mime in MEDIA_SUFFIXES:
+                    content: Optional[bytes] = _output_bytes(mime, value)
+                    if content is not None:
+                        media[name] = content
+        for output in cell.get("outputs", []):
+            for mime, value in (output.get("data") or {}).items():
+                if mime not in MEDIA_SUFFIXES:
+                    continue
+                content = _output_bytes(mime, value)
+                if content is not None:
+                    media[hashlib.sha1(content).hexdigest()] = content
+    return media
+
+
+def media_name(content: bytes, suffix: str) -> str:
+    return hash_bytes(content)[:16] + suffix
+
+
+def extract_media(html: str,
+                  media: Dict[str, bytes],
+                  link_prefix: str = f"{MEDIA_DIR_NAME}/"
+                  ) -> Tuple[str, Dict[str, bytes]]:
+    r"""Replaces the base64 `data:` images in `html`, and references to the
+    images in `media`, with links to files named by the hash of their
+    contents. Returns the new HTML and the files to write, an image used
+    several times is stored once.
+    """
+    files: Dict[str, bytes] = {}
+
+    def replace(match: re.Match) -> str:
+        attribute, quote, mime, data, reference = match.groups()
+        if mime is not None:
+            if mime not in MEDIA_SUFFIXES:
+                return match[0]
+            content: Optional[bytes] = _output_bytes(mime, data)
+            suffix: str = MEDIA_SUFFIXES[mime]
+        elif reference in media:
+            content = media[reference]
+            suffix = os.path.splitext(reference)[1]
+        elif _MEDIABAG_NAME.match(reference) \
+                and reference[:40] in media:
+            content = media[reference[:40]]
+            suffix = os.path.splitext(reference)[1]
+        else:
+            return match[0]
+        if content is None:
+            return match[0]
+        name: str = media_name(content, suffix)
+        files[name] = content
+        return f"{attribute}={quote}{link_prefix}{name}{quote}"
+
+    return _REFERENCE.sub(replace, html), files
+
+
+class MediaCache:
+    r"""On-disk cache of media extraction, keyed on the converted document
+    and its source, so an unchanged notebook is not decoded again. The
+    extracted files are kept once each under their content hash.
+
+    Arguments
+    ---------
+
+    cache_dir: Directory results and extracted files are stored in
+
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir: Path = cache_dir
+
+    def key(self, source: str, input_format: str, html: str) -> str:
+        return hash_bytes(
+            f"{MEDIA_VERSION}\0{input_format}\0{source}\0{html}".encode('utf-8')
+        )
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def file_path(self, name: str) -> Path:
+        return self.cache_dir / "files" / name
+
+    def get(self, key: str) -> Optional[Tuple[str, List[str]]]:
+        try:
+            with open(self.entry_path(key), 'r', encoding='utf-8') as file:
+                entry: Dict = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not all(self.file_path(name).exists() for name in entry["files"]):
+            return None
+        return entry["html"], entry["files"]
+
+    def put(self, key: str, html: str, files: Dict[str, bytes]) -> None:
+        for name, content in files.items():
+            _write_new(self.file_path(name), content)
+        _write_new(
+            self.entry_path(key),
+            json.dumps({"html": html, "files": sorted(files)}).encode('utf-8')
+        )
+
+
+def _write_new(path: Path, content: bytes) -> None:
+    r"""Writes `content` to `path` unless a file of the same size is
+    already there, names are content hashes so it holds the same bytes.
+    """
+    try:
+        if path.stat().st_size == len(content):
+            return
+    except FileNotFoundError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path: Path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def extract_document_media(source: str,
+                           input_format: str,
+                           html: str,
+                           media_dir: Path,
+                           cache: Optional[MediaCache] = None) -> str:
+    r"""Moves the images embedded in a converted document into `media_dir`
+    and returns the HTML linking to them, see `extract_media`. Files in
+    `media_dir` the document no longer uses are removed.
+
+    Arguments
+    ---------
+
+    source: The document pandoc converted
+
+    input_format: Its pandoc format, notebook output images are only
+    recovered for `ipynb`
+
+    html: pandoc's output
+
+    media_dir: Output directory of the images, linked to as a sibling of
+    the page
+
+    cache: Where extraction results are cached, `None` disables it
+
+    """
+    names: List[str] = []
+    if input_format == "ipynb" or "data:image/" in html:
+        html, names = _extract_cached(
+            source,
+            input_format,
+            html,
+            media_dir,
+            cache
+        )
+
+    if media_dir.is_dir():
+        for path in media_dir.iterdir():
+            if path.name not in names:
+                os.remove(path)
+        if not names:
+            media_dir.rmdir()
+    return html
+
+
+def _extract_cached(source: str,
+                    input_format: str,
+                    html: str,
+                    media_dir: Path,
+                    cache: Optional[MediaCache] = None
+                    ) -> Tuple[str, List[str]]:
+    key: Optional[str] = None
+    if cache is not None:
+        key = cache.key(source, input_format, html)
+        cached: Optional[Tuple[str, List[str]]] = cache.get(key)
+        if cached is not None:
+            for name in cached[1]:
+                with open(cache.file_path(name), 'rb') as file:
+                    _write_new(media_dir / name, file.read())
+            return cached
+
+    media: Dict[str, bytes] = notebook_media(source) \
+        if input_format == "ipynb" else {}
+    html, files = extract_media(html, media, f"{media_dir.name}/")
+    for name, content in files.items():
+        _write_new(media_dir / name, content)
+    if cache is not None:
+        cache.put(key, html, files)
+    return html, sorted(files)
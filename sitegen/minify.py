@@ -0,0 +1,245 @@
+from typing import Callable, Dict, Final, List, Optional
+
+import os
+
+from pathlib import Path
+
+import re
+
+from .manifest import hash_bytes
+
+
+# Bumped whenever the minifiers change, so cached results are not reused
+MINIFY_VERSION: Final[str] = "1"
+
+# Elements whose contents are kept exactly as written
+_HTML_PRESERVE: Final[re.Pattern] = re.compile(
+    r"(<(pre|code|textarea|script|style)\b[^>]*>.*?</\2\s*>)",
+    re.S | re.I
+)
+_HTML_STYLE: Final[re.Pattern] = re.compile(
+    r"(<style\b[^>]*>)(.*?)(</style\s*>)",
+    re.S | re.I
+)
+_HTML_COMMENT: Final[re.Pattern] = re.compile(r"<!--(?!\[if).*?-->", re.S)
+# Whitespace next to these tags never renders, so it can go entirely
+_HTML_BLOCK: Final[re.Pattern] = re.compile(
+    r"\s*(</?(?:!doctype|html|head|body|meta|link|title|base|div|section|"
+    r"article|aside|nav|header|footer|main|h[1-6]|p|ul|ol|li|dl|dt|dd|"
+    r"table|thead|tbody|tfoot|tr|td|th|form|fieldset|figure|figcaption|"
+    r"blockquote|hr|br|picture|source|noscript|iframe|canvas|svg)\b[^>]*>)\s*",
+    re.I
+)
+
+_CSS_TOKENS: Final[re.Pattern] = re.compile(
+    r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)",
+    re.S
+)
+_CSS_PUNCTUATION: Final[re.Pattern] = re.compile(r"\s*([{};,>])\s*")
+
+# Characters and keywords after which a `/` starts a regular expression
+# rather than a division
+_JS_REGEX_AFTER: Final[str] = "(,=:[!&|?{};+-*%<>~^"
+_JS_REGEX_KEYWORDS: Final[re.Pattern] = re.compile(
+    r"(?:^|[^\w$])(?:return|typeof|instanceof|case|do|else|in|of|new|"
+    r"delete|void|throw|yield|await)$"
+)
+
+
+def minify_html(text: str) -> str:
+    r"""Collapses whitespace and drops comments, leaving `pre`, `code`,
+    `textarea` and `script` elements untouched. Runs of whitespace become a
+    single space, except next to block level tags where they are removed.
+    """
+    parts: List[str] = _HTML_PRESERVE.split(text)
+    result: List[str] = []
+    # split returns text, the whole element and its tag name in turn
+    for index in range(0, len(parts), 3):
+        chunk: str = _HTML_COMMENT.sub("", parts[index])
+        chunk = re.sub(r"\s+", " ", chunk)
+        chunk = _HTML_BLOCK.sub(r"\1", chunk)
+        result.append(chunk)
+        if index + 1 < len(parts):
+            element: str = parts[index + 1]
+            if parts[index + 2].lower() == "style":
+                element = _HTML_STYLE.sub(
+                    lambda match : match[1] + minify_css(match[2]) + match[3],
+                    element
+                )
+            result.append(element)
+    return "".join(result).strip()
+
+
+def minify_css(text: str) -> str:
+    r"""Drops comments and whitespace that does not separate tokens.
+    Strings are left alone, as are spaces before `:` and around `+` and `-`,
+    which matter in selectors and `calc`.
+    """
+    result: List[str] = []
+    code: str = ""
+    position: int = 0
+    for match in _CSS_TOKENS.finditer(text):
+        code += text[position:match.start()]
+        if match[1] is not None:
+            result.extend((_minify_css_code(code), match[1]))
+            code = ""
+        else:
+            code += " "
+        position = match.end()
+    result.append(_minify_css_code(code + text[position:]))
+    return "".join(result).strip()
+
+
+def _minify_css_code(code: str) -> str:
+    code = re.sub(r"\s+", " ", code)
+    code = _CSS_PUNCTUATION.sub(r"\1", code)
+    code = re.sub(r":\s+", ":", code)
+    return code.replace(";}", "}")
+
+
+def _js_regex_allowed(previous: str) -> bool:
+    previous = previous.rstrip()
+    if not previous:
+        return True
+    return previous[-1] in _JS_REGEX_AFTER \
+        or _JS_REGEX_KEYWORDS.search(previous) is not None
+
+
+def _js_literal_end(text: str, index: int) -> int:
+    r"""End of the string or template literal starting at `index`."""
+    quote: str = text[index]
+    end: int = index + 1
+    while end < len(text) and text[end] != quote:
+        end += 2 if text[end] == "\\" else 1
+    return end + 1
+
+
+def _js_regex_end(text: str, index: int) -> int:
+    r"""End of the regular expression literal starting at `index`, flags
+    included.
+    """
+    end: int = index + 1
+    in_class: bool = False
+    while end < len(text) and text[end] != "\n":
+        if text[end] == "\\":
+            end += 2
+            continue
+        if text[end] == "[":
+            in_class = True
+        elif text[end] == "]":
+            in_class = False
+        elif text[end] == "/" and not in_class:
+            break
+        end += 1
+    end += 1
+    while end < len(text) and text[end].isalnum():
+        end += 1
+    return end
+
+
+def _minify_js_code(code: str) -> str:
+    code = re.sub(r"[ \t\r\f\v]+", " ", code)
+    return re.sub(r" ?\n\s*", "\n", code)
+
+
+def minify_js(text: str) -> str:
+    r"""Conservative JavaScript minification: comments, indentation, blank
+    lines and repeated spaces are removed but every line break is kept, so
+    automatic semicolon insertion behaves exactly as before. Strings,
+    template literals and regular expression literals are copied as is.
+    """
+    result: List[str] = []
+    # The code emitted so far with literals blanked out, used to tell a
+    # regular expression from a division
+    previous: str = ""
+    index: int = 0
+    start: int = 0
+
+    while index < len(text):
+        char: str = text[index]
+        if char in "\"'`" or (
+                char == "/"
+                and not text.startswith(("//", "/*"), index)
+                and _js_regex_allowed(previous + text[start:index])):
+            code: str = _minify_js_code(text[start:index])
+            end: int = _js_regex_end(text, index) if char == "/" \
+                else _js_literal_end(text, index)
+            result.extend((code, text[index:end]))
+            previous = (previous + code)[-32:] + "x"
+            index = start = end
+        elif text.startswith("//", index):
+            code = _minify_js_code(text[start:index])
+            result.append(code)
+            previous = (previous + code)[-32:]
+            end = text.find("\n", index)
+            index = start = len(text) if end == -1 else end
+        elif text.startswith("/*", index):
+            code = _minify_js_code(text[start:index])
+            end = text.find("*/", index + 2)
+            end = len(text) if end == -1 else end + 2
+            result.extend((code, "\n" if "\n" in text[index:end] else " "))
+            previous = (previous + code)[-32:] + " "
+            index = start = end
+        else:
+            index += 1
+    result.append(_minify_js_code(text[start:]))
+
+    lines: List[str] = "".join(result).split("\n")
+    return "\n".join(line.strip() for line in lines if line.strip())
+
+
+MINIFIERS: Final[Dict[str, Callable[[str], str]]] = {
+    ".html": minify_html,
+    ".css": minify_css,
+    ".js": minify_js
+}
+
+
+class MinifyCache:
+    r"""On-disk cache of minified files keyed on the input's hash, so an
+    unchanged page or asset is never minified twice.
+
+    Arguments
+    ---------
+
+    cache_dir: Directory minified outputs are stored in
+
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir: Path = cache_dir
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def minify(self, text: str, suffix: str) -> str:
+        key: str = hash_bytes(
+            f"{suffix}\0{MINIFY_VERSION}\0{text}".encode('utf-8')
+        )
+        path: Path = self.entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError:
+            pass
+
+        result: str = MINIFIERS[suffix](text)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path: Path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(result)
+        os.replace(tmp_path, path)
+        return result
+
+
+def minify(text: str,
+           suffix: str,
+           cache: Optional[MinifyCache] = None) -> str:
+    r"""Minifies `text` as the file type `suffix` (`.html`, `.css` or `.js`),
+    returning other file types unchanged.
+    """
+    if suffix not in MINIFIERS:
+        return text
+    if cache is not None:
+        return cache.minify(text, suffix)
+    return MINIFIERS[suffix](text)
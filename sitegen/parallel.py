@@ -0,0 +1,161 @@
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple
+)
+
+from collections import deque
+
+from concurrent.futures import Future
+
+from itertools import islice
+
+from . import profile
+from .convert import ConversionCache, configure_pandoc
+from .writer import PageWriter
+
+
+class BuildError(Exception):
+    r"""Raised when building a single post or project fails, the message
+    names the document so failures inside worker processes can be traced.
+    """
+
+
+def _call(func: Callable,
+          item: Any,
+          cache: Optional[ConversionCache],
+          writer: Optional[PageWriter]) -> Any:
+    if writer is None:
+        return func(item, cache=cache)
+    return func(item, cache=cache, writer=writer)
+
+
+def _cached_call(func: Callable,
+                 cache: Optional[ConversionCache],
+                 writer: Optional[PageWriter],
+                 item: Any,
+                 profiling: bool = False
+                 ) -> Tuple[Any, int, int, int, int, List[Any]]:
+    # Workers profile each item on their own and send the spans back
+    if profiling:
+        profile.start()
+    try:
+        hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+        written, unchanged = (writer.written, writer.unchanged) \
+            if writer else (0, 0)
+        result: Any = _call(func, item, cache, writer)
+        if cache is not None:
+            hits, misses = cache.hits - hits, cache.misses - misses
+        if writer is not None:
+            written = writer.written - written
+            unchanged = writer.unchanged - unchanged
+    finally:
+        profiler: Optional[profile.Profiler] = profile.stop() \
+            if profiling else None
+    return (
+        result,
+        hits,
+        misses,
+        written,
+        unchanged,
+        profiler.events if profiler else []
+    )
+
+
+def imap_jobs(func: Callable,
+              items: Iterable[Any],
+              names: Iterable[str],
+              jobs: int = 1,
+              cache: Optional[ConversionCache] = None,
+              window: Optional[int] = None,
+              writer: Optional[PageWriter] = None) -> Iterator[Any]:
+    r"""Calls `func(item, cache=cache)` for every item, across a pool of
+    `jobs` processes when `jobs` is greater than one, yielding each result
+    in the order of `items` as soon as it is ready. With a `writer`, it is
+    passed to `func` as well.
+
+    At most `window` items, twice `jobs` by default, are handed to the
+    workers at once and `items` is only consumed as they finish, so the
+    caller can write or drop each result before the next ones are made.
+    Cache hit and miss counts from the workers are added to `cache`, the
+    pages they wrote to the counts of `writer` and the spans they profiled
+    to the active profiler. A failure raises
+    `BuildError` naming the matching entry of `names`.
+    """
+    profiler: Optional[profile.Profiler] = profile.active()
+
+    if jobs <= 1:
+        for item, name in zip(items, names):
+            try:
+                result: Any = _call(func, item, cache, writer)
+            except Exception as error:
+                raise BuildError(f"Failed to build {name}: {error}") from error
+            yield result
+        return
+
+    if window is None:
+        window = 2 * jobs
+    pairs: Iterator[Tuple[Any, str]] = zip(items, names)
+
+    # Starting the pool needs multiprocessing, which serial builds skip
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=configure_pandoc) as executor:
+        in_flight: Deque[Tuple[Future, str]] = deque()
+
+        def submit() -> None:
+            for item, name in islice(pairs, window - len(in_flight)):
+                in_flight.append((
+                    executor.submit(
+                        _cached_call,
+                        func,
+                        cache,
+                        writer,
+                        item,
+                        profiler is not None
+                    ),
+                    name
+                ))
+
+        submit()
+        while in_flight:
+            future, name = in_flight.popleft()
+            try:
+                result, hits, misses, written, unchanged, events = \
+                    future.result()
+            except Exception as error:
+                executor.shutdown(cancel_futures=True)
+                raise BuildError(f"Failed to build {name}: {error}") from error
+            if cache is not None:
+                cache.hits += hits
+                cache.misses += misses
+            if writer is not None:
+                writer.add_counts(written, unchanged)
+            if profiler is not None:
+                profiler.merge(events)
+            submit()
+            yield result
+
+
+def map_jobs(func: Callable,
+             items: List[Any],
+             names: List[str],
+             jobs: int = 1,
+             cache: Optional[ConversionCache] = None,
+             writer: Optional[PageWriter] = None) -> List[Any]:
+    r"""The results of `imap_jobs` as a list, in the order of `items`."""
+    if len(items) <= 1:
+        jobs = 1
+    return list(imap_jobs(
+        func,
+        items,
+        names,
+        jobs=jobs,
+        cache=cache,
+        writer=writer
+    ))
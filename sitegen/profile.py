@@ -0,0 +1,193 @@
+from typing import Any, Callable, Dict, Final, Iterator, List, Optional, Tuple
+
+import os
+
+from pathlib import Path
+
+import json
+
+import threading
+
+import time
+
+from contextlib import contextmanager
+
+from functools import wraps
+
+
+TOP_DOCUMENTS: Final[int] = 10
+
+# The profiler of this process while profiling is on, see `start`
+_ACTIVE: Optional["Profiler"] = None
+
+
+def _io_counters() -> Tuple[int, int]:
+    r"""Bytes read and written by this process so far, zero where
+    `/proc/self/io` is not available.
+    """
+    try:
+        with open("/proc/self/io", 'r') as file:
+            counters: Dict[str, int] = {
+                name: int(value)
+                for name, value in (line.split(": ") for line in file)
+            }
+    except (OSError, ValueError):
+        return 0, 0
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+
+class Profiler:
+    r"""Collects timed spans of a build as Chrome trace events.
+
+    Each span records its wall and CPU time and the bytes the process read
+    and wrote while it ran. Spans recorded in worker processes are sent
+    back with their results by `parallel.map_jobs` and added with `merge`.
+    """
+
+    def __init__(self) -> None:
+        self.events: List[Dict[str, Any]] = []
+        self.pid: int = os.getpid()
+        self._lock: threading.Lock = threading.Lock()
+
+    def add(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def merge(self, events: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self.events.extend(events)
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        r"""Wall time, CPU time, bytes and call count summed per span name."""
+        totals: Dict[str, Dict[str, float]] = {}
+        for event in self.events:
+            total: Dict[str, float] = totals.setdefault(event["name"], {
+                "calls": 0,
+                "wall_ms": 0.0,
+                "cpu_ms": 0.0,
+                "read_bytes": 0,
+                "write_bytes": 0
+            })
+            total["calls"] += 1
+            total["wall_ms"] += event["dur"] / 1000
+            total["cpu_ms"] += event["args"]["cpu_ms"]
+            total["read_bytes"] += event["args"]["read_bytes"]
+            total["write_bytes"] += event["args"]["write_bytes"]
+        return totals
+
+    def summary(self, top: int = TOP_DOCUMENTS) -> str:
+        lines: List[str] = [
+            f"{'stage':<24}{'calls':>6}{'wall ms':>10}{'cpu ms':>10}"
+            f"{'read':>12}{'written':>12}"
+        ]
+        totals: Dict[str, Dict[str, float]] = self.totals()
+        for name, total in sorted(totals.items(),
+                                  key=lambda item : -item[1]["wall_ms"]):
+            lines.append(
+                f"{name:<24}{total['calls']:>6}{total['wall_ms']:>10.1f}"
+                f"{total['cpu_ms']:>10.1f}{total['read_bytes']:>12}"
+                f"{total['write_bytes']:>12}"
+            )
+
+        documents: List[Dict[str, Any]] = sorted(
+            (event for event in self.events if "document" in event["args"]),
+            key=lambda event : -event["dur"]
+        )[:top]
+        if documents:
+            lines.append(f"Slowest {len(documents)} documents:")
+            for event in documents:
+                lines.append(
+                    f"  {event['dur'] / 1000:>9.1f} ms  {event['name']:<16}"
+                    f"{event['args']['document']}"
+                )
+        return "\n".join(lines)
+
+    def write_trace(self, path: Path) -> None:
+        r"""Writes the spans as Chrome trace event JSON, which can be opened
+        in chrome://tracing or Perfetto.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(
+                {"traceEvents": self.events, "displayTimeUnit": "ms"},
+                file
+            )
+
+
+def start() -> Profiler:
+    r"""Turns profiling on in this process."""
+    global _ACTIVE
+    _ACTIVE = Profiler()
+    return _ACTIVE
+
+
+def stop() -> Optional[Profiler]:
+    r"""Turns profiling off, returning what was recorded."""
+    global _ACTIVE
+    profiler: Optional[Profiler] = _ACTIVE
+    _ACTIVE = None
+    return profiler
+
+
+def active() -> Optional[Profiler]:
+    return _ACTIVE
+
+
+@contextmanager
+def span(name: str, category: str = "stage", **args: Any) -> Iterator[None]:
+    r"""Times the body of the `with` block as a span called `name`. Extra
+    keyword arguments are stored with the event, a `document` argument
+    marks the span as per-document work for the summary. Does nothing when
+    profiling is off.
+    """
+    profiler: Optional[Profiler] = _ACTIVE
+    if profiler is None:
+        yield
+        return
+
+    read_start, write_start = _io_counters()
+    cpu_start: int = time.thread_time_ns()
+    wall_start: int = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        wall: int = time.perf_counter_ns() - wall_start
+        cpu: int = time.thread_time_ns() - cpu_start
+        read_end, write_end = _io_counters()
+        profiler.add({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            # perf_counter is system wide on Linux, so worker timestamps
+            # line up with the parent's
+            "ts": wall_start / 1000,
+            "dur": wall / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {
+                "cpu_ms": cpu / 1e6,
+                "read_bytes": read_end - read_start,
+                "write_bytes": write_end - write_start,
+                **args
+            }
+        })
+
+
+def profiled(category: str = "stage",
+             document: Optional[Callable[..., str]] = None) -> Callable:
+    r"""Decorator recording every call of a function as a span named after
+    it. `document`, called with the function's arguments, names the
+    document a per-document step works on.
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _ACTIVE is None:
+                return func(*args, **kwargs)
+            extra: Dict[str, str] = {}
+            if document is not None:
+                extra["document"] = document(*args, **kwargs)
+            with span(func.__name__, category, **extra):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,157 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pathlib import Path
+
+from jinja2 import (
+    BytecodeCache,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    Template,
+    TemplateNotFound,
+    meta,
+    select_autoescape
+)
+
+
+# Registries already set up in this process, keyed on their directories, so
+# registries unpickled in worker processes share one set of compiled
+# templates instead of recompiling them for every task
+_PROCESS_REGISTRIES: Dict[Tuple[str, Optional[str]], "TemplateRegistry"] = {}
+
+
+class TemplateRegistry:
+    r"""The Jinja templates used by one build.
+
+    Every template in `templates_dir` is parsed and compiled once, the first
+    time it is requested, and then reused by every page of the build. Page
+    sources such as `site_src` and the games directory get their own
+    environments through `pages(src_dir)`.
+
+    With a `cache_dir` compiled templates are also kept in a Jinja bytecode
+    cache on disk, so later builds skip compilation entirely.
+
+    The registry also follows the `include`, `extends` and `import` tags of
+    every template it is asked about, `paths` and `page_paths` return a
+    template together with everything it pulls in.
+
+    Arguments
+    ---------
+
+    templates_dir: Directory holding the shared templates
+
+    cache_dir: Directory for the bytecode cache, `None` disables it
+
+    """
+
+    def __init__(self,
+                 templates_dir: Path,
+                 cache_dir: Optional[Path] = None,
+                 verbose: bool = False) -> None:
+        if verbose:
+            print(f"Loading templates from {templates_dir}")
+        self.templates_dir: Path = templates_dir
+        self.cache_dir: Optional[Path] = cache_dir
+
+        self.bytecode_cache: Optional[BytecodeCache] = None
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            self.bytecode_cache = FileSystemBytecodeCache(str(cache_dir))
+
+        self.env: Environment = Environment(
+            loader=FileSystemLoader(templates_dir),
+            autoescape=select_autoescape(),
+            bytecode_cache=self.bytecode_cache,
+            auto_reload=False
+        )
+        self._pages: Dict[Path, Environment] = {}
+        self._references: Dict[Path, Set[Path]] = {}
+
+    def get_template(self, name: str) -> Template:
+        return self.env.get_template(name)
+
+    def references(self, env: Environment, name: str) -> Set[str]:
+        r"""Names of the templates `name` includes, extends or imports.
+        Names only known at render time are skipped.
+        """
+        try:
+            source: str = env.loader.get_source(env, name)[0]
+        except TemplateNotFound:
+            return set()
+        return {
+            ref for ref in meta.find_referenced_templates(env.parse(source))
+            if ref is not None
+        }
+
+    def _closure(self,
+                 env: Environment,
+                 root: Path,
+                 names: Tuple[str, ...]) -> List[Path]:
+        seen: Set[str] = set()
+        stack: List[str] = list(names)
+        while stack:
+            name: str = stack.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            path: Path = root / name
+            if path not in self._references:
+                self._references[path] = {
+                    root / ref for ref in self.references(env, name)
+                }
+            stack.extend(
+                ref.relative_to(root).as_posix()
+                for ref in self._references[path]
+            )
+        return sorted(root / name for name in seen)
+
+    def paths(self, names: Tuple[str, ...]) -> List[Path]:
+        r"""Paths of the named templates and of every template they
+        reference, directly or through other templates.
+        """
+        return self._closure(self.env, self.templates_dir, names)
+
+    def page_paths(self, src_dir: Path, name: str) -> List[Path]:
+        r"""Paths of the page template `name` in `src_dir` and of every page
+        template it references.
+        """
+        return self._closure(self.pages(src_dir), src_dir, (name,))
+
+    def graph(self) -> Dict[str, List[str]]:
+        r"""Template references seen so far, as template path to the paths
+        it includes, extends or imports.
+        """
+        return {
+            str(path): sorted(str(ref) for ref in refs)
+            for path, refs in sorted(self._references.items())
+        }
+
+    def pages(self, src_dir: Path) -> Environment:
+        r"""Environment for the page templates in `src_dir`, created once per
+        directory.
+        """
+        if src_dir not in self._pages:
+            self._pages[src_dir] = Environment(
+                loader=FileSystemLoader(src_dir),
+                bytecode_cache=self.bytecode_cache,
+                auto_reload=False
+            )
+        return self._pages[src_dir]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            "templates_dir": self.templates_dir,
+            "cache_dir": self.cache_dir
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        key: Tuple[str, Optional[str]] = (
+            str(state["templates_dir"]),
+            str(state["cache_dir"]) if state["cache_dir"] is not None else None
+        )
+        if key not in _PROCESS_REGISTRIES:
+            _PROCESS_REGISTRIES[key] = TemplateRegistry(
+                state["templates_dir"],
+                state["cache_dir"]
+            )
+        self.__dict__.update(_PROCESS_REGISTRIES[key].__dict__)
@@ -0,0 +1,232 @@
+from typing import Any, Dict, Final, Iterable, List, NamedTuple, Optional
+
+import os
+
+from pathlib import Path
+
+import html
+
+import json
+
+import re
+
+from collections import Counter
+
+from .manifest import hash_value
+
+
+SEARCH_DIR_NAME: Final[str] = "search"
+INDEX_NAME: Final[str] = "index.json"
+# Bumped whenever tokenizing or the index layout changes, so the terms
+# cached for each post are not reused
+SEARCH_VERSION: Final[str] = "1"
+PREFIX_LENGTH: Final[int] = 1
+
+# How much more a match in each field counts than one in the body
+FIELD_WEIGHTS: Final[Dict[str, int]] = {
+    "title": 8,
+    "tags": 4,
+    "description": 2,
+    "body": 1
+}
+
+MIN_TERM_LENGTH: Final[int] = 2
+MAX_TERM_LENGTH: Final[int] = 32
+STOP_WORDS: Final[frozenset] = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from",
+    "has", "have", "in", "is", "it", "its", "of", "on", "or", "that", "the",
+    "this", "to", "was", "were", "which", "will", "with"
+))
+
+_SKIPPED: Final[re.Pattern] = re.compile(
+    r"<(script|style|math|svg)\b.*?</\1\s*>",
+    re.IGNORECASE | re.DOTALL
+)
+_TAG: Final[re.Pattern] = re.compile(r"<[^>]*>")
+_WORD: Final[re.Pattern] = re.compile(r"[^\W_]+")
+_SHARD_NAME: Final[re.Pattern] = re.compile(r"^[a-z0-9]+$")
+
+
+def html_text(text: str) -> str:
+    r"""The readable text of an HTML fragment, scripts, styles and inline
+    math or graphics are dropped.
+    """
+    return html.unescape(_TAG.sub(" ", _SKIPPED.sub(" ", text)))
+
+
+def tokenize(text: str) -> List[str]:
+    r"""Lower-cased words of `text`, without stop words and words too short
+    or long to be worth indexing. `static/search.js` splits queries the
+    same way.
+    """
+    return [
+        word for word in _WORD.findall(text.lower())
+        if MIN_TERM_LENGTH <= len(word) <= MAX_TERM_LENGTH
+        and word not in STOP_WORDS
+    ]
+
+
+def document_terms(fields: Dict[str, str]) -> Dict[str, int]:
+    r"""Score of each term of a document, the count of its occurrences in
+    every field weighted by `FIELD_WEIGHTS`.
+    """
+    terms: Counter = Counter()
+    for field, text in fields.items():
+        weight: int = FIELD_WEIGHTS[field]
+        for term in tokenize(text):
+            terms[term] += weight
+    return dict(terms)
+
+
+def shard_name(term: str, prefix_length: int = PREFIX_LENGTH) -> str:
+    r"""The shard holding `term`, named by its first characters. Terms
+    starting with other characters share the `_` shard.
+    """
+    prefix: str = term[:prefix_length]
+    return prefix if _SHARD_NAME.match(prefix) else "_"
+
+
+class SearchDocument(NamedTuple):
+    # The key the terms were computed for, see `SearchIndex.is_fresh`
+    key: str
+    meta: Dict[str, Any]
+    terms: Dict[str, int]
+
+
+class SearchReport(NamedTuple):
+    documents: int
+    indexed: int
+    terms: int
+    shards: int
+    size: int
+    seconds: float
+
+    def __str__(self) -> str:
+        return (
+            f"Search index: {self.documents} documents "
+            f"({self.indexed} indexed), {self.terms} terms in "
+            f"{self.shards} shards, {self.size} bytes, "
+            f"built in {self.seconds * 1000:.0f} ms"
+        )
+
+
+class SearchIndex:
+    r"""Inverted index of the posts for the client-side search.
+
+    The terms of every post are kept in the build cache with the key of the
+    inputs they came from, so a build only tokenizes the posts that changed
+    since the last one. `shards` splits the index by term prefix, the
+    browser fetches `index.json` with the post titles and links and then
+    only the shards of the words searched for.
+
+    Arguments
+    ---------
+
+    path: JSON file the per-post terms are cached in
+
+    prefix_length: Number of leading characters of a term naming its shard
+
+    """
+
+    def __init__(self,
+                 path: Path,
+                 prefix_length: int = PREFIX_LENGTH) -> None:
+        self.path: Path = path
+        self.prefix_length: int = prefix_length
+        self.documents: Dict[str, SearchDocument] = {}
+
+    @classmethod
+    def load(cls,
+             path: Path,
+             prefix_length: int = PREFIX_LENGTH) -> "SearchIndex":
+        index: SearchIndex = cls(path, prefix_length)
+        try:
+            with open(path, 'r') as file:
+                data: Dict[str, Any] = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return index
+        if data.get("version") != SEARCH_VERSION:
+            return index
+        index.documents = {
+            name: SearchDocument(**document)
+            for name, document in data["documents"].items()
+        }
+        return index
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path: Path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as file:
+            json.dump({
+                "version": SEARCH_VERSION,
+                "documents": {
+                    name: document._asdict()
+                    for name, document in self.documents.items()
+                }
+            }, file)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def key(*inputs: Any) -> str:
+        return hash_value((SEARCH_VERSION, *inputs))
+
+    def is_fresh(self, name: str, key: str) -> bool:
+        document: Optional[SearchDocument] = self.documents.get(name)
+        return document is not None and document.key == key
+
+    def add(self,
+            name: str,
+            key: str,
+            meta: Dict[str, Any],
+            fields: Dict[str, str]) -> None:
+        self.documents[name] = SearchDocument(
+            key,
+            meta,
+            document_terms(fields)
+        )
+
+    def retain(self, names: Iterable[str]) -> List[str]:
+        r"""Drops the documents not in `names`, returning their names."""
+        kept: frozenset = frozenset(names)
+        removed: List[str] = [
+            name for name in self.documents if name not in kept
+        ]
+        for name in removed:
+            del self.documents[name]
+        return removed
+
+    def shards(self) -> Dict[str, Dict[str, List[List]]]:
+        r"""The postings of every term, grouped by shard. A term's postings
+        are `[document, score]` pairs, best match first.
+        """
+        shards: Dict[str, Dict[str, List[List]]] = {}
+        for name in sorted(self.documents):
+            for term, score in self.documents[name].terms.items():
+                shards.setdefault(
+                    shard_name(term, self.prefix_length), {}
+                ).setdefault(term, []).append([name, score])
+        for shard in shards.values():
+            for postings in shard.values():
+                postings.sort(key=lambda posting : -posting[1])
+        return {
+            name: dict(sorted(shard.items()))
+            for name, shard in sorted(shards.items())
+        }
+
+    def manifest(self, shard_names: Iterable[str]) -> Dict[str, Any]:
+        r"""Contents of `index.json`: the shard layout and what search
+        results show of each document.
+        """
+        return {
+            "version": SEARCH_VERSION,
+            "prefix_length": self.prefix_length,
+            "shards": sorted(shard_names),
+            "documents": {
+                name: self.documents[name].meta
+                for name in sorted(self.documents)
+            }
+        }
+
+
+def dump_json(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
@@ -0,0 +1,539 @@
+from typing import Any, Callable, Dict, Final, List, Optional, Set, Tuple, Union
+
+from pathlib import Path
+
+import mimetypes
+
+import shutil
+
+import threading
+
+import time
+
+import traceback
+
+from collections import OrderedDict
+
+from concurrent.futures import ThreadPoolExecutor
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from urllib.parse import unquote, urlsplit
+
+from . import build
+from .catalogue import MetadataCatalogue
+from .convert import ConversionCache, configure_pandoc, start_backend
+from .media import MEDIA_DIR_NAME
+from .registry import TemplateRegistry
+from .search import SEARCH_DIR_NAME, SearchIndex
+from .watch import WATCH_DIRS, make_watcher
+from .writer import PageWriter
+
+
+# Where rendered pages would be written, pages never are but post media is
+# extracted here and the build functions make their directories
+SERVE_DIR: Final[Path] = build.CACHE_DIR / "serve"
+# Rendered pages kept in memory, least recently requested are dropped first
+PAGE_CACHE_BYTES: Final[int] = 64 << 20
+
+
+class MemoryWriter(PageWriter):
+    r"""A `PageWriter` keeping pages in memory instead of writing them, so
+    the build functions render straight into the server's cache. `take`
+    hands over the pages written since it was last called.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.pages: Dict[Path, bytes] = {}
+
+    def write(self, path: Path, text: str) -> None:
+        self.pages[path] = text.encode('utf-8')
+        self.written += 1
+
+    def take(self) -> Dict[Path, bytes]:
+        pages: Dict[Path, bytes] = self.pages
+        self.pages = {}
+        return pages
+
+
+def _under(path: Path, root: Path) -> bool:
+    return path == root or root in path.parents
+
+
+class PageCache:
+    r"""LRU of rendered pages by URL path, each with the source files and
+    directories it was rendered from. `invalidate` drops the pages whose
+    sources changed.
+
+    Arguments
+    ---------
+
+    max_bytes: Size of the pages kept, the least recently used pages are
+    dropped past it
+
+    """
+
+    def __init__(self, max_bytes: int = PAGE_CACHE_BYTES) -> None:
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.pages: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        if key not in self.pages:
+            return None
+        self.pages.move_to_end(key)
+        return self.pages[key][0]
+
+    def put(self, key: str, data: bytes, sources: Tuple[Path, ...]) -> None:
+        self.remove(key)
+        self.pages[key] = (data, sources)
+        self.size += len(data)
+        while self.size > self.max_bytes and len(self.pages) > 1:
+            self.remove(next(iter(self.pages)))
+
+    def remove(self, key: str) -> None:
+        if key in self.pages:
+            self.size -= len(self.pages.pop(key)[0])
+
+    def invalidate(self, changed: Set[Path]) -> int:
+        r"""Drops the pages rendered from any of the `changed` paths,
+        returning how many.
+        """
+        stale: List[str] = [
+            key for key, (_, sources) in self.pages.items()
+            if any(_under(path, source)
+                   for path in changed for source in sources)
+        ]
+        for key in stale:
+            self.remove(key)
+        return len(stale)
+
+
+class DevSite:
+    r"""Renders the pages of the site on request, for `serve`.
+
+    A URL is mapped to the one build function producing it, called with a
+    `MemoryWriter` and `SERVE_DIR` as the build directory: a post page
+    converts just that post, listings only read post metadata. Whatever
+    the call renders goes into a `PageCache`, so the other pages of a
+    listing are ready when they are asked for. Static files are served
+    from the source trees, posts' extracted media from `SERVE_DIR`.
+
+    Everything runs on one thread, the SQLite catalogue and the pandoc
+    backend are not shared between threads, and `invalidate` runs between
+    renders.
+
+    Arguments
+    ---------
+
+    cache: On-disk pandoc cache, shared with the build
+
+    backend: Pandoc backend, see `convert.start_backend`
+
+    page_size: Posts per page of the blog and tag listings
+
+    max_bytes: Size of the in-memory page cache
+
+    """
+
+    def __init__(self,
+                 cache: Optional[ConversionCache] = None,
+                 backend: Optional[Any] = None,
+                 page_size: int = build.POSTS_PER_PAGE,
+                 max_bytes: int = PAGE_CACHE_BYTES,
+                 verbose: bool = False) -> None:
+        self.cache: Optional[ConversionCache] = cache
+        self.backend: Optional[Any] = backend
+        self.page_size: int = page_size
+        self.verbose: bool = verbose
+        self.pages: PageCache = PageCache(max_bytes)
+        self.writer: MemoryWriter = MemoryWriter()
+        self.templates: TemplateRegistry = self.make_templates()
+        self.catalogue: Optional[MetadataCatalogue] = None
+        self._posts: Optional[Dict[str, build.PostData]] = None
+        self._projects: Optional[Dict[str, build.ProjectData]] = None
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="render"
+        )
+
+    @staticmethod
+    def make_templates() -> TemplateRegistry:
+        return TemplateRegistry(
+            build.TEMPLATE_DIR,
+            cache_dir=build.CACHE_DIR / "jinja"
+        )
+
+    def call(self, func: Callable, *args: Any) -> Any:
+        r"""Runs `func(*args)` on the render thread and returns its result."""
+        return self._executor.submit(func, *args).result()
+
+    def close(self) -> None:
+        if self.catalogue is not None:
+            self.call(self.catalogue.close)
+        self._executor.shutdown()
+
+    def posts(self) -> Dict[str, build.PostData]:
+        if self._posts is None:
+            if self.catalogue is None:
+                self.catalogue = MetadataCatalogue(build.CATALOGUE_PATH)
+            self._posts = {
+                str(post.directory): post
+                for post in build.collect_posts(catalogue=self.catalogue)
+            }
+        return self._posts
+
+    def projects(self) -> Dict[str, build.ProjectData]:
+        if self._projects is None:
+            if self.catalogue is None:
+                self.catalogue = MetadataCatalogue(build.CATALOGUE_PATH)
+            self._projects = {
+                str(project.directory): project
+                for project in build.collect_projects(
+                    catalogue=self.catalogue,
+                    verbose=False
+                )
+            }
+        return self._projects
+
+    def index(self) -> build.ContentIndex:
+        return build.ContentIndex([
+            build.post_build_data(post, SERVE_DIR)
+            for post in self.posts().values()
+        ])
+
+    def invalidate(self, changed: Set[Path]) -> None:
+        r"""Forgets the pages and metadata read from the `changed` files."""
+        changed = {path.absolute() for path in changed}
+        if any(_under(path, build.POSTS_DIR.absolute()) for path in changed):
+            self._posts = None
+        if any(_under(path, build.PROJS_DIR.absolute()) for path in changed):
+            self._projects = None
+        if any(_under(path, root.absolute()) for path in changed
+               for root in (build.TEMPLATE_DIR, build.SRC_DIR)):
+            self.templates = self.make_templates()
+        dropped: int = self.pages.invalidate(changed)
+        if self.verbose:
+            print(f"{len(changed)} files changed, {dropped} pages dropped")
+
+    def get(self, url_path: str) -> Optional[Union[bytes, Path]]:
+        r"""The page at `url_path`, or the static file to send, `None` when
+        there is neither. Safe to call from any thread.
+        """
+        parts: Tuple[str, ...] = tuple(
+            part for part in unquote(url_path).split("/") if part
+        )
+        if any(part in (".", "..") for part in parts):
+            return None
+        return self.call(self._get, parts or ("index.html",))
+
+    def _get(self, parts: Tuple[str, ...]) -> Optional[Union[bytes, Path]]:
+        key: str = "/".join(parts)
+        page: Optional[bytes] = self.pages.get(key)
+        if page is not None:
+            return page
+
+        static: Optional[Path] = self.static_file(parts)
+        if static is not None:
+            return static
+
+        render: Optional[Tuple[Callable, Tuple[Path, ...]]] = \
+            self.renderer(parts)
+        if render is None:
+            return None
+        func, sources = render
+        start: float = time.perf_counter()
+        func()
+        sources = tuple(source.absolute() for source in sources)
+        for path, data in self.writer.take().items():
+            self.pages.put(
+                path.relative_to(SERVE_DIR).as_posix(),
+                data,
+                sources
+            )
+        if self.verbose:
+            print(
+                f"Rendered {key} in "
+                f"{(time.perf_counter() - start) * 1000:.0f} ms"
+            )
+        return self.pages.get(key)
+
+    def static_file(self, parts: Tuple[str, ...]) -> Optional[Path]:
+        r"""The source file served at `parts`, if it is a static file."""
+        root: Optional[Path] = None
+        rest: Tuple[str, ...] = ()
+        if parts[0] == "static":
+            root, rest = build.STATIC_DIR, parts[1:]
+        elif parts[0] == "games" and len(parts) > 2 \
+                and parts[1] in ("static", "scripts"):
+            root, rest = build.GAMES_DIR / parts[1], parts[2:]
+        elif parts[0] == "posts" and len(parts) > 3:
+            post: Optional[build.PostData] = self.posts().get(parts[1])
+            if post is None:
+                return None
+            if parts[2] == "static" and post.static is not None:
+                root = build.POSTS_DIR / post.directory / post.static
+            elif parts[2] == MEDIA_DIR_NAME:
+                # Extracted when the page is rendered
+                root = SERVE_DIR / "posts" / post.directory / MEDIA_DIR_NAME
+                if not (root / parts[3]).is_file():
+                    self._get(("posts", parts[1], post.path.stem + ".html"))
+            rest = parts[3:]
+        elif parts[0] == "projects" and len(parts) > 3 \
+                and parts[2] == "static":
+            project: Optional[build.ProjectData] = \
+                self.projects().get(parts[1])
+            if project is None:
+                return None
+            root = build.PROJS_DIR / project.directory / project.static
+            rest = parts[3:]
+        if root is None:
+            return None
+        path: Path = root.joinpath(*rest)
+        return path if path.is_file() else None
+
+    def renderer(self, parts: Tuple[str, ...]
+                 ) -> Optional[Tuple[Callable, Tuple[Path, ...]]]:
+        r"""The call rendering the page at `parts`, with the sources the
+        pages it renders depend on, or `None` when no page is there. Pages
+        written by later build stages take precedence, as in the build.
+        """
+        templates: Tuple[Path, ...] = (build.TEMPLATE_DIR,)
+        name: str = parts[-1]
+        if not name.endswith(".html") and parts[0] != SEARCH_DIR_NAME:
+            return None
+
+        if parts == ("projects.html",):
+            return self.render_projects_page, \
+                (build.PROJS_DIR, *templates)
+        if len(parts) <= 2:
+            listing: str = parts[0].removesuffix(".html")
+            numbered: bool = len(parts) == 1 \
+                or name.removesuffix(".html").isdigit()
+            if numbered and listing == "blog":
+                return lambda : self.render_listing("blog"), \
+                    (build.POSTS_DIR, *templates)
+            if numbered and listing in self.index().tags:
+                return lambda : self.render_listing(listing), \
+                    (build.POSTS_DIR, *templates)
+        if len(parts) == 1 \
+                and (build.SRC_DIR / f"{name}.jinja").is_file():
+            return lambda : self.render_source_page(build.SRC_DIR, name), \
+                (build.SRC_DIR, *templates)
+        if len(parts) == 2 and parts[0] == "games" \
+                and (build.GAMES_DIR / f"{name}.jinja").is_file():
+            return lambda : self.render_source_page(build.GAMES_DIR, name), \
+                (build.GAMES_DIR, *templates)
+        if len(parts) == 3 and parts[0] == "posts" \
+                and parts[1] in self.posts():
+            post: build.PostData = self.posts()[parts[1]]
+            return lambda : self.render_post(post), \
+                (build.POSTS_DIR / post.directory, *templates)
+        if len(parts) == 3 and parts[0] == "projects" \
+                and parts[1] in self.projects():
+            project: build.ProjectData = self.projects()[parts[1]]
+            return lambda : self.render_project(project), \
+                (build.PROJS_DIR / project.directory, build.POSTS_DIR,
+                 *templates)
+        if len(parts) == 2 and parts[0] == SEARCH_DIR_NAME:
+            return self.render_search, (build.POSTS_DIR,)
+        return None
+
+    def render_source_page(self, src_dir: Path, name: str) -> None:
+        depth: str = "../" if src_dir == build.GAMES_DIR else ""
+        out_path: Path = SERVE_DIR / ("games" if depth else "") / name
+        self.writer.write(out_path, build.render_source_page(
+            src_dir / f"{name}.jinja",
+            self.templates.pages(src_dir),
+            self.templates,
+            depth=depth
+        ))
+
+    def render_listing(self, listing: str) -> None:
+        index: build.ContentIndex = self.index()
+        build.build_blog_page(
+            index.by_date if listing == "blog" else index.tag_posts(listing),
+            self.templates,
+            SERVE_DIR,
+            SERVE_DIR / "posts",
+            blog_page_path=Path(f"{listing}.html"),
+            title="Blog" if listing == "blog" else f"{listing} Blog Posts",
+            page_size=self.page_size,
+            writer=self.writer
+        )
+
+    def render_post(self, post: build.PostData) -> None:
+        build.build_post(
+            post,
+            site_build_dir=SERVE_DIR,
+            post_build_dir=SERVE_DIR / "posts",
+            templates=self.templates,
+            cache=self.cache,
+            backend=self.backend,
+            writer=self.writer,
+            media_cache_dir=build.MEDIA_CACHE_DIR
+        )
+
+    def render_project(self, project: build.ProjectData) -> None:
+        build.build_project(
+            project,
+            self.index(),
+            self.templates,
+            site_build_dir=SERVE_DIR,
+            posts_build_dir=SERVE_DIR / "posts",
+            projects_build_dir=SERVE_DIR / "projects",
+            cache=self.cache,
+            backend=self.backend,
+            writer=self.writer
+        )
+
+    def render_projects_page(self) -> None:
+        build.build_projects_page(
+            [
+                build.ProjectBuildData(
+                    build.project_page_path(project, SERVE_DIR / "projects"),
+                    SERVE_DIR / "projects" / project.directory,
+                    project
+                )
+                for project in self.projects().values()
+            ],
+            self.templates,
+            SERVE_DIR,
+            SERVE_DIR / "projects",
+            writer=self.writer
+        )
+
+    def render_search(self) -> None:
+        r"""The whole search index, only posts changed since the last build
+        or request are converted.
+        """
+        index: SearchIndex = SearchIndex.load(build.SEARCH_CACHE_PATH)
+        for post in self.posts().values():
+            build.index_post(
+                index,
+                post,
+                cache=self.cache,
+                backend=self.backend
+            )
+        index.retain(self.posts())
+        index.save()
+        build.write_search_index(index, SERVE_DIR, writer=self.writer)
+
+
+def make_handler(site: DevSite, verbose: bool = False) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            self.respond(send_body=True)
+
+        def do_HEAD(self) -> None:
+            self.respond(send_body=False)
+
+        def respond(self, send_body: bool) -> None:
+            url_path: str = urlsplit(self.path).path
+            try:
+                found: Optional[Union[bytes, Path]] = site.get(url_path)
+            except Exception:
+                self.send_text(500, traceback.format_exc(), send_body)
+                return
+            if found is None:
+                self.send_text(404, f"Nothing at {url_path}\n", send_body)
+                return
+
+            name: str = found.name if isinstance(found, Path) \
+                else url_path.rstrip("/").rsplit("/", 1)[-1] or "index.html"
+            self.send_response(200)
+            self.send_header(
+                "Content-Type",
+                mimetypes.guess_type(name)[0] or "application/octet-stream"
+            )
+            self.send_header("Cache-Control", "no-cache")
+            if isinstance(found, Path):
+                self.send_header("Content-Length", str(found.stat().st_size))
+                self.end_headers()
+                if send_body:
+                    with open(found, 'rb') as file:
+                        shutil.copyfileobj(file, self.wfile)
+            else:
+                self.send_header("Content-Length", str(len(found)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(found)
+
+        def send_text(self, status: int, text: str, send_body: bool) -> None:
+            data: bytes = text.encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(data)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            if verbose:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+def watch_sources(site: DevSite,
+                  polling: bool = False,
+                  interval: float = 0.5) -> threading.Thread:
+    r"""Starts a daemon thread invalidating `site`'s pages whenever a source
+    changes, see `watch.make_watcher`.
+    """
+    watcher: Any = make_watcher(WATCH_DIRS, polling=polling, interval=interval)
+
+    def run() -> None:
+        while True:
+            site.call(site.invalidate, watcher.wait())
+
+    thread: threading.Thread = threading.Thread(
+        target=run,
+        name="source-watcher",
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def serve(host: str = "127.0.0.1",
+          port: int = 8000,
+          pandoc_mode: str = "auto",
+          page_size: int = build.POSTS_PER_PAGE,
+          max_bytes: int = PAGE_CACHE_BYTES,
+          polling: bool = False,
+          interval: float = 0.5,
+          verbose: bool = True) -> None:
+    r"""Serves the site from its sources at `http://host:port/`, rendering
+    each page the first time it is requested rather than building the
+    site, see `DevSite`. Rendered pages stay in memory until one of their
+    sources changes. Nothing is written to `site_out`.
+    """
+    configure_pandoc()
+    SERVE_DIR.mkdir(parents=True, exist_ok=True)
+
+    backend: Optional[Any] = start_backend(pandoc_mode, verbose=verbose)
+    site: DevSite = DevSite(
+        cache=ConversionCache(build.CACHE_DIR / "pandoc"),
+        backend=backend,
+        page_size=page_size,
+        max_bytes=max_bytes,
+        verbose=verbose
+    )
+    server: ThreadingHTTPServer = ThreadingHTTPServer(
+        (host, port),
+        make_handler(site, verbose=verbose)
+    )
+    watch_sources(site, polling=polling, interval=interval)
+    print(f"Serving the site at http://{host}:{server.server_address[1]}/")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        site.close()
+        if backend is not None:
+            backend.close()
@@ -0,0 +1,488 @@
+from typing import Any, Dict, Final, List, NamedTuple, Optional, Tuple
+
+from pathlib import Path
+
+import glob
+
+import json
+
+import os
+
+import re
+
+from functools import partial
+
+from .assets import AssetStore
+from .build import (
+    ASSETS_STATE_PATH,
+    BUILD_DIR,
+    IMAGE_CACHE_DIR,
+    MEDIA_CACHE_DIR,
+    POSTS_DIR,
+    POSTS_PER_PAGE,
+    PROJS_DIR,
+    SEARCH_CACHE_PATH,
+    ContentIndex,
+    PostBlocks,
+    PostBuildData,
+    PostData,
+    ProjectBuildData,
+    ProjectData,
+    build_blog_page,
+    build_project_page_html,
+    build_projects_page,
+    build_tags_pages,
+    clean,
+    convert_project,
+    copy_project_files,
+    default_templates,
+    index_post,
+    post_build_data,
+    post_from_json,
+    post_thumbnail,
+    project_from_json,
+    project_page_path,
+    project_thumbnail,
+    stream_posts,
+    write_project,
+    write_search_index
+)
+from .convert import ConversionCache
+from .images import ThumbnailSet, build_thumbnails
+from .manifest import hash_value
+from .parallel import map_jobs
+from .profile import profiled, span
+from .registry import TemplateRegistry
+from .search import PREFIX_LENGTH, SearchDocument, SearchIndex
+from .sync import sync_tree
+from .writer import PageWriter, default_writer
+
+
+SHARDS_DIR: Final[Path] = Path("site_shards")
+FRAGMENT_NAME: Final[str] = "shard.json"
+# Bumped whenever the fragment layout changes, so a merge never mixes
+# shards written by different versions
+FRAGMENT_VERSION: Final[int] = 1
+
+_SHARD_SPEC: Final[re.Pattern] = re.compile(r"^\s*(\d+)\s*/\s*(\d+)\s*$")
+
+
+class ShardSpec(NamedTuple):
+    # One based, as in `--shard 2/4`
+    number: int
+    count: int
+
+    def __str__(self) -> str:
+        return f"{self.number}/{self.count}"
+
+    def owns(self, name: str) -> bool:
+        r"""Whether the post or project in directory `name` is built by
+        this shard, see `shard_of`.
+        """
+        return shard_of(name, self.count) == self.number
+
+
+def parse_shard(text: str) -> ShardSpec:
+    r"""Parses `i/N`, shard `i` of `N` counting from one. Raises
+    `ValueError` when `text` is not of that form.
+    """
+    match: Optional[re.Match] = _SHARD_SPEC.match(text)
+    if match is None:
+        raise ValueError(f"Expected a shard as i/N, got {text!r}")
+    shard: ShardSpec = ShardSpec(int(match[1]), int(match[2]))
+    if not 1 <= shard.number <= shard.count:
+        raise ValueError(f"No shard {shard}, shards count from 1 to N")
+    return shard
+
+
+def shard_of(name: str, count: int) -> int:
+    r"""The shard, from 1 to `count`, building the post or project in
+    directory `name`. Assignment hashes the name, so it is the same on
+    every runner and a new post does not move the others.
+    """
+    return int(hash_value(name)[:8], 16) % count + 1
+
+
+def shard_dir(shard: ShardSpec, shards_dir: Path = SHARDS_DIR) -> Path:
+    return shards_dir / f"{shard.number}-of-{shard.count}"
+
+
+def read_documents(src_dir: Path,
+                   json_name: str,
+                   shard: Optional[ShardSpec] = None) -> Dict[str, Dict]:
+    r"""The parsed `json_name` of every document directory in `src_dir`,
+    by directory name, only those `shard` owns when it is given.
+    """
+    documents: Dict[str, Dict] = {}
+    for json_path in sorted(glob.glob(f"*/{json_name}", root_dir=src_dir)):
+        name: str = Path(json_path).parent.name
+        if shard is not None and not shard.owns(name):
+            continue
+        with open(src_dir / json_path, 'r') as file:
+            documents[name] = json.load(file)
+    return documents
+
+
+class ShardFragment(NamedTuple):
+    r"""What a shard leaves for the merge besides its output tree: the
+    metadata of its posts and projects, the converted HTML of its projects
+    and the search terms of its posts.
+    """
+    shard: ShardSpec
+    settings: Dict[str, Any]
+    posts: Dict[str, Dict]
+    projects: Dict[str, Dict]
+    project_html: Dict[str, str]
+    search: Dict[str, SearchDocument]
+
+    def save(self, path: Path) -> None:
+        tmp_path: Path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as file:
+            json.dump({
+                "version": FRAGMENT_VERSION,
+                "shard": list(self.shard),
+                "settings": self.settings,
+                "posts": self.posts,
+                "projects": self.projects,
+                "project_html": self.project_html,
+                "search": {
+                    name: document._asdict()
+                    for name, document in self.search.items()
+                }
+            }, file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ShardFragment":
+        r"""Reads the fragment at `path`, raising `FileNotFoundError` when
+        there is none and `ValueError` when another version wrote it.
+        """
+        if not path.is_file():
+            raise FileNotFoundError(f"No shard fragment {path}")
+        with open(path, 'r') as file:
+            data: Dict[str, Any] = json.load(file)
+        if data.get("version") != FRAGMENT_VERSION:
+            raise ValueError(
+                f"{path} was written by another version, rebuild the shard"
+            )
+        return cls(
+            ShardSpec(*data["shard"]),
+            data["settings"],
+            data["posts"],
+            data["projects"],
+            data["project_html"],
+            {
+                name: SearchDocument(**document)
+                for name, document in data["search"].items()
+            }
+        )
+
+
+@profiled()
+def build_shard(shard: ShardSpec,
+                out_dir: Path,
+                post_src_dir: Path = POSTS_DIR,
+                projects_src_dir: Path = PROJS_DIR,
+                templates: Optional[TemplateRegistry] = None,
+                post_template_name: str = "post_temp.html.jinja",
+                cache: Optional[ConversionCache] = None,
+                backend: Optional[Any] = None,
+                jobs: int = 1,
+                media_cache_dir: Path = MEDIA_CACHE_DIR,
+                search_cache_path: Path = SEARCH_CACHE_PATH,
+                writer: Optional[PageWriter] = None,
+                verbose: bool = False) -> ShardFragment:
+    r"""Does the pandoc work of one shard of the site into `out_dir`, which
+    is cleaned first.
+
+    The pages, media and static files of the posts the shard owns are
+    written under `out_dir/posts` as a full build lays them out, the static
+    files of its projects under `out_dir/projects`. Project pages list the
+    project's posts, which may belong to other shards, so only the project
+    documents are converted here and the pages are rendered by
+    `merge_shards`. The fragment describing the shard is saved to
+    `out_dir/shard.json` and returned.
+
+    Arguments
+    ---------
+
+    shard: Which shard to build, posts and projects are assigned by
+    `shard_of` their directory name
+
+    out_dir: Directory the partial output tree is written to
+
+    search_cache_path: Search terms cache, reused for unchanged posts
+
+    """
+    templates = default_templates(templates)
+    writer = default_writer(writer)
+
+    clean(out_dir)
+    out_dir.mkdir(parents=True)
+
+    posts_json: Dict[str, Dict] = read_documents(
+        post_src_dir,
+        "post.json",
+        shard
+    )
+    projects_json: Dict[str, Dict] = read_documents(
+        projects_src_dir,
+        "proj.json",
+        shard
+    )
+    if verbose:
+        print(
+            f"Shard {shard}: {len(posts_json)} posts, "
+            f"{len(projects_json)} projects"
+        )
+
+    posts_data: List[PostData] = [
+        post_from_json(post_json) for post_json in posts_json.values()
+    ]
+    with span("posts", "shard"):
+        for post in stream_posts(
+            posts_data,
+            post_src_dir=post_src_dir,
+            post_build_dir=out_dir / "posts",
+            site_build_dir=out_dir,
+            templates=templates,
+            post_template_name=post_template_name,
+            cache=cache,
+            backend=backend,
+            jobs=jobs,
+            media_cache_dir=media_cache_dir,
+            writer=writer,
+            verbose=verbose
+        ):
+            pass
+
+    with span("search", "shard"):
+        # The posts were just converted, so these are pandoc cache hits
+        index: SearchIndex = SearchIndex.load(search_cache_path)
+        for post in posts_data:
+            index_post(
+                index,
+                post,
+                post_src_dir=post_src_dir,
+                cache=cache,
+                backend=backend,
+                verbose=verbose
+            )
+        index.save()
+
+    projs_data: List[ProjectData] = [
+        project_from_json(proj_json) for proj_json in projects_json.values()
+    ]
+    with span("projects", "shard"):
+        project_html: List[str] = map_jobs(
+            partial(
+                convert_project,
+                projects_src_dir=projects_src_dir,
+                backend=backend
+            ),
+            projs_data,
+            [f"project {project.directory}" for project in projs_data],
+            jobs=jobs,
+            cache=cache
+        )
+        for project in projs_data:
+            copy_project_files(
+                ProjectBuildData(
+                    project_page_path(project, out_dir / "projects"),
+                    out_dir / "projects" / project.directory,
+                    project
+                ),
+                out_dir,
+                projects_src_dir,
+                out_dir / "projects",
+                writer=writer,
+                verbose=verbose
+            )
+
+    writer.flush()
+
+    fragment: ShardFragment = ShardFragment(
+        shard,
+        writer.settings(),
+        posts_json,
+        projects_json,
+        dict(zip(projects_json, project_html)),
+        {
+            str(post.directory): index.documents[str(post.directory)]
+            for post in posts_data
+        }
+    )
+    fragment.save(out_dir / FRAGMENT_NAME)
+    if verbose:
+        print(f"Wrote shard {shard} to {out_dir}")
+    return fragment
+
+
+def load_fragments(shard_dirs: List[Path],
+                   settings: Optional[Dict[str, Any]] = None
+                   ) -> List[Tuple[Path, ShardFragment]]:
+    r"""The fragments of the shards in `shard_dirs` in shard order, checked
+    to be every shard of one split of the site, each exactly once, written
+    with the same settings, `settings` when given. Raises `ValueError`
+    otherwise, the pages of shards built with other settings would not
+    match the merge's.
+    """
+    fragments: List[Tuple[Path, ShardFragment]] = [
+        (path, ShardFragment.load(path / FRAGMENT_NAME))
+        for path in shard_dirs
+    ]
+    if not fragments:
+        raise ValueError("No shards to merge")
+
+    counts: set = {fragment.shard.count for _, fragment in fragments}
+    if len(counts) > 1:
+        raise ValueError(
+            f"Shards from different splits: {sorted(counts)} shards"
+        )
+    count: int = counts.pop()
+    numbers: List[int] = [fragment.shard.number for _, fragment in fragments]
+    duplicated: List[int] = sorted({n for n in numbers if numbers.count(n) > 1})
+    if duplicated:
+        raise ValueError(f"Shards given more than once: {duplicated}")
+    missing: List[int] = sorted(set(range(1, count + 1)) - set(numbers))
+    if missing:
+        raise ValueError(f"Missing shards {missing} of {count}")
+    if any(fragment.settings != fragments[0][1].settings
+           for _, fragment in fragments):
+        raise ValueError("Shards were built with different settings")
+    if settings is not None and fragments[0][1].settings != settings:
+        raise ValueError("Shards were built with other settings")
+    return sorted(fragments, key=lambda item : item[1].shard.number)
+
+
+@profiled()
+def merge_shards(fragments: List[Tuple[Path, ShardFragment]],
+                 site_build_dir: Path = BUILD_DIR,
+                 templates: Optional[TemplateRegistry] = None,
+                 image_cache_dir: Path = IMAGE_CACHE_DIR,
+                 page_size: int = POSTS_PER_PAGE,
+                 jobs: int = 1,
+                 writer: Optional[PageWriter] = None,
+                 verbose: bool = False) -> List[PostBuildData]:
+    r"""Combines the shards `build_shard` wrote into `site_build_dir` and
+    builds everything that needs all of the posts and projects: the blog
+    and tag listings, the project pages and listing, the thumbnails and the
+    search index. No pandoc runs here.
+
+    `fragments` are the shard directories with their fragments, checked by
+    `load_fragments`.
+    """
+    templates = default_templates(templates)
+    writer = default_writer(writer)
+    blocks: PostBlocks = PostBlocks(templates)
+
+    posts_build_dir: Path = site_build_dir / "posts"
+    projects_build_dir: Path = site_build_dir / "projects"
+    posts_data: List[PostData] = []
+    projs_data: List[ProjectData] = []
+    project_html: Dict[Path, str] = {}
+    index: SearchIndex = SearchIndex(SEARCH_CACHE_PATH, PREFIX_LENGTH)
+
+    with span("copy", "merge"):
+        for path, fragment in fragments:
+            if verbose:
+                print(f"Merging shard {fragment.shard} from {path}")
+            for post_json in fragment.posts.values():
+                post: PostData = post_from_json(post_json)
+                sync_tree(
+                    path / "posts" / post.directory,
+                    posts_build_dir / post.directory
+                )
+                posts_data.append(post)
+            for name, proj_json in fragment.projects.items():
+                project: ProjectData = project_from_json(proj_json)
+                if (path / "projects" / project.directory).is_dir():
+                    sync_tree(
+                        path / "projects" / project.directory,
+                        projects_build_dir / project.directory
+                    )
+                projs_data.append(project)
+                project_html[project.directory] = \
+                    fragment.project_html[name]
+            index.documents.update(fragment.search)
+
+    posts: List[PostBuildData] = [
+        post_build_data(post, site_build_dir) for post in posts_data
+    ]
+    content: ContentIndex = ContentIndex(posts)
+
+    thumbnails: Dict[str, ThumbnailSet] = build_thumbnails(
+        [
+            site_build_dir / image for image in (
+                *(post_thumbnail(post.data) for post in posts),
+                *(project_thumbnail(project) for project in projs_data)
+            )
+        ],
+        image_cache_dir,
+        site_build_dir,
+        jobs=jobs,
+        locate=AssetStore.load(site_build_dir, ASSETS_STATE_PATH).locate,
+        verbose=verbose
+    )
+
+    with span("blog", "merge"):
+        build_blog_page(content.by_date,
+                        templates,
+                        site_build_dir,
+                        posts_build_dir,
+                        thumbnails=thumbnails,
+                        blocks=blocks,
+                        page_size=page_size,
+                        writer=writer,
+                        verbose=verbose)
+        build_tags_pages(posts,
+                         templates=templates,
+                         site_build_dir=site_build_dir,
+                         post_build_dir=posts_build_dir,
+                         thumbnails=thumbnails,
+                         blocks=blocks,
+                         page_size=page_size,
+                         index=content,
+                         writer=writer,
+                         verbose=verbose)
+
+    with span("projects", "merge"):
+        proj_builds: List[ProjectBuildData] = [
+            write_project(
+                build_project_page_html(
+                    project,
+                    content,
+                    templates,
+                    site_build_dir=site_build_dir,
+                    post_build_dir=posts_build_dir,
+                    projects_build_dir=projects_build_dir,
+                    thumbnails=thumbnails,
+                    blocks=blocks,
+                    proj_html=project_html[project.directory],
+                    verbose=verbose
+                ),
+                site_build_dir,
+                projects_build_dir,
+                writer=writer,
+                verbose=verbose
+            )
+            for project in projs_data
+        ]
+        build_projects_page(
+            proj_builds,
+            templates,
+            site_build_dir,
+            projects_build_dir,
+            thumbnails=thumbnails,
+            writer=writer,
+            verbose=verbose
+        )
+
+    with span("search", "merge"):
+        write_search_index(
+            index,
+            site_build_dir,
+            writer=writer,
+            verbose=verbose
+        )
+    return posts
@@ -0,0 +1,128 @@
+// Client side of the post search, the index is written by
+// build_search_index in sitegen/build.py. index.json lists the posts and
+// the shards, each shard maps the terms starting with its prefix to
+// [post, score] pairs, so a query only fetches the shards of its words.
+
+const STOP_WORDS = new Set([
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from",
+    "has", "have", "in", "is", "it", "its", "of", "on", "or", "that", "the",
+    "this", "to", "was", "were", "which", "will", "with"
+]);
+
+const MIN_TERM_LENGTH = 2;
+const MAX_TERM_LENGTH = 32;
+const MAX_RESULTS = 20;
+
+// Mirrors sitegen.search.tokenize
+function tokenize(text) {
+    return (text.toLowerCase().match(/[\p{L}\p{N}]+/gu) || []).filter(
+        (word) => word.length >= MIN_TERM_LENGTH
+            && word.length <= MAX_TERM_LENGTH
+            && !STOP_WORDS.has(word)
+    );
+}
+
+class SearchIndex {
+    constructor(base) {
+        this.base = base;
+        this.index = null;
+        this.shards = new Map();
+    }
+
+    async manifest() {
+        if (this.index === null) {
+            const response = await fetch(this.base + "index.json");
+            this.index = await response.json();
+        }
+        return this.index;
+    }
+
+    shardName(term) {
+        const prefix = term.slice(0, this.index.prefix_length);
+        return /^[a-z0-9]+$/.test(prefix) ? prefix : "_";
+    }
+
+    async shard(name) {
+        if (!this.index.shards.includes(name)) {
+            return {};
+        }
+        if (!this.shards.has(name)) {
+            this.shards.set(
+                name,
+                fetch(this.base + name + ".json").then((r) => r.json())
+            );
+        }
+        return this.shards.get(name);
+    }
+
+    // Posts matching every word of the query, best first. The last word
+    // also matches longer terms, so results show up while typing.
+    async search(query) {
+        const terms = tokenize(query);
+        if (terms.length === 0) {
+            return [];
+        }
+        const index = await this.manifest();
+        let scores = null;
+        for (const [position, term] of terms.entries()) {
+            const shard = await this.shard(this.shardName(term));
+            const prefix = position === terms.length - 1;
+            const matches = new Map();
+            for (const [candidate, postings] of Object.entries(shard)) {
+                if (candidate !== term
+                    && !(prefix && candidate.startsWith(term))) {
+                    continue;
+                }
+                for (const [post, score] of postings) {
+                    matches.set(post, (matches.get(post) || 0) + score);
+                }
+            }
+            if (scores !== null) {
+                for (const post of [...matches.keys()]) {
+                    if (scores.has(post)) {
+                        matches.set(post, matches.get(post) + scores.get(post));
+                    } else {
+                        matches.delete(post);
+                    }
+                }
+            }
+            scores = matches;
+        }
+        return [...scores.entries()]
+            .sort((a, b) => b[1] - a[1])
+            .slice(0, MAX_RESULTS)
+            .map(([post]) => index.documents[post]);
+    }
+}
+
+function setupSearch(form) {
+    const base = form.dataset.index;
+    const root = base.replace(/[^/]+\/$/, "");
+    const index = new SearchIndex(base);
+    const input = form.querySelector("input");
+    const results = document.getElementById(form.dataset.results);
+
+    let latest = 0;
+    input.addEventListener("input", async () => {
+        const query = ++latest;
+        const found = await index.search(input.value);
+        if (query !== latest) {
+            return;
+        }
+        results.replaceChildren(...found.map((post) => {
+            const item = document.createElement("li");
+            const link = document.createElement("a");
+            link.href = root + post.link;
+            link.textContent = post.title;
+            const date = document.createElement("span");
+            date.className = "date";
+            date.textContent = post.date;
+            item.append(link, " ", date);
+            return item;
+        }));
+        results.hidden = input.value.trim() === "";
+    });
+    form.addEventListener("submit", (event) => event.preventDefault());
+}
+
+document.querySelectorAll("form.search").forEach(setupSearch);
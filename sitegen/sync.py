@@ -0,0 +1,319 @@
+from typing import (
+    Callable,
+    Dict,
+    Final,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple
+)
+
+import os
+
+from pathlib import Path
+
+import shutil
+
+import errno
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .compress import SIBLING_SUFFIXES
+from .manifest import hash_file
+
+
+LINK_ENV: Final[str] = 'SITEGEN_LINK_STATIC'
+SYNC_THREADS: Final[int] = min(8, (os.cpu_count() or 1) * 2)
+# ioctl number of FICLONE, which clones a file on btrfs, xfs and friends
+FICLONE: Final[int] = 0x40049409
+CHUNK_SIZE: Final[int] = 1 << 30
+
+# Errors that mean a copy strategy is not supported here rather than that
+# the copy went wrong
+_UNSUPPORTED: Final[Set[int]] = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSUP,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EPERM,
+    errno.EBADF,
+    errno.EMLINK
+}
+
+
+class SyncResult(NamedTuple):
+    copied: List[Path]
+    skipped: int
+    removed: List[Path]
+
+
+def link_static() -> bool:
+    r"""Whether `SITEGEN_LINK_STATIC` asks for static files to be hardlinked
+    into the build rather than copied.
+    """
+    return os.environ.get(LINK_ENV, "") not in ("", "0")
+
+
+def _reflink(src: Path, dest: Path) -> bool:
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+        try:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+        except OSError as error:
+            if error.errno in _UNSUPPORTED:
+                return False
+            raise
+    return True
+
+
+def _kernel_copy(src: Path, dest: Path) -> bool:
+    r"""Copies with `copy_file_range`, or `sendfile` where that is missing,
+    so the data never passes through Python.
+    """
+    size: int = src.stat().st_size
+    with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+        src_fd: int = src_file.fileno()
+        dest_fd: int = dest_file.fileno()
+        for copy in ("copy_file_range", "sendfile"):
+            if not hasattr(os, copy):
+                continue
+            offset: int = 0
+            try:
+                while offset < size:
+                    if copy == "copy_file_range":
+                        sent: int = os.copy_file_range(
+                            src_fd, dest_fd, min(CHUNK_SIZE, size - offset)
+                        )
+                    else:
+                        sent = os.sendfile(
+                            dest_fd, src_fd, offset, min(CHUNK_SIZE, size - offset)
+                        )
+                    if sent == 0:
+                        break
+                    offset += sent
+            except OSError as error:
+                if offset == 0 and error.errno in _UNSUPPORTED:
+                    continue
+                raise
+            if offset == size:
+                return True
+            # The source changed size under us, let a plain copy handle it
+            return False
+    return False
+
+
+def copy_file(src: Path, dest: Path, link: bool = False) -> str:
+    r"""Copies `src` to `dest` with the cheapest method the filesystem
+    supports, and returns which one was used.
+
+    With `link` the file is hardlinked when source and destination share a
+    filesystem. Otherwise it is reflinked where copy on write clones are
+    available, copied in the kernel with `copy_file_range` or `sendfile`,
+    and only as a last resort copied by `shutil`. The copy is written next
+    to `dest` and renamed over it, and keeps the source's mtime so later
+    syncs can tell it is up to date.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path: Path = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+
+    try:
+        if link:
+            try:
+                os.link(src, tmp_path)
+                os.replace(tmp_path, dest)
+                return "link"
+            except OSError as error:
+                if error.errno not in _UNSUPPORTED:
+                    raise
+        if _reflink(src, tmp_path):
+            method: str = "reflink"
+        elif _kernel_copy(src, tmp_path):
+            method = "kernel"
+        else:
+            shutil.copyfile(src, tmp_path)
+            method = "copy"
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dest)
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+    return method
+
+
+def transform_file(src: Path,
+                   dest: Path,
+                   transform: Callable[[bytes], bytes]) -> str:
+    r"""Writes `transform` of the contents of `src` to `dest`, with the
+    source's mtime so later syncs can tell it is up to date.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path: Path = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    with open(src, 'rb') as file:
+        data: bytes = transform(file.read())
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    shutil.copystat(src, tmp_path)
+    os.replace(tmp_path, dest)
+    return "transform"
+
+
+def up_to_date(src_stat: os.stat_result,
+               src: Path,
+               dest: Path,
+               checksum: bool = False,
+               transformed: bool = False) -> bool:
+    r"""Whether `dest` already holds `src`. Equal size and mtime are taken
+    as proof, with `checksum` files of equal size are compared by hash.
+    Files that are `transformed` on the way only compare mtimes.
+    """
+    try:
+        dest_stat: os.stat_result = dest.stat()
+    except FileNotFoundError:
+        return False
+    if transformed:
+        return dest_stat.st_mtime_ns == src_stat.st_mtime_ns
+    if dest_stat.st_size != src_stat.st_size:
+        return False
+    if dest_stat.st_mtime_ns == src_stat.st_mtime_ns:
+        return True
+    if checksum and hash_file(src) == hash_file(dest):
+        os.utime(dest, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        return True
+    return False
+
+
+def _scan(root: Path) -> Tuple[Dict[str, os.stat_result], Set[str]]:
+    files: Dict[str, os.stat_result] = {}
+    dirs: Set[str] = set()
+    if not root.is_dir():
+        return files, dirs
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir: str = os.path.relpath(dir_path, root)
+        for name in dir_names:
+            dirs.add(os.path.normpath(os.path.join(rel_dir, name)))
+        for name in file_names:
+            path: str = os.path.join(dir_path, name)
+            files[os.path.normpath(os.path.join(rel_dir, name))] = os.stat(path)
+    return files, dirs
+
+
+def sync_tree(src_dir: Path,
+              dest_dir: Path,
+              link: Optional[bool] = None,
+              checksum: bool = False,
+              threads: int = SYNC_THREADS,
+              transform: Optional[
+                  Callable[[str], Optional[Callable[[bytes], bytes]]]
+              ] = None,
+              moved: Optional[Dict[str, Tuple[int, int]]] = None,
+              verbose: bool = False) -> SyncResult:
+    r"""Makes `dest_dir` a copy of `src_dir`, only copying files that are
+    missing or changed and deleting whatever no longer exists in the source,
+    apart from the compressed siblings of files that still do.
+
+    Arguments
+    ---------
+
+    src_dir: Directory to copy from, `FileNotFoundError` is raised when it
+    does not exist
+
+    dest_dir: Directory to copy into, created if it does not exist
+
+    link: Hardlink files instead of copying them, defaults to `link_static()`
+
+    checksum: Compare files of equal size but different mtime by hash
+    before copying them
+
+    threads: Number of files copied at once
+
+    transform: Given a file suffix, returns a function rewriting the
+    contents of files with that suffix as they are copied, or `None`
+
+    moved: Files a later stage moved out of `dest_dir`, by path relative to
+    it, with the mtime and size they had. They count as present, so they
+    are only copied again once their source changes, and are listed as
+    removed once their source is gone.
+
+    """
+    if not src_dir.is_dir():
+        raise FileNotFoundError(f"No directory {src_dir} to copy from")
+    if link is None:
+        link = link_static()
+
+    if moved is None:
+        moved = {}
+
+    src_files, src_dirs = _scan(src_dir)
+    dest_files, dest_dirs = _scan(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+
+    transforms: Dict[str, Optional[Callable[[bytes], bytes]]] = {
+        name: transform(os.path.splitext(name)[1]) if transform else None
+        for name in src_files
+    }
+
+    def current(name: str, stat: os.stat_result) -> bool:
+        if name not in dest_files and name in moved:
+            mtime, size = moved[name]
+            return mtime == stat.st_mtime_ns \
+                and (transforms[name] is not None or size == stat.st_size)
+        return name in dest_files and up_to_date(
+            stat,
+            src_dir / name,
+            dest_dir / name,
+            checksum,
+            transforms[name] is not None
+        )
+
+    stale: List[str] = [
+        name for name, stat in src_files.items() if not current(name, stat)
+    ]
+
+    removed: List[Path] = []
+    for name in sorted((set(dest_files) | set(moved)) - set(src_files)):
+        base, suffix = os.path.splitext(name)
+        if suffix in SIBLING_SUFFIXES and base in src_files:
+            # Precompressed copy written by the compress stage
+            continue
+        if name in dest_files:
+            os.remove(dest_dir / name)
+        removed.append(dest_dir / name)
+    for name in sorted(dest_dirs - src_dirs, reverse=True):
+        path: Path = dest_dir / name
+        if path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+    for name in sorted(src_dirs):
+        (dest_dir / name).mkdir(exist_ok=True)
+
+    def copy(name: str) -> str:
+        if transforms[name] is not None:
+            return transform_file(
+                src_dir / name,
+                dest_dir / name,
+                transforms[name]
+            )
+        return copy_file(src_dir / name, dest_dir / name, link=link)
+
+    if threads > 1 and len(stale) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(copy, stale))
+    else:
+        for name in stale:
+            copy(name)
+
+    if verbose:
+        print(
+            f"Synced {src_dir} to {dest_dir}: {len(stale)} copied, "
+            f"{len(src_files) - len(stale)} unchanged, {len(removed)} removed"
+        )
+    return SyncResult(
+        [dest_dir / name for name in stale],
+        len(src_files) - len(stale),
+        removed
+    )
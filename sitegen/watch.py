@@ -0,0 +1,437 @@
+from typing import Any, Dict, Final, List, NamedTuple, Optional, Set, Tuple
+
+import os
+
+from pathlib import Path
+
+import ctypes
+import ctypes.util
+
+import select
+
+import struct
+
+import sys
+
+import time
+
+from . import build
+from .assets import AssetStore
+from .catalogue import MetadataCatalogue
+from .convert import ConversionCache, configure_pandoc, start_backend
+from .manifest import BuildManifest
+from .registry import TemplateRegistry
+from .sync import copy_file, link_static, transform_file
+from .writer import PageWriter, default_writer
+
+
+WATCH_DIRS: Final[Tuple[Path, ...]] = (
+    build.POSTS_DIR,
+    build.PROJS_DIR,
+    build.SRC_DIR,
+    build.TEMPLATE_DIR
+)
+
+DEBOUNCE_SECONDS: Final[float] = 0.1
+
+
+def ignored(path: Path) -> bool:
+    r"""Editor swap and backup files never trigger a rebuild."""
+    name: str = path.name
+    return name.startswith(".") or name.endswith("~") \
+        or name.endswith(".swp") or name == "4913"
+
+
+class PollingWatcher:
+    r"""Finds changed files by comparing `(mtime_ns, size)` snapshots of the
+    watched trees every `interval` seconds.
+    """
+
+    def __init__(self, roots: Tuple[Path, ...], interval: float = 0.5) -> None:
+        self.roots: Tuple[Path, ...] = roots
+        self.interval: float = interval
+        self.snapshot: Dict[str, Tuple[int, int]] = self.scan()
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot: Dict[str, Tuple[int, int]] = {}
+        stack: List[str] = [str(root) for root in self.roots]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    stat: os.stat_result = entry.stat()
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self) -> Set[Path]:
+        while True:
+            time.sleep(self.interval)
+            snapshot: Dict[str, Tuple[int, int]] = self.scan()
+            changed: Set[Path] = {
+                Path(path) for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            changed = {path for path in changed if not ignored(path)}
+            if changed:
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+# inotify(7) constants
+IN_MODIFY: Final[int] = 0x00000002
+IN_ATTRIB: Final[int] = 0x00000004
+IN_CLOSE_WRITE: Final[int] = 0x00000008
+IN_MOVED_FROM: Final[int] = 0x00000040
+IN_MOVED_TO: Final[int] = 0x00000080
+IN_CREATE: Final[int] = 0x00000100
+IN_DELETE: Final[int] = 0x00000200
+IN_ISDIR: Final[int] = 0x40000000
+IN_NONBLOCK: Final[int] = 0o4000
+IN_CLOEXEC: Final[int] = 0o2000000
+WATCH_MASK: Final[int] = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE \
+    | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER: Final[struct.Struct] = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    r"""Receives file change events from the Linux kernel through inotify,
+    called with ctypes so no extra dependency is needed. Every directory
+    under the roots gets a watch, directories created later are added as
+    they appear.
+    """
+
+    def __init__(self, roots: Tuple[Path, ...]) -> None:
+        libc_name: Optional[str] = ctypes.util.find_library("c")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd: int = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: Dict[int, Path] = {}
+        for root in roots:
+            self.add_tree(root)
+
+    def add_tree(self, root: Path) -> None:
+        for dir_path, _, _ in os.walk(root):
+            wd: int = self.libc.inotify_add_watch(
+                self.fd,
+                os.fsencode(dir_path),
+                WATCH_MASK
+            )
+            if wd >= 0:
+                self.dirs[wd] = Path(dir_path)
+
+    def read_events(self) -> Set[Path]:
+        changed: Set[Path] = set()
+        try:
+            data: bytes = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        offset: int = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name: bytes = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if wd not in self.dirs or not name:
+                continue
+            path: Path = self.dirs[wd] / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+                    changed.update(p for p in path.rglob("*") if p.is_file())
+                continue
+            if not ignored(path):
+                changed.add(path)
+        return changed
+
+    def wait(self) -> Set[Path]:
+        changed: Set[Path] = set()
+        while not changed:
+            select.select([self.fd], [], [])
+            changed |= self.read_events()
+        # Collect the rest of a burst of writes, e.g. an editor saving
+        while select.select([self.fd], [], [], DEBOUNCE_SECONDS)[0]:
+            changed |= self.read_events()
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def make_watcher(roots: Tuple[Path, ...] = WATCH_DIRS,
+                 polling: bool = False,
+                 interval: float = 0.5) -> Any:
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(roots, interval)
+
+
+class StaticCopy(NamedTuple):
+    src_root: Path
+    build_root: Path
+    path: Path
+
+
+class RebuildPlan(NamedTuple):
+    stages: Set[str]
+    copies: List[StaticCopy]
+    templates_changed: bool
+
+
+def _relative(path: Path, root: Path) -> Optional[Path]:
+    try:
+        return path.relative_to(root)
+    except ValueError:
+        return None
+
+
+def _document_static(json_path: Path,
+                     parse: Any) -> Optional[Tuple[Path, Path, Path]]:
+    r"""The static directory of the post or project described by
+    `json_path`, the output directory it is copied to and its thumbnail.
+    """
+    try:
+        data: Any = parse(json_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if data.static is None:
+        return None
+    return json_path.parent / data.static, data.directory, \
+        json_path.parent / data.thumbnail
+
+
+def template_stages(path: Path, manifest: BuildManifest) -> Set[str]:
+    r"""Stages writing an output the manifest recorded `path` as a
+    template of, directly or through an include, extends or import.
+    """
+    return {
+        build.GROUP_STAGES[manifest.entries[key]["group"]]
+        for key in manifest.dependents(path)
+    }
+
+
+def plan_rebuild(changed: Set[Path], manifest: BuildManifest) -> RebuildPlan:
+    r"""Works out which build stages a set of changed source files affects.
+
+    A template or page source only reruns the stages whose outputs the
+    manifest lists it as an input of. Static files are copied on their own,
+    except thumbnails which also rerun the stages listing them. A post or
+    project source only reruns its stage, where the manifest limits the
+    work to that one page, and only a changed post.json also reruns the
+    project stage whose listings depend on post metadata. Post changes
+    also update the search index.
+    """
+    stages: Set[str] = set()
+    copies: List[StaticCopy] = []
+    templates_changed: bool = False
+
+    for path in changed:
+        if (rel := _relative(path, build.TEMPLATE_DIR)) is not None:
+            templates_changed = True
+            stages.update(template_stages(path, manifest))
+        elif (rel := _relative(path, build.STATIC_DIR)) is not None:
+            copies.append(StaticCopy(build.STATIC_DIR, build.BUILD_DIR / "static", path))
+        elif (rel := _relative(path, build.GAMES_DIR)) is not None:
+            if rel.parts[0] in ("static", "scripts") and len(rel.parts) > 1:
+                copies.append(StaticCopy(
+                    build.GAMES_DIR / rel.parts[0],
+                    build.GAMES_BUILD_DIR / rel.parts[0],
+                    path
+                ))
+            else:
+                templates_changed = True
+                stages.update(template_stages(path, manifest) or {"games"})
+        elif _relative(path, build.SRC_DIR) is not None:
+            templates_changed = True
+            stages.update(template_stages(path, manifest) or {"pages"})
+        elif (rel := _relative(path, build.POSTS_DIR)) is not None:
+            if len(rel.parts) < 2:
+                continue
+            if rel.parts[1] == "post.json":
+                stages.update(("blog", "projects", "search"))
+                continue
+            static: Optional[Tuple[Path, Path, Path]] = _document_static(
+                build.POSTS_DIR / rel.parts[0] / "post.json",
+                lambda json_path : build.parse_post(json_path, build.POSTS_DIR)
+            )
+            if static is not None and _relative(path, static[0]) is not None:
+                copies.append(StaticCopy(
+                    static[0],
+                    build.POST_BUILD_DIR / static[1] / "static",
+                    path
+                ))
+                if path == static[2]:
+                    stages.update(("blog", "projects"))
+            else:
+                stages.update(("blog", "search"))
+        elif (rel := _relative(path, build.PROJS_DIR)) is not None:
+            if len(rel.parts) < 2:
+                continue
+            if rel.parts[1] == "proj.json":
+                stages.add("projects")
+                continue
+            static = _document_static(
+                build.PROJS_DIR / rel.parts[0] / "proj.json",
+                build.parse_proj
+            )
+            if static is not None and _relative(path, static[0]) is not None:
+                copies.append(StaticCopy(
+                    static[0],
+                    build.PROJS_BUILD_DIR / static[1] / "static",
+                    path
+                ))
+                if path == static[2]:
+                    stages.add("projects")
+            else:
+                stages.add("projects")
+
+    if stages or copies:
+        stages.update(("assets", "compress"))
+    return RebuildPlan(stages, copies, templates_changed)
+
+
+def copy_changed_static(copies: List[StaticCopy],
+                        manifest: BuildManifest,
+                        writer: Optional[PageWriter] = None,
+                        verbose: bool = False) -> None:
+    r"""Copies (or deletes) single static files, then updates the manifest
+    entry of their directory so the next full incremental build agrees
+    they are up to date. Deleted files fingerprinting already moved out of
+    the build are forgotten by the asset store.
+    """
+    roots: Set[Tuple[Path, Path]] = set()
+    deleted: List[Path] = []
+    for copy in copies:
+        dest: Path = copy.build_root / copy.path.relative_to(copy.src_root)
+        if copy.path.is_file():
+            if verbose:
+                print(f"Copying {copy.path} to {dest}")
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            transform: Optional[Any] = default_writer(writer).transform(
+                copy.path.suffix
+            )
+            if transform is not None:
+                transform_file(copy.path, dest, transform)
+            else:
+                copy_file(copy.path, dest, link=link_static())
+        else:
+            if dest.exists():
+                if verbose:
+                    print(f"Removing {dest}")
+                os.remove(dest)
+            deleted.append(dest)
+        roots.add((copy.src_root, copy.build_root))
+
+    if deleted:
+        AssetStore.load(build.BUILD_DIR, build.ASSETS_STATE_PATH).forget(
+            deleted
+        )
+
+    for src_root, build_root in roots:
+        group: Optional[str] = manifest.owner(build_root)
+        if group is not None:
+            manifest.record(build_root, manifest.inputs([src_root]), group)
+
+
+def watch(jobs: int = 1,
+          pandoc_mode: str = "auto",
+          polling: bool = False,
+          interval: float = 0.5,
+          minify: bool = False,
+          page_size: int = build.POSTS_PER_PAGE) -> None:
+    r"""Brings `site_out` up to date, then rebuilds the affected outputs
+    every time a source, template or static file changes. The pandoc
+    backend, conversion cache and manifest are kept for the whole session.
+    """
+    configure_pandoc()
+
+    writer: PageWriter = PageWriter(
+        minify=minify,
+        cache_dir=build.CACHE_DIR / "minify",
+        background=True
+    )
+    manifest: BuildManifest = build.load_manifest(
+        writer.settings(),
+        verbose=True
+    )
+    cache: ConversionCache = ConversionCache(build.CACHE_DIR / "pandoc")
+    templates: TemplateRegistry = TemplateRegistry(
+        build.TEMPLATE_DIR,
+        cache_dir=build.CACHE_DIR / "jinja"
+    )
+    catalogue: MetadataCatalogue = MetadataCatalogue(build.CATALOGUE_PATH)
+    backend: Optional[Any] = start_backend(pandoc_mode, verbose=True)
+    watcher: Any = make_watcher(polling=polling, interval=interval)
+
+    try:
+        build.build_site(
+            templates=templates,
+            manifest=manifest,
+            cache=cache,
+            backend=backend,
+            jobs=jobs,
+            writer=writer,
+            page_size=page_size,
+            catalogue=catalogue
+        )
+        manifest.save()
+        print(f"Watching for changes ({type(watcher).__name__})")
+
+        while True:
+            changed: Set[Path] = watcher.wait()
+            plan: RebuildPlan = plan_rebuild(changed, manifest)
+            start: float = time.perf_counter()
+
+            manifest.refresh()
+            if plan.templates_changed:
+                templates = TemplateRegistry(
+                    build.TEMPLATE_DIR,
+                    cache_dir=build.CACHE_DIR / "jinja"
+                )
+            copy_changed_static(plan.copies, manifest, writer, verbose=True)
+            try:
+                build.build_site(
+                    tuple(
+                        stage for stage in build.SITE_STAGES
+                        if stage in plan.stages
+                    ),
+                    templates=templates,
+                    manifest=manifest,
+                    cache=cache,
+                    backend=backend,
+                    jobs=jobs,
+                    writer=writer,
+                    page_size=page_size,
+                    catalogue=catalogue
+                )
+            except Exception as error:
+                # Keep watching, the next save will usually fix it
+                print(f"Build failed: {error}")
+                continue
+            manifest.save()
+
+            print(
+                f"Rebuilt {', '.join(sorted(plan.stages)) or 'static files'} "
+                f"for {len(changed)} changed files "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        catalogue.close()
+        writer.close()
+        if backend is not None:
+            backend.close()
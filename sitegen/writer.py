@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, Final, List, Optional
+
+import os
+
+from pathlib import Path
+
+import threading
+
+from .minify import MINIFIERS, MinifyCache, minify
+
+# The writer thread is only started by background writes
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# Pages a background writer holds at most before `write` waits for it
+MAX_PENDING_PAGES: Final[int] = 16
+
+
+class PageWriter:
+    r"""The one place rendered pages are written to the build directory.
+
+    Pages are written atomically, to a temporary file renamed over the
+    page, so a crash never leaves half a page behind. A page whose bytes
+    are already on disk is not written again, which keeps its mtime for
+    the caches and tools downstream. With `background` set `write` only
+    queues the page and a background thread renders and writes it while
+    the build carries on; `flush` waits for the queue and raises the first
+    error a write hit. Every queued page holds its whole text, so once
+    `max_pending` pages are waiting `write` blocks until the oldest is
+    written, keeping memory bounded when pages are rendered faster than
+    they are written.
+
+    With `minify` set pages are minified on the way out, and `transforms`
+    gives `sync_tree` the same treatment for static CSS and JavaScript.
+    Minified results are cached on disk by input hash when a `cache_dir` is
+    given.
+
+    Arguments
+    ---------
+
+    minify: Minify HTML pages and static CSS and JavaScript
+
+    cache_dir: Directory minified files are cached in, `None` disables it
+
+    background: Write pages on a background thread
+
+    max_pending: Pages queued at most on the background thread
+
+    """
+
+    def __init__(self,
+                 minify: bool = False,
+                 cache_dir: Optional[Path] = None,
+                 background: bool = False,
+                 max_pending: int = MAX_PENDING_PAGES) -> None:
+        self.minify: bool = minify
+        self.cache_dir: Optional[Path] = cache_dir
+        self.cache: Optional[MinifyCache] = None
+        if cache_dir is not None:
+            self.cache = MinifyCache(cache_dir)
+        self.background: bool = background
+        self.max_pending: int = max_pending
+        self.written: int = 0
+        self.unchanged: int = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: List[Future] = []
+        self._lock: threading.Lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Worker processes write their pages themselves, synchronously
+        return {"minify": self.minify, "cache_dir": self.cache_dir}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["minify"], state["cache_dir"])
+
+    def render(self, path: Path, text: str) -> str:
+        r"""The text written for a page at `path`."""
+        if not self.minify:
+            return text
+        return minify(text, path.suffix, self.cache)
+
+    def write(self, path: Path, text: str) -> None:
+        if not self.background:
+            self._write(path, text)
+            return
+        from concurrent.futures import ThreadPoolExecutor, wait
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="page-writer"
+            )
+        with self._lock:
+            # Written pages are dropped, failed ones kept for `flush`
+            self._pending = [
+                future for future in self._pending
+                if not future.done() or future.exception() is not None
+            ]
+            self._pending.append(self._executor.submit(self._write, path, text))
+            queued: List[Future] = [
+                future for future in self._pending if not future.done()
+            ]
+        if len(queued) > self.max_pending:
+            wait(queued[:len(queued) - self.max_pending])
+
+    def _write(self, path: Path, text: str) -> None:
+        data: bytes = self.render(path, text).encode('utf-8')
+        if same_bytes(path, data):
+            with self._lock:
+                self.unchanged += 1
+            return
+
+        tmp_path: Path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+        with self._lock:
+            self.written += 1
+
+    def flush(self) -> None:
+        r"""Waits until every queued page is written."""
+        with self._lock:
+            pending: List[Future] = self._pending
+            self._pending = []
+        for future in pending:
+            future.result()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def add_counts(self, written: int, unchanged: int) -> None:
+        r"""Counts pages written by a copy of this writer in a worker
+        process.
+        """
+        with self._lock:
+            self.written += written
+            self.unchanged += unchanged
+
+    def transform(self, suffix: str) -> Optional[Callable[[bytes], bytes]]:
+        r"""How static files with `suffix` are rewritten when copied, `None`
+        when they are copied as they are.
+        """
+        if not self.minify or suffix not in MINIFIERS:
+            return None
+        return lambda data : minify(
+            data.decode('utf-8'),
+            suffix,
+            self.cache
+        ).encode('utf-8')
+
+    def settings(self) -> Dict[str, Any]:
+        r"""Settings that change every output, kept in the build manifest."""
+        return {"minify": self.minify}
+
+
+def same_bytes(path: Path, data: bytes) -> bool:
+    r"""Whether the file at `path` holds exactly `data`."""
+    try:
+        if path.stat().st_size != len(data):
+            return False
+        with open(path, 'rb') as file:
+            return file.read() == data
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+
+def default_writer(writer: Optional[PageWriter] = None) -> PageWriter:
+    r"""Returns `writer`, or a writer that writes pages as rendered."""
+    if writer is None:
+        return PageWriter()
+    return writer